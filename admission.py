@@ -0,0 +1,93 @@
+from fastapi import HTTPException
+import logging
+import math
+import os
+import threading
+from scheduler import PRIORITY_FIRST_PART
+from segmenter import split_for_model
+
+logger = logging.getLogger(__name__)
+
+# Longest estimated wait for the first audio a new request may face before it is turned
+# away with 429; 0 disables admission control
+ADMISSION_MAX_WAIT_SECONDS = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "15"))
+# Weight of each new part in the running RTF and speech-rate averages
+ADMISSION_EWMA_ALPHA = float(os.environ.get("ADMISSION_EWMA_ALPHA", "0.2"))
+# Weight of each part rendered with nothing else in flight in the (slower moving) idle RTF
+ADMISSION_IDLE_RTF_ALPHA = float(os.environ.get("ADMISSION_IDLE_RTF_ALPHA", "0.05"))
+
+class AdmissionController:
+    # Estimates each job's run time as characters * audio seconds per character * RTF, both
+    # averaged over recently rendered parts, and charges it to the scheduler. A request whose
+    # first audio would come later than max_wait is rejected instead of making everyone slower.
+    # The wait is the queued work ahead of it plus the rest of every running job, then the first
+    # model call of the request's own job: parts and streams produce audio call by call.
+
+    def __init__(self, scheduler, max_wait: float = ADMISSION_MAX_WAIT_SECONDS, alpha: float = ADMISSION_EWMA_ALPHA,
+                 initial_rtf: float = 1.0, initial_seconds_per_char: float = 0.07, idle_alpha: float = ADMISSION_IDLE_RTF_ALPHA):
+        self.scheduler = scheduler
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self.idle_alpha = idle_alpha
+        self.rtf = initial_rtf
+        # RTF of parts that rendered alone, the uncontended baseline; None until one has
+        self.idle_rtf = None
+        self.seconds_per_char = initial_seconds_per_char
+        self.lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        # Parts observed; until the first one rtf and seconds_per_char are only the initial guesses
+        self.samples = 0
+
+    def observe(self, chars: int, synthesis_seconds: float, audio_seconds: float):
+        if chars <= 0 or audio_seconds <= 0:
+            return
+        rtf = synthesis_seconds / audio_seconds
+        # Called from the part's own scheduler job
+        alone = self.scheduler.ran_alone()
+        with self.lock:
+            self.rtf += self.alpha * (rtf - self.rtf)
+            if alone:
+                self.idle_rtf = rtf if self.idle_rtf is None else self.idle_rtf + self.idle_alpha * (rtf - self.idle_rtf)
+            self.seconds_per_char += self.alpha * (audio_seconds / chars - self.seconds_per_char)
+            self.samples += 1
+
+    def cost(self, text: str) -> float:
+        with self.lock:
+            return len(text) * self.seconds_per_char * self.rtf
+
+    def duration(self, text: str) -> float:
+        # Estimated seconds of audio
+        with self.lock:
+            return len(text) * self.seconds_per_char
+
+    def first_audio_cost(self, text: str) -> float:
+        # Run time of the first model call (one sentence, or piece of one); parts and streams
+        # both produce audio call by call, not at the end of the whole text
+        pieces = split_for_model(text)
+        return self.cost(pieces[0]) if pieces else 0.0
+
+    def admit(self, first_text: str, priority: int = PRIORITY_FIRST_PART):
+        # Raises 429 with Retry-After when the first audio would come too late
+        wait = self.scheduler.estimated_wait(priority)
+        delay = wait + self.first_audio_cost(first_text)
+        if self.max_wait and delay > self.max_wait:
+            with self.lock:
+                self.rejected += 1
+            retry_after = max(1, math.ceil(delay - self.max_wait))
+            logger.warning(f"Rejecting request, first audio in an estimated {delay:.1f}s ({wait:.1f}s behind queued and running work) is over the {self.max_wait:.0f}s budget")
+            raise HTTPException(status_code=429, detail="Server overloaded, try again later",
+                                headers={"Retry-After": str(retry_after)})
+        with self.lock:
+            self.admitted += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "max_wait_seconds": self.max_wait,
+                "rtf": round(self.rtf, 3),
+                "audio_seconds_per_char": round(self.seconds_per_char, 4),
+                "estimated_wait_seconds": round(self.scheduler.estimated_wait(), 2),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+import numpy as np
+from metrics import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_MB", "1024")) * 1024 * 1024
+
+def normalize_text(text: str) -> str:
+    # XTTS lowercases its input, and whitespace differences don't change the audio
+    return " ".join(unicodedata.normalize("NFC", text).split()).lower()
+
+class AudioCache:
+    # On-disk float32 waveforms keyed by normalized text, speaker, language and model version,
+    # evicted least-recently-used once the store grows past max_bytes
+
+    def __init__(self, model_version: str, cache_dir: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        self.model_version = model_version
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total_bytes += size
+        logger.info(f"Audio cache has {len(self.index)} entries ({self.total_bytes / 1e6:.1f} MB)")
+
+    def key_for(self, text: str, speaker_key: str, language: str, variant: str = "") -> str:
+        # variant tells apart renders with non-default generation settings (quality tiers)
+        fields = [normalize_text(text), speaker_key, language, self.model_version]
+        raw = "\0".join(fields + [variant] if variant else fields)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key: str):
+        with self.lock:
+            if key not in self.index:
+                return None
+            self.index.move_to_end(key)
+        try:
+            wav = np.load(self.path_for(key))
+            os.utime(self.path_for(key))
+            return wav
+        except (OSError, ValueError, EOFError) as e:
+            # ValueError/EOFError: a truncated or corrupt .npy; it would fail the same way on every lookup
+            logger.error(f"Dropping unreadable audio cache entry {key}: {e}")
+            with self.lock:
+                self.total_bytes -= self.index.pop(key, 0)
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+            return None
+
+    def put(self, key: str, wav: np.ndarray):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(wav, dtype=np.float32))
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        evicted = []
+        with self.lock:
+            self.total_bytes += size - self.index.pop(key, 0)
+            self.index[key] = size
+            while self.total_bytes > self.max_bytes and len(self.index) > 1:
+                old_key, old_size = self.index.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path_for(old_key))
+            except OSError:
+                pass
+
+    def get_or_create(self, key: str, create) -> np.ndarray:
+        # Single flight: concurrent callers for the same key wait for one create() call
+        wav = self.get(key)
+        if wav is not None:
+            with self.lock:
+                self.hits += 1
+            CACHE_LOOKUPS.labels("audio", "hit").inc()
+            return wav
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        CACHE_LOOKUPS.labels("audio", "miss" if leader else "coalesced").inc()
+        if not leader:
+            return future.result()
+        try:
+            wav = create()
+            try:
+                self.put(key, wav)
+            except OSError as e:
+                logger.error(f"Failed to store audio cache entry {key}: {e}")
+            future.set_result(wav)
+            return wav
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self.index),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
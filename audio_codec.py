@@ -0,0 +1,88 @@
+import io
+import math
+import os
+import struct
+from typing import NamedTuple
+import numpy as np
+import soundfile as sf
+
+class AudioFormat(NamedTuple):
+    sf_format: str
+    subtype: str
+    media_type: str
+    extension: str
+    lossy: bool
+
+AUDIO_FORMATS = {
+    "wav": AudioFormat("WAV", "PCM_16", "audio/wav", "wav", False),
+    "flac": AudioFormat("FLAC", "PCM_16", "audio/flac", "flac", False),
+    "opus": AudioFormat("OGG", "OPUS", "audio/ogg", "opus", True),
+    "mp3": AudioFormat("MP3", "MPEG_LAYER_III", "audio/mpeg", "mp3", True),
+}
+
+# Format for /initialize-voice parts when the client doesn't ask for one; bitrate only applies to opus/mp3
+AUDIO_FORMAT = os.environ.get("AUDIO_FORMAT", "wav")
+AUDIO_BITRATE_KBPS = int(os.environ.get("AUDIO_BITRATE_KBPS", "32"))
+
+def media_type_for(file_name: str) -> str:
+    extension = os.path.splitext(file_name)[1].lstrip(".")
+    for fmt in AUDIO_FORMATS.values():
+        if fmt.extension == extension:
+            return fmt.media_type
+    return "application/octet-stream"
+
+def float_to_pcm16(wav: np.ndarray) -> bytes:
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def streaming_wav_header(sample_rate: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    # RIFF/data sizes are unknown while streaming; 0xFFFFFFFF tells players to read until EOF
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+def bitrate_range(audio_format: str, sample_rate: int) -> tuple:
+    # kbps libsndfile spans between compression_level 1.0 and 0.0. MP3 at 24 kHz is
+    # MPEG-2 layer III, which tops out at 160 kbps.
+    if audio_format == "opus":
+        return 6, 256
+    if sample_rate >= 32000:
+        return 32, 320
+    return 8, 160
+
+def compression_level(audio_format: str, sample_rate: int, bitrate_kbps: int) -> float:
+    # libsndfile has no bitrate setting; it maps compression_level linearly onto the bitrate range
+    low, high = bitrate_range(audio_format, sample_rate)
+    bitrate_kbps = min(max(bitrate_kbps, low), high)
+    return (high - bitrate_kbps) / (high - low)
+
+def encode_audio(wav: np.ndarray, sample_rate: int, audio_format: str = AUDIO_FORMAT, bitrate_kbps: int = AUDIO_BITRATE_KBPS) -> bytes:
+    # Encode a float waveform straight to bytes, no file round trip
+    fmt = AUDIO_FORMATS[audio_format]
+    kwargs = {}
+    if fmt.lossy and bitrate_kbps:
+        kwargs["compression_level"] = compression_level(audio_format, sample_rate, bitrate_kbps)
+        if audio_format == "mp3":
+            kwargs["bitrate_mode"] = "CONSTANT"
+    buffer = io.BytesIO()
+    sf.write(
+        buffer, np.clip(wav, -1.0, 1.0).astype(np.float32), sample_rate,
+        format=fmt.sf_format, subtype=fmt.subtype, **kwargs,
+    )
+    return buffer.getvalue()
+
+def decode_audio(source) -> np.ndarray:
+    # Encoded bytes or a file path back to a mono float32 waveform
+    wav, _ = sf.read(io.BytesIO(source) if isinstance(source, bytes) else source, dtype="float32", always_2d=True)
+    return wav.mean(axis=1)
+
+def resample(wav: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    if target_rate == sample_rate:
+        return wav
+    # scipy comes in with TTS
+    from scipy.signal import resample_poly
+    g = math.gcd(sample_rate, target_rate)
+    return resample_poly(wav, target_rate // g, sample_rate // g).astype(np.float32)
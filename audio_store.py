@@ -0,0 +1,110 @@
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+import logging
+import os
+import threading
+from audio_codec import media_type_for
+
+logger = logging.getLogger(__name__)
+
+AUDIO_STORE_MAX_BYTES = int(os.environ.get("AUDIO_STORE_MEMORY_MB", "256")) * 1024 * 1024
+
+class AudioStore:
+    # Encoded parts by file name. They are served from memory; once the memory budget is
+    # used up, new parts spill to files in spill_dir instead. A shared store writes every
+    # part to spill_dir, so other API processes on the host can serve it too.
+
+    def __init__(self, spill_dir: str = "outputs", max_memory_bytes: int = AUDIO_STORE_MAX_BYTES, shared: bool = False):
+        self.spill_dir = spill_dir
+        self.max_memory_bytes = 0 if shared else max_memory_bytes
+        self.shared = shared
+        # name -> (bytes, or None when spilled, media_type)
+        self.entries = {}
+        self.memory_bytes = 0
+        self.spilled = 0
+        self.lock = threading.Lock()
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.spill_dir, name)
+
+    def put(self, name: str, data: bytes, media_type: str):
+        self.remove(name)
+        with self.lock:
+            if self.memory_bytes + len(data) <= self.max_memory_bytes:
+                self.entries[name] = (data, media_type)
+                self.memory_bytes += len(data)
+                return
+        path = self.path_for(name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.entries[name] = (None, media_type)
+            self.spilled += 1
+
+    def get(self, name: str):
+        # (bytes or None, path or None, media_type), or None if unknown
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None:
+            # Written by another process
+            path = self.path_for(name)
+            if self.shared and os.path.basename(name) == name and os.path.isfile(path):
+                return None, path, media_type_for(name)
+            return None
+        data, media_type = entry
+        return data, None if data is not None else self.path_for(name), media_type
+
+    def remove(self, name: str):
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is not None and entry[0] is not None:
+                self.memory_bytes -= len(entry[0])
+        if (entry is None and self.shared) or (entry is not None and entry[0] is None):
+            try:
+                os.remove(self.path_for(name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "memory_bytes": self.memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "spilled": self.spilled,
+            }
+
+def byte_range(range_header: str, size: int):
+    # Single "bytes=start-end" range, as media players send when seeking; None means whole body
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), min(int(end) if end else size - 1, size - 1)
+        else:
+            start, end = max(size - int(end), 0), size - 1
+    except ValueError:
+        return None
+    if start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def serve_audio(audio_store: AudioStore, name: str, range_header: str = None):
+    entry = audio_store.get(name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    data, path, media_type = entry
+    if data is None:
+        # FileResponse handles Range itself
+        return FileResponse(path, media_type=media_type)
+    headers = {"Accept-Ranges": "bytes"}
+    span = byte_range(range_header, len(data))
+    if span is None:
+        return Response(data, media_type=media_type, headers=headers)
+    start, end = span
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
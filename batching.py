@@ -0,0 +1,154 @@
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+from xtts_inference import get_xtts, generation_settings, gpt_lock, inference_batch, join_sentence_wavs, split_sentences
+
+logger = logging.getLogger(__name__)
+
+BATCHING_ENABLED = os.environ.get("BATCHING_ENABLED", "0") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+BATCH_WAIT_MS = float(os.environ.get("BATCH_WAIT_MS", "20"))
+# Rows are right-padded with the stop token and decoded without an attention mask, so a short
+# sentence batched with much longer ones decodes differently than alone. A batch's longest
+# sentence may have at most this many times the text tokens of its shortest.
+BATCH_MAX_LENGTH_RATIO = float(os.environ.get("BATCH_MAX_LENGTH_RATIO", "1.5"))
+
+def length_buckets(items: list, lengths: list, max_ratio: float = BATCH_MAX_LENGTH_RATIO) -> list:
+    # Sorts items by length and cuts wherever the longest would exceed max_ratio x the shortest
+    buckets, current, shortest = [], [], 0
+    for length, item in sorted(zip(lengths, items), key=lambda pair: pair[0]):
+        if current and length > max_ratio * max(shortest, 1):
+            buckets.append(current)
+            current = []
+        if not current:
+            shortest = length
+        current.append(item)
+    if current:
+        buckets.append(current)
+    return buckets
+
+class BatchingEngine:
+    # Collects sentences from concurrent requests for a short window and synthesizes
+    # those sharing a speaker, language and tier, and of similar token length, as one
+    # padded batch on a single model thread
+
+    def __init__(self, tts_model, max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_WAIT_MS,
+                 max_length_ratio: float = BATCH_MAX_LENGTH_RATIO):
+        self.tts_model = tts_model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_length_ratio = max_length_ratio
+        self.pending = queue.Queue()
+        self.batch_sizes = Counter()
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.batch_loop, name="batching-engine", daemon=True)
+        self.thread.start()
+        logger.info(f"Batching engine started (max batch {self.max_batch_size}, window {self.max_wait * 1000:.0f} ms)")
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def submit(self, sentence: str, language: str, speaker_key: str, latents, tier=None) -> Future:
+        future = Future()
+        self.pending.put((future, sentence, language, speaker_key, latents, tier))
+        return future
+
+    def synthesize(self, text: str, language: str, speaker_key: str, latents, tier=None) -> np.ndarray:
+        # Blocking, like xtts_inference.synthesize; sentences of one part can share a batch too
+        sentences = split_sentences(self.tts_model, text, language)
+        futures = [self.submit(s, language, speaker_key, latents, tier) for s in sentences]
+        return join_sentence_wavs([f.result() for f in futures])
+
+    def mean_batch_size(self) -> float:
+        # Sentences decoded per gpt.generate call so far; 1 until the first batch
+        with self.stats_lock:
+            batches = sum(self.batch_sizes.values())
+            return sum(size * count for size, count in self.batch_sizes.items()) / batches if batches else 1.0
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            batches = sum(self.batch_sizes.values())
+            items = sum(size * count for size, count in self.batch_sizes.items())
+            return {
+                "batches": batches,
+                "mean_batch_size": items / batches if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            }
+
+    def collect(self):
+        first = self.pending.get()
+        if first is None:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def batch_loop(self):
+        while True:
+            batch, stopping = self.collect()
+            if batch:
+                groups = defaultdict(list)
+                for item in batch:
+                    # Only sentences with the same speaker, language and sampling settings share a batch
+                    groups[(item[3], item[2], item[5])].append(item)
+                for (_, language, tier), items in groups.items():
+                    lengths = [self.token_count(item[1], language) for item in items]
+                    for bucket in length_buckets(items, lengths, self.max_length_ratio):
+                        self.run_group(bucket, language, tier)
+            if stopping:
+                break
+
+    def token_count(self, sentence: str, language: str) -> int:
+        # Same encoding inference_batch pads
+        return len(get_xtts(self.tts_model).tokenizer.encode(sentence.strip().lower(), lang=language.split("-")[0]))
+
+    def run_group(self, items: list, language: str, tier=None):
+        items = [item for item in items if item[0].set_running_or_notify_cancel()]
+        if not items:
+            return
+        gpt_cond_latent, speaker_embedding = items[0][4]
+        sentences = [item[1] for item in items]
+        with self.stats_lock:
+            self.batch_sizes[len(items)] += 1
+        logger.debug(f"Running batch of {len(items)} sentences ({language})")
+        try:
+            if len(items) == 1:
+                with gpt_lock(self.tts_model):
+                    out = get_xtts(self.tts_model).inference(
+                        sentences[0], language, gpt_cond_latent, speaker_embedding, **generation_settings(self.tts_model, tier)
+                    )
+                wavs = [np.asarray(out["wav"], dtype=np.float32)]
+            else:
+                wavs = inference_batch(self.tts_model, sentences, language, gpt_cond_latent, speaker_embedding, tier)
+        except Exception as e:
+            logger.error(f"Batched inference of {len(items)} sentences failed: {e}")
+            for item in items:
+                item[0].set_exception(e)
+            return
+        for item, wav in zip(items, wavs):
+            item[0].set_result(wav)
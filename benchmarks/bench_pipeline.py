@@ -0,0 +1,71 @@
+# Sequential vs pipelined (GPT || vocoder) synthesis of the same multi-sentence texts.
+#
+#   python -m benchmarks.bench_pipeline --speaker sounds/sound4.wav
+#   python -m benchmarks.bench_pipeline --speaker sounds/sound4.wav --gpt-threads 4 --vocoder-threads 12
+#
+# Run from the repository root. Both modes render the corpus part by part with --parts-in-flight
+# parts submitted at a time, as the API's scheduler workers would. The report shows audio
+# seconds per wall second, the speedup, and each pipeline stage's utilization; a stage near
+# 1.0 is the bottleneck, so move threads towards it.
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import time
+import torch
+from pipeline import PipelinedSynthesizer, PIPELINE_GPT_THREADS, PIPELINE_VOCODER_THREADS, PIPELINE_QUEUE_SIZE
+from tts_engine import get_model
+from xtts_inference import compute_conditioning_latents, get_sample_rate, synthesize
+
+CORPUS = [
+    "يسعدنا تواصلك معنا. سيتم تحويل مكالمتك إلى أول موظف متاح. يرجى البقاء على الخط.",
+    "يرجى الاستماع إلى الخيارات التالية بعناية. للاستفسار عن الرصيد اضغط واحد. وللتحدث مع خدمة العملاء اضغط صفر.",
+    "نود إعلامكم بأن ساعات العمل خلال شهر رمضان ستكون من التاسعة صباحًا حتى الثالثة عصرًا. شكرًا لاستخدامك خدماتنا.",
+]
+
+def run(render, texts: list, parts_in_flight: int, sample_rate: int) -> dict:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=parts_in_flight) as pool:
+        wavs = list(pool.map(render, texts))
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(len(w) for w in wavs) / sample_rate
+    return {"elapsed": elapsed, "audio_seconds": audio_seconds, "audio_s_per_s": audio_seconds / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipelined GPT/vocoder synthesis")
+    parser.add_argument("--speaker", required=True, help="reference wav")
+    parser.add_argument("--repeat", type=int, default=2, help="passes over the corpus")
+    parser.add_argument("--parts-in-flight", type=int, default=2)
+    parser.add_argument("--gpt-threads", type=int, default=PIPELINE_GPT_THREADS)
+    parser.add_argument("--vocoder-threads", type=int, default=PIPELINE_VOCODER_THREADS)
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    tts_model = get_model()
+    sample_rate = get_sample_rate(tts_model)
+    latents = compute_conditioning_latents(tts_model, args.speaker)
+    texts = CORPUS * args.repeat
+    # Warm both paths so neither pays for lazy init
+    synthesize(tts_model, CORPUS[0], "ar", *latents)
+
+    # Sequential runs get every core, as without the pipeline
+    torch.set_num_threads(args.gpt_threads + args.vocoder_threads)
+    sequential = run(lambda text: synthesize(tts_model, text, "ar", *latents), texts, args.parts_in_flight, sample_rate)
+
+    pipeline = PipelinedSynthesizer(tts_model, args.gpt_threads, args.vocoder_threads, args.queue_size)
+    pipeline.start()
+    pipeline.synthesize(CORPUS[0], "ar", latents)
+    pipeline.stop()
+    pipeline = PipelinedSynthesizer(tts_model, args.gpt_threads, args.vocoder_threads, args.queue_size)
+    pipeline.start()
+    pipelined = run(lambda text: pipeline.synthesize(text, "ar", latents), texts, args.parts_in_flight, sample_rate)
+    stats = pipeline.stats()
+    pipeline.stop()
+
+    for name, result in (("sequential", sequential), ("pipelined", pipelined)):
+        print(f"{name:>10}: {result['audio_seconds']:.1f}s audio in {result['elapsed']:.1f}s, {result['audio_s_per_s']:.2f} audio s/s")
+    print(f"   speedup: {pipelined['audio_s_per_s'] / sequential['audio_s_per_s']:.2f}x")
+    for stage in ("gpt", "vocoder"):
+        print(f"{stage:>10}: {stats[stage]['threads']} threads, utilization {stats[stage]['utilization']:.2f}")
+    print(f"gpt blocked on vocoder: {stats['gpt']['blocked_seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
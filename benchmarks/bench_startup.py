@@ -0,0 +1,99 @@
+# Cold-start cost of loading through the model manager vs the memory-mapped snapshot.
+#
+#   python model_snapshot.py export
+#   python -m benchmarks.bench_startup --speaker sounds/sound4.wav --runs 3
+#
+# Run from the repository root. Every run is a fresh interpreter and reports
+#   import_s       importing torch, TTS and the engine
+#   load_s         get_model() until the model object exists
+#   first_audio_s  the first synthesis, where lazily mapped weight pages get read in
+#   ready_s        process start until the first audio, what an autoscaled replica waits for
+#   peak_rss_mb    peak resident set size of the process
+# --drop-caches (root only) empties the page cache before each run so the weights come
+# from disk, as on a freshly scheduled node.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+SOURCES = ("hub", "snapshot")
+TEXT = "مرحبًا! هذا مثال لاختبار تحويل النص إلى كلام."
+
+def child(source: str, speaker_wav: str):
+    import resource
+    start = time.perf_counter()
+    from tts_engine import get_model
+    from xtts_inference import compute_conditioning_latents, synthesize
+    imported = time.perf_counter()
+    tts_model = get_model(device="cpu", progress_bar=False)
+    loaded = time.perf_counter()
+    synthesize(tts_model, TEXT, "ar", *compute_conditioning_latents(tts_model, speaker_wav))
+    done = time.perf_counter()
+    print(json.dumps({
+        "source": source,
+        "import_s": imported - start,
+        "load_s": loaded - imported,
+        "first_audio_s": done - loaded,
+        "ready_s": done - start,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+def drop_caches():
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+def run(source: str, speaker_wav: str, snapshot_dir: str) -> dict:
+    env = dict(os.environ, TTS_BACKEND="xtts", TTS_PRECISION="fp32", MODEL_SNAPSHOT_DIR=snapshot_dir if source == "snapshot" else "")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child", source, "--speaker", speaker_wav],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model load paths: time to first audio and peak RSS")
+    parser.add_argument("--speaker", required=True, help="reference wav")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--snapshot-dir", default="model_snapshot")
+    parser.add_argument("--sources", nargs="+", default=list(SOURCES), choices=SOURCES)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--child", choices=SOURCES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.speaker)
+        return
+    if "snapshot" in args.sources and not os.path.exists(os.path.join(args.snapshot_dir, "snapshot.json")):
+        raise SystemExit(f"No snapshot in {args.snapshot_dir}, run: python model_snapshot.py export --out {args.snapshot_dir}")
+
+    results = {}
+    for i in range(args.runs):
+        # Alternate sources so neither always runs on a warmer machine
+        for source in args.sources if i % 2 == 0 else reversed(args.sources):
+            if args.drop_caches:
+                drop_caches()
+            print(f"Run {i + 1}/{args.runs}: {source}...", flush=True)
+            results.setdefault(source, []).append(run(source, args.speaker, args.snapshot_dir))
+
+    keys = ("import_s", "load_s", "first_audio_s", "ready_s", "peak_rss_mb")
+    summary = {source: {key: float(np.median([r[key] for r in runs])) for key in keys} for source, runs in results.items()}
+    print(f"\n{'source':>10}" + "".join(f"{key:>15}" for key in keys))
+    for source, row in summary.items():
+        print(f"{source:>10}" + "".join(f"{row[key]:>15.2f}" for key in keys))
+    if "hub" in summary and "snapshot" in summary:
+        hub, snap = summary["hub"], summary["snapshot"]
+        print(f"\nsnapshot: load {hub['load_s'] / snap['load_s']:.1f}x faster, "
+              f"ready {hub['ready_s'] - snap['ready_s']:.1f}s sooner, "
+              f"peak RSS {hub['peak_rss_mb'] - snap['peak_rss_mb']:.0f} MB lower")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"median": summary, "runs": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
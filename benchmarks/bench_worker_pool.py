@@ -0,0 +1,63 @@
+# Throughput and memory of the multi-process worker pool as the worker count grows.
+#
+#   python -m benchmarks.bench_worker_pool --speaker sounds/sound4.wav --workers 1 2 4 8
+#
+# Run from the repository root. Each pool size renders the same corpus; the report
+# shows audio seconds per wall second, speedup over one worker, and total PSS of the
+# worker processes (snapshot pages mapped by several workers are split across them).
+import argparse
+import time
+from segmenter import split_for_model
+from tts_engine import model_version
+from worker_pool import WorkerPool
+
+CORPUS = [
+    "مرحبًا! هذا مثال لاختبار تحويل النص إلى كلام.",
+    "يسعدنا تواصلك معنا، سيتم تحويل مكالمتك إلى أول موظف متاح.",
+    "يرجى الاستماع إلى الخيارات التالية بعناية، فقد تغيرت قائمتنا مؤخرًا.",
+    "شكرًا لاستخدامك خدماتنا، نتمنى لك يومًا سعيدًا.",
+]
+
+def pss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+def run(num_workers: int, speaker_wav: str, sentences: list) -> dict:
+    # Each worker loads its own model after the fork, so nothing is loaded here
+    pool = WorkerPool(model_version(), num_workers=num_workers, device="cpu")
+    pool.start()
+    pool.wait_ready()
+    start = time.perf_counter()
+    futures = [pool.submit(s, "ar", speaker_wav) for s in sentences]
+    wavs = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+    pss = sum(pss_kb(p.pid) for p in pool.processes)
+    pool.stop()
+    audio_seconds = sum(len(w) for w in wavs) / pool.sample_rate
+    return {"workers": num_workers, "elapsed": elapsed, "audio_seconds": audio_seconds, "pss_mb": pss / 1024}
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker pool scaling benchmark")
+    parser.add_argument("--speaker", required=True, help="reference wav")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=8, help="copies of the corpus per run")
+    args = parser.parse_args()
+
+    sentences = [p for text in CORPUS * args.repeat for p in split_for_model(text)]
+
+    baseline = None
+    print(f"{'workers':>7} {'wall s':>8} {'audio s/s':>10} {'speedup':>8} {'RTF':>6} {'PSS MB':>8}")
+    for num_workers in args.workers:
+        r = run(num_workers, args.speaker, sentences)
+        throughput = r["audio_seconds"] / r["elapsed"]
+        baseline = baseline or throughput
+        print(
+            f"{r['workers']:>7} {r['elapsed']:>8.1f} {throughput:>10.2f} {throughput / baseline:>8.2f}"
+            f" {r['elapsed'] / r['audio_seconds']:>6.2f} {r['pss_mb']:>8.0f}"
+        )
+
+if __name__ == "__main__":
+    main()
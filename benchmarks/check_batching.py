@@ -0,0 +1,76 @@
+# Checks that cross-request batching doesn't change what a sentence renders to, by its length.
+#
+#   python -m benchmarks.check_batching --speaker sounds/sound4.wav
+#   python -m benchmarks.check_batching --speaker sounds/sound4.wav --runs 5 --tolerance 0.2
+#
+# Run from the repository root. A corpus of short and long sentences is rendered one sentence
+# at a time, then submitted all at once to BatchingEngine (so they share batches), once with
+# length bucketing (BATCH_MAX_LENGTH_RATIO) and once without. Sampling is random, so each
+# sentence's duration is averaged over --runs. The report shows each sentence's batched/single
+# duration ratio; short sentences padded next to long ones drift furthest. Exits 1 if a
+# bucketed ratio is off by more than --tolerance.
+import argparse
+import sys
+import numpy as np
+import torch
+from batching import BatchingEngine, BATCH_MAX_LENGTH_RATIO
+from tts_engine import get_model
+from xtts_inference import compute_conditioning_latents, get_sample_rate, synthesize
+
+CORPUS = [
+    "مرحبًا.",
+    "شكرًا لك.",
+    "يرجى الانتظار قليلًا.",
+    "يسعدنا تواصلك معنا، سيتم تحويل مكالمتك إلى أول موظف متاح.",
+    "يرجى الاستماع إلى الخيارات التالية بعناية، فقد تغيرت قائمتنا مؤخرًا.",
+    "نود إعلامكم بأن ساعات العمل خلال شهر رمضان ستكون من التاسعة صباحًا حتى الثالثة عصرًا يوميًا.",
+]
+
+def single_durations(tts_model, latents, sample_rate: int) -> np.ndarray:
+    return np.array([len(synthesize(tts_model, s, "ar", *latents)) / sample_rate for s in CORPUS])
+
+def batched_durations(tts_model, latents, sample_rate: int, max_length_ratio: float) -> tuple:
+    engine = BatchingEngine(tts_model, max_batch_size=len(CORPUS), max_wait_ms=500, max_length_ratio=max_length_ratio)
+    engine.start()
+    try:
+        futures = [engine.submit(s, "ar", "check", latents) for s in CORPUS]
+        durations = np.array([len(f.result()) / sample_rate for f in futures])
+    finally:
+        engine.stop()
+    return durations, engine.stats()["batch_size_histogram"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare batched and single-sentence output lengths")
+    parser.add_argument("--speaker", required=True, help="reference wav")
+    parser.add_argument("--runs", type=int, default=3, help="renders averaged per sentence and mode")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed |ratio - 1| with bucketing")
+    parser.add_argument("--max-length-ratio", type=float, default=BATCH_MAX_LENGTH_RATIO)
+    args = parser.parse_args()
+
+    tts_model = get_model()
+    sample_rate = get_sample_rate(tts_model)
+    latents = compute_conditioning_latents(tts_model, args.speaker)
+    synthesize(tts_model, CORPUS[0], "ar", *latents)  # warm-up, not compared
+
+    single, bucketed, unbucketed = [], [], []
+    for run in range(args.runs):
+        torch.manual_seed(run)
+        single.append(single_durations(tts_model, latents, sample_rate))
+        durations, bucketed_batches = batched_durations(tts_model, latents, sample_rate, args.max_length_ratio)
+        bucketed.append(durations)
+        durations, unbucketed_batches = batched_durations(tts_model, latents, sample_rate, float("inf"))
+        unbucketed.append(durations)
+    single = np.mean(single, axis=0)
+    bucketed_ratio = np.mean(bucketed, axis=0) / single
+    unbucketed_ratio = np.mean(unbucketed, axis=0) / single
+
+    print(f"batch sizes: bucketed {bucketed_batches}, unbucketed {unbucketed_batches}")
+    print(f"{'chars':>6} {'single_s':>9} {'bucketed':>9} {'unbucketed':>11}")
+    for sentence, seconds, b, u in zip(CORPUS, single, bucketed_ratio, unbucketed_ratio):
+        print(f"{len(sentence):>6} {seconds:>9.2f} {b:>9.2f} {u:>11.2f}")
+    worst = float(np.max(np.abs(bucketed_ratio - 1)))
+    print(f"worst bucketed deviation {worst:.2f} (tolerance {args.tolerance:.2f})")
+    sys.exit(1 if worst > args.tolerance else 0)
+
+if __name__ == "__main__":
+    main()
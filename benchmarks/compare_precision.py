@@ -0,0 +1,117 @@
+# Quality/latency report for the CPU inference modes (TTS_PRECISION).
+#
+#   python -m benchmarks.compare_precision --speaker sounds/sound4.wav --out precision_report
+#
+# Run from the repository root. Every mode renders the same corpus with the same seeds in
+# its own subprocess, so peak RSS is measured per mode. Outputs are compared against fp32:
+#   rtf        wall time / audio time (lower is faster)
+#   peak_rss   max resident set size of the process, MB
+#   mel_dtw    mean log-mel distance after DTW alignment (0 = identical)
+#   mfcc_cos   cosine similarity of mean MFCC vectors (1 = identical timbre)
+#   dur_ratio  audio duration relative to fp32
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+CORPUS = [
+    "مرحبًا! هذا مثال لاختبار تحويل النص إلى كلام.",
+    "يسعدنا تواصلك معنا، سيتم تحويل مكالمتك إلى أول موظف متاح.",
+    "يرجى الاستماع إلى الخيارات التالية بعناية، فقد تغيرت قائمتنا مؤخرًا.",
+    "للاستفسار عن الرصيد اضغط واحد، وللتحدث مع خدمة العملاء اضغط صفر.",
+    "شكرًا لاستخدامك خدماتنا، نتمنى لك يومًا سعيدًا.",
+]
+
+def render(precision: str, speaker_wav: str, out_dir: str):
+    # Runs in a subprocess: load one precision, render the corpus, write wavs + timings
+    import torch
+    from scipy.io import wavfile
+    from tts_engine import get_model
+    from xtts_inference import compute_conditioning_latents, get_sample_rate, synthesize
+
+    tts_model = get_model(device="cpu", precision=precision, progress_bar=False)
+    sample_rate = get_sample_rate(tts_model)
+    latents = compute_conditioning_latents(tts_model, speaker_wav)
+    synthesize(tts_model, CORPUS[0], "ar", *latents)  # warm-up, not timed
+
+    os.makedirs(out_dir, exist_ok=True)
+    elapsed, audio_seconds = 0.0, 0.0
+    for i, text in enumerate(CORPUS):
+        torch.manual_seed(i)
+        start = time.perf_counter()
+        wav = synthesize(tts_model, text, "ar", *latents)
+        elapsed += time.perf_counter() - start
+        audio_seconds += len(wav) / sample_rate
+        wavfile.write(os.path.join(out_dir, f"{i}.wav"), sample_rate, wav.astype(np.float32))
+    stats = {
+        "precision": precision,
+        "rtf": elapsed / audio_seconds,
+        "audio_seconds": audio_seconds,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    with open(os.path.join(out_dir, "stats.json"), "w") as f:
+        json.dump(stats, f)
+
+def similarity(reference_path: str, candidate_path: str) -> dict:
+    import librosa
+
+    ref, sr = librosa.load(reference_path, sr=None)
+    cand, _ = librosa.load(candidate_path, sr=sr)
+    ref_mel = np.log(librosa.feature.melspectrogram(y=ref, sr=sr, n_mels=80) + 1e-6)
+    cand_mel = np.log(librosa.feature.melspectrogram(y=cand, sr=sr, n_mels=80) + 1e-6)
+    cost, path = librosa.sequence.dtw(X=ref_mel, Y=cand_mel, metric="euclidean")
+    ref_mfcc = librosa.feature.mfcc(y=ref, sr=sr, n_mfcc=20).mean(axis=1)
+    cand_mfcc = librosa.feature.mfcc(y=cand, sr=sr, n_mfcc=20).mean(axis=1)
+    return {
+        "mel_dtw": float(cost[-1, -1] / len(path)),
+        "mfcc_cos": float(np.dot(ref_mfcc, cand_mfcc) / (np.linalg.norm(ref_mfcc) * np.linalg.norm(cand_mfcc))),
+        "dur_ratio": len(cand) / len(ref),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare TTS_PRECISION modes against fp32")
+    parser.add_argument("--speaker", required=True, help="reference wav")
+    parser.add_argument("--out", default="precision_report")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8", "bf16"])
+    parser.add_argument("--render", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        render(args.render, args.speaker, os.path.join(args.out, args.render))
+        return
+
+    modes = ["fp32"] + [m for m in args.modes if m != "fp32"]
+    for mode in modes:
+        print(f"Rendering {mode}...", flush=True)
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.compare_precision", "--speaker", args.speaker, "--out", args.out, "--render", mode],
+            check=True,
+        )
+
+    report = []
+    for mode in modes:
+        with open(os.path.join(args.out, mode, "stats.json")) as f:
+            stats = json.load(f)
+        scores = [
+            similarity(os.path.join(args.out, "fp32", f"{i}.wav"), os.path.join(args.out, mode, f"{i}.wav"))
+            for i in range(len(CORPUS))
+        ]
+        for key in ("mel_dtw", "mfcc_cos", "dur_ratio"):
+            stats[key] = float(np.mean([s[key] for s in scores]))
+        report.append(stats)
+
+    print(f"{'mode':>6} {'rtf':>6} {'peak_rss':>9} {'mel_dtw':>8} {'mfcc_cos':>9} {'dur_ratio':>9}")
+    for r in report:
+        print(
+            f"{r['precision']:>6} {r['rtf']:>6.2f} {r['peak_rss']:>9.0f} {r['mel_dtw']:>8.3f}"
+            f" {r['mfcc_cos']:>9.4f} {r['dur_ratio']:>9.2f}"
+        )
+    with open(os.path.join(args.out, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
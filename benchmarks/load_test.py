@@ -0,0 +1,244 @@
+# Load test for the part-based and streaming APIs.
+#
+#   python -m benchmarks.load_test --concurrency 8 --requests 64
+#   python -m benchmarks.load_test --backend xtts --speaker sounds/sound4.wav
+#   python -m benchmarks.load_test --url http://localhost:8000 --speaker sounds/sound4.wav
+#
+# Run from the repository root. Without --url the API (--app) is started with uvicorn on a
+# free port. It uses the deterministic stub model by default (TTS_BACKEND=stub, no GPU or
+# model download) and the real XTTS model with --backend xtts. Caches go to a temp dir, and
+# every request gets a unique suffix unless --allow-cache-hits is given, so the numbers
+# measure synthesis, not cache hits.
+#
+# parts mode: POST /initialize-voice, then poll /part-status until every part is done and
+#   fetch each part's audio.
+#   ttfp      time until /initialize-voice returned (part 1 ready)
+#   part      time from request start until each part was ready
+#   rtf       time until the last part was ready / audio seconds
+# stream mode: POST /stream-voice?audio_format=pcm
+#   ttfb      time to the first audio byte
+#   rtf       stream wall time / audio seconds
+# Both modes report throughput in audio seconds per wall second, and how many requests
+# admission control turned away with 429. --max-p95-ms exits non-zero when the p95 of
+# ttfp/ttfb is over budget, for use as a regression gate.
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urljoin
+import numpy as np
+import requests
+from scipy.io import wavfile
+import soundfile as sf
+
+SHORT = [
+    "مرحبًا! هذا مثال لاختبار تحويل النص إلى كلام.",
+    "شكرًا لاستخدامك خدماتنا، نتمنى لك يومًا سعيدًا.",
+    "للاستفسار عن الرصيد اضغط واحد.",
+]
+MEDIUM = [
+    "يسعدنا تواصلك معنا، سيتم تحويل مكالمتك إلى أول موظف متاح. يرجى البقاء على الخط، "
+    "فجميع موظفينا مشغولون حاليًا بخدمة عملاء آخرين.",
+    "يرجى الاستماع إلى الخيارات التالية بعناية، فقد تغيرت قائمتنا مؤخرًا. للاستفسار عن الرصيد اضغط واحد، "
+    "وللتحدث مع خدمة العملاء اضغط صفر.",
+]
+LONG = [
+    " ".join(MEDIUM + SHORT) + " نود إعلامكم بأن ساعات العمل خلال شهر رمضان ستكون من التاسعة صباحًا "
+    "حتى الثالثة عصرًا، ويمكنكم دائمًا استخدام التطبيق لإتمام معاملاتكم على مدار الساعة؛ "
+    "كما يمكنكم زيارة موقعنا الإلكتروني للاطلاع على آخر العروض والخدمات الجديدة.",
+]
+MIXES = {
+    "short": [(SHORT, 1)],
+    "medium": [(MEDIUM, 1)],
+    "long": [(LONG, 1)],
+    "mixed": [(SHORT, 5), (MEDIUM, 4), (LONG, 1)],
+}
+
+def texts_for(mix: str, count: int, seed: int, unique: bool) -> list:
+    rng = random.Random(seed)
+    pools, weights = zip(*MIXES[mix])
+    texts = [rng.choice(rng.choices(pools, weights)[0]) for _ in range(count)]
+    if unique:
+        texts = [f"{text} رقم {i + 1}." for i, text in enumerate(texts)]
+    return texts
+
+def percentile(values: list, q: float) -> float:
+    return float(np.percentile(values, q)) * 1000 if values else float("nan")
+
+def audio_seconds(data: bytes) -> float:
+    info = sf.info(io.BytesIO(data))
+    return info.frames / info.samplerate
+
+def run_parts(base_url: str, text: str, speaker: str, poll_interval: float, audio_format: str) -> dict:
+    session = requests.Session()
+    start = time.perf_counter()
+    response = session.post(f"{base_url}/initialize-voice", params={"audio_format": audio_format},
+                            json={"text": text, "speaker_wav": speaker}, timeout=600)
+    if response.status_code == 429:
+        return {"rejected": True}
+    response.raise_for_status()
+    ttfp = time.perf_counter() - start
+    body = response.json()
+    request_id, total_parts = body["request_id"], body["total_parts"]
+    ready, urls = {}, {}
+    while len(ready) < total_parts:
+        for part in range(1, total_parts + 1):
+            if part in ready:
+                continue
+            status = session.get(f"{base_url}/part-status/{request_id}/{part}", timeout=60).json()
+            if status.get("status") == "done":
+                ready[part] = time.perf_counter() - start
+                urls[part] = urljoin(base_url + "/", status["audio_url"])
+            elif status.get("status") == "error":
+                raise RuntimeError(f"Part {part} of {request_id} failed")
+        if len(ready) < total_parts:
+            time.sleep(poll_interval)
+    seconds = 0.0
+    for part in sorted(urls):
+        audio = session.get(urls[part], timeout=60)
+        audio.raise_for_status()
+        seconds += audio_seconds(audio.content)
+    return {"first": ttfp, "parts": list(ready.values()), "wall": max(ready.values()), "audio_seconds": seconds}
+
+def run_stream(base_url: str, text: str, speaker: str) -> dict:
+    start = time.perf_counter()
+    ttfb, size = None, 0
+    with requests.post(f"{base_url}/stream-voice", params={"audio_format": "pcm"},
+                       json={"text": text, "speaker_wav": speaker}, stream=True, timeout=600) as response:
+        if response.status_code == 429:
+            return {"rejected": True}
+        response.raise_for_status()
+        # audio/L16;rate=24000;channels=1
+        rate = int(response.headers["content-type"].split("rate=")[1].split(";")[0])
+        for chunk in response.iter_content(chunk_size=None):
+            if ttfb is None and chunk:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+    wall = time.perf_counter() - start
+    return {"first": ttfb or wall, "parts": [], "wall": wall, "audio_seconds": size / 2 / rate}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(app: str, backend: str, workdir: str, ready_timeout: float):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        TTS_BACKEND=backend,
+        AUDIO_BASE_URL=f"{base_url}/outputs",
+        AUDIO_CACHE_DIR=os.path.join(workdir, "audio_cache"),
+        SPEAKER_CACHE_DIR=os.path.join(workdir, "speaker_cache"),
+        REQUEST_STATE_DB=os.path.join(workdir, "request_state.db"),
+    )
+    os.makedirs("outputs", exist_ok=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{app}:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{app} exited with code {server.returncode}")
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return server, base_url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"{app} not ready after {ready_timeout:.0f}s")
+
+def synthetic_speaker(workdir: str) -> str:
+    sample_rate = 22050
+    t = np.arange(3 * sample_rate) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.01 * np.random.default_rng(0).standard_normal(len(t))
+    path = os.path.abspath(os.path.join(workdir, "speaker.wav"))
+    wavfile.write(path, sample_rate, (tone * 32767).astype(np.int16))
+    return path
+
+def summarize(results: list, elapsed: float, mode: str) -> dict:
+    rejected = sum(1 for r in results if r.get("rejected"))
+    results = [r for r in results if not r.get("rejected")]
+    first = [r["first"] for r in results]
+    parts = [p for r in results for p in r["parts"]]
+    rtf = [r["wall"] / r["audio_seconds"] for r in results if r["audio_seconds"]]
+    audio = sum(r["audio_seconds"] for r in results)
+    summary = {
+        "requests": len(results),
+        "rejected": rejected,
+        "elapsed_s": elapsed,
+        "requests_per_s": len(results) / elapsed,
+        "audio_s_per_s": audio / elapsed,
+        "rtf_mean": float(np.mean(rtf)) if rtf else float("nan"),
+    }
+    first_name = "ttfp" if mode == "parts" else "ttfb"
+    for q in (50, 95, 99):
+        summary[f"{first_name}_p{q}_ms"] = percentile(first, q)
+    if mode == "parts":
+        for q in (50, 95, 99):
+            summary[f"part_p{q}_ms"] = percentile(parts, q)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the TTS API")
+    parser.add_argument("--url", help="use a running server instead of starting one")
+    parser.add_argument("--app", default="tts_api_v3", choices=["tts_api_v3", "dockerApi"])
+    parser.add_argument("--backend", default="stub", choices=["stub", "xtts"])
+    parser.add_argument("--mode", default="parts", choices=["parts", "stream"])
+    parser.add_argument("--mix", default="mixed", choices=sorted(MIXES))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--speaker", help="reference wav as the API expects it (default: a synthetic tone)")
+    parser.add_argument("--audio-format", default="wav")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allow-cache-hits", action="store_true", help="send repeated texts unchanged")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--max-p95-ms", type=float, help="fail if ttfp/ttfb p95 exceeds this")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tts-load-") as workdir:
+        server = None
+        base_url = args.url.rstrip("/") if args.url else None
+        if base_url is None:
+            server, base_url = start_server(args.app, args.backend, workdir, args.ready_timeout)
+        try:
+            speaker = args.speaker or synthetic_speaker(workdir)
+            texts = texts_for(args.mix, args.requests, args.seed, not args.allow_cache_hits)
+            if args.mode == "parts":
+                run = lambda text: run_parts(base_url, text, speaker, args.poll_interval, args.audio_format)
+            else:
+                run = lambda text: run_stream(base_url, text, speaker)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                results = list(pool.map(run, texts))
+            summary = summarize(results, time.perf_counter() - start, args.mode)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    summary.update(mode=args.mode, mix=args.mix, concurrency=args.concurrency, backend=args.backend if not args.url else "remote")
+    for key, value in summary.items():
+        print(f"{key:>16}: {value:.3f}" if isinstance(value, float) else f"{key:>16}: {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    first_p95 = summary.get("ttfp_p95_ms", summary.get("ttfb_p95_ms"))
+    if args.max_p95_ms is not None and first_p95 > args.max_p95_ms:
+        print(f"p95 {first_p95:.0f} ms is over the {args.max_p95_ms:.0f} ms budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Offline bulk synthesis from a JSONL manifest, one {"id", "text", "speaker", "language"} per line.
+#
+#   python bulk_synthesize.py prompts.jsonl --out renders/ --workers 4 --audio-format opus
+#
+# Items are grouped by speaker so conditioning latents are computed once per voice.
+# Every finished item is appended to <out>/progress.jsonl; rerunning the same command
+# skips what is already there, so a crashed or interrupted job resumes where it stopped.
+# <out>/summary.json has counts, timings and failures when the run ends.
+import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import numpy as np
+from audio_codec import AUDIO_FORMATS, AUDIO_BITRATE_KBPS, encode_audio
+from speaker_cache import SpeakerLatentCache
+from tts_engine import Engine
+from worker_pool import WorkerPool
+from xtts_inference import get_sample_rate, synthesize
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def load_manifest(path: str) -> list:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    # seen_files catches distinct ids that still map to one file (e.g. differing only in case)
+    items, seen, seen_files = [], set(), {}
+    with open(path, encoding="utf-8") as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item_id = str(item["id"])
+            if item_id in seen:
+                raise ValueError(f"Duplicate id {item_id} on line {line_num}")
+            seen.add(item_id)
+            stem = file_stem_for(item_id).lower()
+            if stem in seen_files:
+                raise ValueError(f"Ids {seen_files[stem]} and {item_id} (line {line_num}) map to the same output file")
+            seen_files[stem] = item_id
+            speaker = item["speaker"]
+            if not os.path.exists(speaker):
+                speaker = os.path.join(base_dir, speaker)
+            items.append({"id": item_id, "text": item["text"], "speaker": speaker, "language": item.get("language", "ar")})
+    return items
+
+def load_progress(path: str) -> dict:
+    # id -> last record; a torn final line from a crash is ignored
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done[record["id"]] = record
+    return done
+
+def file_stem_for(item_id: str) -> str:
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', item_id)
+    if safe != item_id:
+        # "a/b", "a b" and "a_b" would otherwise share a_b; the hash of the raw id keeps them apart
+        safe = f"{safe}-{hashlib.sha256(item_id.encode('utf-8')).hexdigest()[:8]}"
+    return safe
+
+def file_name_for(item_id: str, extension: str) -> str:
+    return f"{file_stem_for(item_id)}.{extension}"
+
+def write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a JSONL manifest of prompts to audio files")
+    parser.add_argument("manifest")
+    parser.add_argument("--out", default="bulk_outputs")
+    parser.add_argument("--workers", type=int, default=1, help="inference workers (processes on CPU, threads on GPU)")
+    parser.add_argument("--audio-format", default="wav", choices=sorted(AUDIO_FORMATS))
+    parser.add_argument("--bitrate", type=int, default=AUDIO_BITRATE_KBPS)
+    parser.add_argument("--retry-failed", action="store_true", help="rerun items that failed in an earlier run")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    progress_path = os.path.join(args.out, "progress.jsonl")
+    extension = AUDIO_FORMATS[args.audio_format].extension
+    items = load_manifest(args.manifest)
+    done = load_progress(progress_path)
+
+    def finished(item) -> bool:
+        record = done.get(item["id"])
+        if record is None:
+            return False
+        if record["status"] == "ok":
+            return os.path.exists(os.path.join(args.out, record["file"]))
+        return not args.retry_failed
+
+    todo = [item for item in items if not finished(item)]
+    # Group by voice so each speaker's latents are computed once and stay hot
+    todo.sort(key=lambda item: (item["speaker"], item["language"]))
+    logger.info(f"{len(items)} items in manifest, {len(items) - len(todo)} already done, {len(todo)} to render")
+
+    engine = Engine()
+    pool, executor = None, None
+    if args.workers > 1 and engine.device == "cpu":
+        # Fork before anything loads; each worker loads the model and keeps its own speaker cache
+        pool = WorkerPool(engine.model_version, num_workers=args.workers, model_name=engine.model_name,
+                          device=engine.device, precision=engine.precision)
+        pool.start()
+        if not pool.wait_ready() and pool.alive_workers() == 0:
+            raise SystemExit("No TTS worker came up")
+        sample_rate = pool.sample_rate
+        submit = lambda item: pool.submit(item["text"], item["language"], item["speaker"])
+    else:
+        tts_model = engine.load()
+        if tts_model is None:
+            raise SystemExit(f"TTS model failed to load: {engine.error}")
+        sample_rate = get_sample_rate(tts_model)
+        speaker_cache = SpeakerLatentCache(model_version=engine.model_version)
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+
+        def render(item):
+            latents = speaker_cache.get_latents(tts_model, item["speaker"])
+            return synthesize(tts_model, item["text"], item["language"], *latents)
+
+        submit = lambda item: executor.submit(render, item)
+
+    start = time.perf_counter()
+    timings, audio_seconds, failures = [], 0.0, []
+    pending = deque(todo)
+    in_flight = {}
+    with open(progress_path, "a", encoding="utf-8") as progress:
+        def record(entry: dict):
+            progress.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            progress.flush()
+            os.fsync(progress.fileno())
+
+        try:
+            while pending or in_flight:
+                # Keep exactly one item per worker in flight so timings exclude queueing
+                while pending and len(in_flight) < args.workers:
+                    item = pending.popleft()
+                    in_flight[submit(item)] = (item, time.perf_counter())
+                completed, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in completed:
+                    item, submitted = in_flight.pop(future)
+                    elapsed = time.perf_counter() - submitted
+                    try:
+                        wav = future.result()
+                        file_name = file_name_for(item["id"], extension)
+                        write_atomic(os.path.join(args.out, file_name), encode_audio(wav, sample_rate, args.audio_format, args.bitrate))
+                    except Exception as e:
+                        logger.error(f"Item {item['id']} failed: {e}")
+                        failures.append({"id": item["id"], "error": str(e)})
+                        record({"id": item["id"], "status": "error", "error": str(e)})
+                        continue
+                    seconds = len(wav) / sample_rate
+                    timings.append(elapsed)
+                    audio_seconds += seconds
+                    record({"id": item["id"], "status": "ok", "file": file_name,
+                            "seconds": round(elapsed, 3), "audio_seconds": round(seconds, 3)})
+                    rendered = len(timings) + len(failures)
+                    if rendered % 50 == 0:
+                        logger.info(f"{rendered}/{len(todo)} rendered")
+        finally:
+            if pool:
+                pool.stop()
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    wall = time.perf_counter() - start
+    summary = {
+        "manifest": os.path.abspath(args.manifest),
+        "items": len(items),
+        "skipped": len(items) - len(todo),
+        "rendered": len(timings),
+        "failed": len(failures),
+        "workers": args.workers,
+        "wall_seconds": round(wall, 3),
+        "audio_seconds": round(audio_seconds, 3),
+        "rtf": round(wall / audio_seconds, 4) if audio_seconds else None,
+        "item_seconds_p50": round(float(np.percentile(timings, 50)), 3) if timings else None,
+        "item_seconds_p95": round(float(np.percentile(timings, 95)), 3) if timings else None,
+        "failures": failures,
+    }
+    with open(os.path.join(args.out, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    logger.info(f"Rendered {len(timings)} items ({audio_seconds:.0f}s of audio) in {wall:.0f}s, {len(failures)} failed")
+
+if __name__ == "__main__":
+    main()
@@ -1,122 +1,128 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import os, torch, uuid, time, threading
-from TTS.api import TTS
-from TTS.tts.configs.xtts_config import XttsConfig
-from TTS.tts.models.xtts import XttsAudioConfig, XttsArgs
-from TTS.config.shared_configs import BaseDatasetConfig
+from typing import Optional
+import os
 import logging
+from admission import AdmissionController
+from audio_codec import AUDIO_FORMATS, AUDIO_FORMAT, AUDIO_BITRATE_KBPS
+from audio_store import AudioStore
+from metrics import add_metrics_route
+from profiling import RequestProfiler, add_profile_routes
+from quality import QualityController
+from request_manager import RequestManager, add_request_routes
+from scheduler import InferenceScheduler, PRIORITY_FIRST_PART
+from segmenter import segment_text
+from speaker_cache import SpeakerLatentCache
+from speaker_registry import SpeakerRegistry, add_speaker_routes, resolve_speaker
+from state_store import create_state_store
+from tts_engine import Engine, add_health_routes
+from xtts_inference import get_sample_rate
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Allowlist PyTorch safe globals
-torch.serialization.add_safe_globals([XttsConfig, XttsAudioConfig, BaseDatasetConfig, XttsArgs])
-
 app = FastAPI()
 
-# Serve audio files from "outputs"
-app.mount("/audio", StaticFiles(directory="outputs"), name="audio")
+# Request and part state; REQUEST_STATE_BACKEND=sqlite shares it between uvicorn workers
+state = create_state_store()
+
+# Encoded parts are served from memory under /audio, spilling to "outputs" past the memory budget
+# (always, with shared state, so any worker can serve them)
+audio_store = AudioStore(spill_dir="outputs", shared=state.shared)
+
+# The container can't answer the interactive Coqui model license prompt
+os.environ.setdefault("COQUI_TOS_AGREED", "1")
+
+engine = Engine()
+tts_model = engine.load()
+add_health_routes(app, engine)
+add_metrics_route(app)
+
+# Conditioning latents per reference voice, shared by all requests
+speaker_cache = SpeakerLatentCache(model_version=engine.model_version)
+
+# All synthesis goes through the scheduler; the event loop only awaits results. Its threads take
+# turns on the model's GPT lock, so wait estimates count one job at a time.
+scheduler = InferenceScheduler(parallelism=1)
+
+# Rejects new requests with 429 once the estimated wait for their first audio is over budget
+admission = AdmissionController(scheduler)
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Steps new requests down to cheaper quality tiers while the server is overloaded
+quality = QualityController(scheduler, admission)
 
-tts_model = None
-try:
-    logger.info("Loading TTS model...")
-    tts_model = TTS(
-    model_name="tts_models/multilingual/multi-dataset/xtts_v2",
-    progress_bar=True,
-    config_path=None,
-    speaker_wav=None,
-    vocoder_path=None,
-    vocoder_config_path=None,
-    gpu=True,
-    agree_to_fine_tune_model_license=True  # <-- this is required!
-).to(device)
+# torch.profiler captures of flagged or sampled requests, listed and downloaded under /profiles
+profiler = RequestProfiler()
+add_profile_routes(app, profiler)
 
-except Exception as e:
-    logger.error(f"Failed to load TTS model: {e}")
+@app.on_event("startup")
+async def start_scheduler():
+    scheduler.start()
+    request_manager.janitor.start()
+    if tts_model is not None:
+        # Warm up on a model worker; /readyz flips once it has run
+        scheduler.submit(engine.warm_up, speaker_cache, priority=PRIORITY_FIRST_PART)
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    request_manager.janitor.stop()
+    scheduler.stop()
+
+# Uploaded reference voices; requests pick one by speaker_id
+speaker_registry = SpeakerRegistry()
+add_speaker_routes(
+    app, speaker_registry,
+    # First-part priority: the upload waits on this, and would otherwise queue behind every pending part
+    lambda path: scheduler.submit(speaker_cache.get_latents, tts_model, path, priority=PRIORITY_FIRST_PART),
+    speaker_cache.discard,
+)
 
 class TTSRequest(BaseModel):
     text: str
-    speaker_wav: str
-
-text_parts = {}
-generated_parts = {}
-
-def split_text_by_sentences(text: str, max_length: int = 500) -> list:
-    sentences = text.split('.')
-    parts, current_part = [], ""
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if sentence and len(current_part) + len(sentence) + 1 <= max_length:
-            current_part += sentence + '.'
-        else:
-            if current_part:
-                parts.append(current_part.strip())
-            current_part = sentence + '.' if sentence else ""
-    if current_part:
-        parts.append(current_part.strip())
-    return parts
-
-def auto_delete(path, delay_seconds=300):
-    def delete():
-        time.sleep(delay_seconds)
-        if os.path.exists(path):
-            os.remove(path)
-            logger.info(f"Deleted: {path}")
-    threading.Thread(target=delete, daemon=True).start()
-
-def generate_audio_part(text: str, speaker_wav: str, file_path: str, request_id: str, part_num: int):
-    try:
-        speaker_path = os.path.join("sounds", speaker_wav)
-        logger.info(f"Generating part {part_num} for {request_id}")
-        tts_model.tts_to_file(text=text, speaker_wav=speaker_path, language="ar", file_path=file_path)
-        generated_parts[request_id].add(file_path)
-        auto_delete(file_path)
-    except Exception as e:
-        logger.error(f"Error generating part {part_num}: {e}")
-        raise
+    speaker_id: Optional[str] = None
+    # File name under sounds/, for voices that aren't registered
+    speaker_wav: Optional[str] = None
+
+# Request lifecycle, part events, prefetch and stitching; parts are served under /audio.
+# Requests expire 5 minutes after their last part, as the audio files used to.
+request_manager = RequestManager(tts_model, scheduler, state, audio_store, admission, quality, profiler, speaker_cache,
+                                 "/audio", ttl=float(os.environ.get("OUTPUT_TTL_SECONDS", "300")))
+add_request_routes(app, request_manager, "/audio")
 
 @app.post("/initialize-voice")
-async def initialize_voice(tts_req: TTSRequest, background_tasks: BackgroundTasks):
+async def initialize_voice(tts_req: TTSRequest, audio_format: str = AUDIO_FORMAT, bitrate: int = AUDIO_BITRATE_KBPS,
+                           prefetch_parts: Optional[int] = None, quality_tier: Optional[str] = Query(None, alias="quality"),
+                           profile: bool = False):
+    # prefetch_parts: parts rendered ahead of the client's playback position; 0 renders all now.
+    # quality may be stepped down while overloaded; profile traces the first PROFILE_MAX_PARTS parts.
     if tts_model is None:
         raise HTTPException(status_code=500, detail="TTS model not loaded")
+    if audio_format not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"audio_format must be one of {', '.join(AUDIO_FORMATS)}")
 
-    parts = split_text_by_sentences(tts_req.text)
+    speaker_wav = resolve_speaker(speaker_registry, tts_req.speaker_id, tts_req.speaker_wav, base_dir="sounds")
+    parts = segment_text(tts_req.text)
     if not parts:
         raise HTTPException(status_code=400, detail="Empty text")
+    return await request_manager.start_request(parts, speaker_wav, audio_format, bitrate, prefetch_parts, quality_tier, profile)
+
+@app.post("/stream-voice")
+async def stream_voice(tts_req: TTSRequest, audio_format: str = "wav", quality_tier: Optional[str] = Query(None, alias="quality")):
+    # Only the tier's sampling settings apply; streams stay at the model's sample rate
+    if tts_model is None:
+        raise HTTPException(status_code=500, detail="TTS model not loaded")
+    if audio_format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail="audio_format must be 'wav' or 'pcm'")
+    if not tts_req.text.strip():
+        raise HTTPException(status_code=400, detail="Empty text")
+    speaker_wav = resolve_speaker(speaker_registry, tts_req.speaker_id, tts_req.speaker_wav, base_dir="sounds")
+    chunks = request_manager.start_stream(tts_req.text, speaker_wav, quality_tier)
 
-    request_id = str(uuid.uuid4())
-    text_parts[request_id] = parts
-    generated_parts[request_id] = set()
-
-    os.makedirs("outputs", exist_ok=True)
-    first_part_file = f"{request_id}_part1.wav"
-    first_part_path = os.path.join("outputs", first_part_file)
-    generate_audio_part(parts[0], tts_req.speaker_wav, first_part_path, request_id, 1)
-
-    for i, part_text in enumerate(parts[1:], 2):
-        part_file = f"{request_id}_part{i}.wav"
-        part_path = os.path.join("outputs", part_file)
-        background_tasks.add_task(generate_audio_part, part_text, tts_req.speaker_wav, part_path, request_id, i)
-
-    return {"request_id": request_id, "total_parts": len(parts)}
-
-@app.get("/part-status/{request_id}/{part_number}")
-async def part_status(request_id: str, part_number: int):
-    if request_id not in text_parts:
-        raise HTTPException(status_code=404, detail="Invalid request_id")
-    if part_number < 1 or part_number > len(text_parts[request_id]):
-        raise HTTPException(status_code=404, detail="Invalid part number")
-
-    part_file = f"{request_id}_part{part_number}.wav"
-    part_path = os.path.join("outputs", part_file)
-    if part_path in generated_parts.get(request_id, set()):
-        return {"status": "done", "audio_url": f"/audio/{part_file}"}
-    return {"status": "pending"}
+    sample_rate = get_sample_rate(tts_model)
+    media_type = "audio/wav" if audio_format == "wav" else f"audio/L16;rate={sample_rate};channels=1"
+    return StreamingResponse(request_manager.encode_stream(chunks, audio_format), media_type=media_type)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,37 +1,27 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 import os
-import torch
+import threading
 import uuid
-from TTS.api import TTS
-from TTS.tts.configs.xtts_config import XttsConfig
-from TTS.tts.models.xtts import XttsAudioConfig, XttsArgs  # Import XttsArgs
-from TTS.config.shared_configs import BaseDatasetConfig  # New import
 import logging
+from segmenter import segment_text
+from tts_engine import Engine, add_health_routes
 
 # Set up detailed logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Allowlist all required globals for PyTorch 2.6+
-torch.serialization.add_safe_globals([XttsConfig, XttsAudioConfig, BaseDatasetConfig, XttsArgs])  # Add XttsArgs
-logger.info("Added XttsConfig, XttsAudioConfig, BaseDatasetConfig, and XttsArgs to safe globals for torch.load")
-
 app = FastAPI()
 
-# Set device
-device = "cuda" if torch.cuda.is_available() else "cpu"
-logger.info(f"Using device: {device}")
+# Load TTS model through the shared engine
+engine = Engine()
+logger.info(f"Using device: {engine.device}")
+tts_model = engine.load()
+add_health_routes(app, engine)
 
-# Load TTS model
-tts_model = None
-try:
-    logger.info("Attempting to load TTS model...")
-    tts_model = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True).to(device)
-    logger.info("TTS model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load TTS model: {e}")
-    tts_model = None
+@app.on_event("startup")
+async def warm_up_model():
+    threading.Thread(target=engine.warm_up, daemon=True).start()
 
 class TTSRequest(BaseModel):
     text: str
@@ -40,27 +30,6 @@ class TTSRequest(BaseModel):
 text_parts = {}
 generated_parts = {}
 
-def split_text_by_sentences(text: str, max_length: int = 500) -> list:
-    try:
-        sentences = text.split('.')
-        parts = []
-        current_part = ""
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if sentence and len(current_part) + len(sentence) + 1 <= max_length:
-                current_part += sentence + '.'
-            else:
-                if current_part:
-                    parts.append(current_part.strip())
-                current_part = sentence + '.' if sentence else ""
-        if current_part:
-            parts.append(current_part.strip())
-        logger.info(f"Text split into {len(parts)} parts")
-        return parts
-    except Exception as e:
-        logger.error(f"Error splitting text: {e}")
-        raise
-
 def generate_audio_part(text: str, speaker_wav: str, file_path: str, request_id: str, part_num: int):
     try:
         logger.info(f"Generating part {part_num} for {request_id} at {file_path}")
@@ -87,7 +56,7 @@ async def initialize_voice(tts_req: TTSRequest, background_tasks: BackgroundTask
         text = tts_req.text
         logger.info(f"Original Text: {text}")
         
-        parts = split_text_by_sentences(text)
+        parts = segment_text(text)
         if not parts:
             logger.error("No valid text provided")
             raise HTTPException(status_code=400, detail="No valid text provided")
@@ -1,41 +1,73 @@
-import torch
-from TTS.tts.configs.xtts_config import XttsConfig
-from TTS.tts.models.xtts import XttsArgs, XttsAudioConfig
-from TTS.config.shared_configs import BaseDatasetConfig
-
-# Register safe globals for model checkpoint loading.
-torch.serialization.add_safe_globals([XttsConfig, XttsArgs, XttsAudioConfig, BaseDatasetConfig])
-
-from TTS.api import TTS
+import os
 import gradio as gr
+import numpy as np
 from pyngrok import ngrok
+from audio_codec import encode_audio
+from speaker_cache import SpeakerLatentCache
+from streaming import threaded_stream
+from tts_engine import Engine
+from xtts_inference import get_sample_rate, stream_synthesize
+
+# Sessions served at once; the rest wait in the queue and see their position. Each session
+# decodes on a thread of its own, and GPT decoding on the shared model is serialized per
+# sentence (xtts_inference.gpt_lock): a higher limit makes sessions take turns sentence by
+# sentence, it doesn't add model throughput.
+GRADIO_CONCURRENCY = int(os.environ.get("GRADIO_CONCURRENCY", "1"))
+# Submissions allowed to wait; past this new ones are turned away instead of piling up
+GRADIO_QUEUE_SIZE = int(os.environ.get("GRADIO_QUEUE_SIZE", "64"))
+GRADIO_OUTPUT_DIR = os.environ.get("GRADIO_OUTPUT_DIR", "outputs/gradio")
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Load and warm the model once for every Gradio session
+engine = Engine()
+tts = engine.load()
+speaker_cache = SpeakerLatentCache(model_version=engine.model_version)
+engine.warm_up(speaker_cache)
+os.makedirs(GRADIO_OUTPUT_DIR, exist_ok=True)
 
 # Set your actual ngrok authtoken here
 ngrok.set_auth_token("2sqhmKnE6Yfun65pHWoD6NAszME_5tDwwpSBvbJz9N8Na7RYG")
 
-def generate_voice(text, speaker_wav):
-    tts = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+def generate_voice(text, speaker_wav, request: gr.Request):
+    if not text or not text.strip():
+        raise gr.Error("Enter some text")
+    if not os.path.exists(speaker_wav):
+        raise gr.Error(f"Speaker audio {speaker_wav} not found")
     language = "ar"
-    output_path = "outputs/output4.wav"
-    tts.tts_to_file(text=text, speaker_wav=speaker_wav, language=language, file_path=output_path)
-    return output_path
+    sample_rate = get_sample_rate(tts)
+    gpt_cond_latent, speaker_embedding = speaker_cache.get_latents(tts, speaker_wav)
+    chunks = []
+    # Gradio may run each step of this generator on a different pool thread, and stream_synthesize
+    # holds the GPT lock across yields, so it runs on one thread of its own
+    stream = threaded_stream(lambda: stream_synthesize(tts, text, language, gpt_cond_latent, speaker_embedding))
+    for chunk in stream:
+        chunks.append(chunk)
+        # Played as it arrives
+        yield {audio_output: (sample_rate, (np.clip(chunk, -1.0, 1.0) * 32767).astype(np.int16))}
+    # The whole take for download, in a file of this session's own so reviewers can't overwrite each other
+    output_path = os.path.join(GRADIO_OUTPUT_DIR, f"{request.session_hash}.wav")
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_audio(np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32), sample_rate, "wav"))
+    os.replace(tmp_path, output_path)
+    yield {file_output: output_path}
 
-# Create the Gradio interface using the new components
-interface = gr.Interface(
-    fn=generate_voice,
-    inputs=[
-        gr.components.Textbox(lines=2, placeholder="Enter text here...", label="Text"),
-        gr.components.Textbox(value="sounds/sound4.wav", label="Speaker Audio Path")
-    ],
-    outputs=gr.components.Audio(type="filepath", label="Generated Audio"),
-    title="Text-to-Speech with TTS and ngrok",
-    description="Enter text and a speaker audio sample path to clone a voice."
-)
+with gr.Blocks(title="Text-to-Speech with TTS and ngrok") as interface:
+    gr.Markdown("# Text-to-Speech with TTS and ngrok\nEnter text and a speaker audio sample path to clone a voice.")
+    text_input = gr.Textbox(lines=2, placeholder="Enter text here...", label="Text")
+    speaker_input = gr.Textbox(value="sounds/sound4.wav", label="Speaker Audio Path")
+    generate_button = gr.Button("Generate", variant="primary")
+    audio_output = gr.Audio(streaming=True, autoplay=True, label="Generated Audio")
+    file_output = gr.File(label="Full Take")
+    generate_button.click(
+        generate_voice,
+        inputs=[text_input, speaker_input],
+        outputs=[audio_output, file_output],
+        concurrency_limit=GRADIO_CONCURRENCY,
+    )
 
 port = 7860
 public_url = ngrok.connect(port)
 print("ngrok tunnel available at:", public_url)
 
+interface.queue(max_size=GRADIO_QUEUE_SIZE)
 interface.launch(server_name="0.0.0.0", server_port=port, share=False)
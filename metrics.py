@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+import functools
+import os
+import time
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+import torch
+
+# Set PROMETHEUS_MULTIPROC_DIR (to an empty directory, before start) when running several
+# uvicorn workers or WORKER_PROCESSES, so /metrics aggregates every process
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+STAGE_SECONDS = Histogram(
+    "tts_stage_seconds", "Wall time per pipeline stage", ["stage"], buckets=LATENCY_BUCKETS,
+)
+PART_RTF = Histogram(
+    "tts_part_rtf", "Synthesis time / audio duration per part",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5),
+)
+AUDIO_SECONDS = Counter("tts_audio_seconds_total", "Seconds of audio produced")
+CACHE_LOOKUPS = Counter("tts_cache_lookups_total", "Cache lookups", ["cache", "result"])
+QUEUE_DEPTH = Gauge("tts_queue_depth", "Jobs waiting in the inference scheduler", multiprocess_mode="livesum")
+IN_FLIGHT = Gauge("tts_in_flight", "Parts and streams being rendered", ["kind"], multiprocess_mode="livesum")
+PIPELINE_BUSY_SECONDS = Counter("tts_pipeline_busy_seconds_total", "Time each pipelined stage spent computing", ["stage"])
+REQUESTS_BY_TIER = Counter("tts_requests_by_tier_total", "Requests per quality tier, and whether load forced it", ["tier", "degraded"])
+QUALITY_LEVEL = Gauge("tts_quality_degrade_level", "Tiers new requests are stepped down by load (0 = none)", multiprocess_mode="max")
+MODEL_BYTES = Gauge("tts_model_bytes", "Parameter and buffer bytes of the loaded model", multiprocess_mode="max")
+CUDA_ALLOCATED_BYTES = Gauge("tts_cuda_allocated_bytes", "CUDA memory held by tensors", multiprocess_mode="livesum")
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+def observe_part(synthesis_seconds: float, audio_seconds: float):
+    AUDIO_SECONDS.inc(audio_seconds)
+    if audio_seconds > 0:
+        PART_RTF.observe(synthesis_seconds / audio_seconds)
+
+def timed_method(obj, name: str, stage: str, cuda: bool = False):
+    method = getattr(obj, name)
+    sync = torch.cuda.synchronize if cuda else None
+
+    @functools.wraps(method)
+    def wrapped(*args, **kwargs):
+        # record_function names the stage in torch.profiler traces; near free when not profiling
+        with timed(stage), torch.profiler.record_function(stage):
+            result = method(*args, **kwargs)
+            if sync is not None:
+                # Kernels are async; count them in this stage, not the next one
+                sync()
+        return result
+
+    setattr(obj, name, wrapped)
+
+def instrument_model(tts_model):
+    # Splits Xtts.inference (and inference_batch) into GPT decoding and vocoder time
+    xtts = tts_model.synthesizer.tts_model
+    if not hasattr(xtts, "gpt"):
+        # Stub backend
+        return
+    MODEL_BYTES.set(sum(t.numel() * t.element_size() for t in (*xtts.parameters(), *xtts.buffers())))
+    cuda = xtts.device.type == "cuda"
+    timed_method(xtts.gpt, "generate", "gpt_decode", cuda)
+    timed_method(xtts.hifigan_decoder, "forward", "vocoder", cuda)
+
+def metrics_response() -> Response:
+    if torch.cuda.is_available():
+        CUDA_ALLOCATED_BYTES.set(torch.cuda.memory_allocated())
+    registry = REGISTRY
+    if MULTIPROCESS:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def add_metrics_route(app):
+    @app.get("/metrics")
+    async def metrics():
+        return metrics_response()
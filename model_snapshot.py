@@ -0,0 +1,176 @@
+# Local, memory-mapped copy of the XTTS model for fast cold starts.
+#
+#   python model_snapshot.py export --out model_snapshot
+#
+# Export loads the model once the usual way (model manager + torch.load) and writes
+#   model.safetensors  every parameter and buffer, each stored once
+#   tokenizer.json     the BPE vocabulary
+#   snapshot.json      the XttsConfig, names of tied tensors and the versions it came from
+# get_model() loads from MODEL_SNAPSHOT_DIR whenever it holds a snapshot of the requested
+# model. The model skeleton is built on the meta device (no allocation, no weight init) and its
+# tensors are pointed straight at the mmapped file, so weights are paged in on first use
+# instead of being copied up front. There is no network, model-manager lookup or unpickling.
+import argparse
+import importlib
+import json
+import logging
+import os
+import torch
+from torch import nn
+from safetensors import safe_open
+from safetensors.torch import save_file
+from TTS import __version__ as TTS_VERSION
+from TTS.api import TTS
+from TTS.tts.configs.xtts_config import XttsConfig
+from TTS.tts.layers.xtts.tokenizer import VoiceBpeTokenizer
+from TTS.tts.models.xtts import Xtts
+from TTS.utils.synthesizer import Synthesizer
+from xtts_inference import get_xtts
+
+logger = logging.getLogger(__name__)
+
+MODEL_SNAPSHOT_DIR = os.environ.get("MODEL_SNAPSHOT_DIR", "model_snapshot")  # empty string disables snapshots
+
+WEIGHTS_FILE = "model.safetensors"
+TOKENIZER_FILE = "tokenizer.json"
+MANIFEST_FILE = "snapshot.json"
+# Rebuilt from the loaded modules by init_gpt_for_inference, so never exported
+INFERENCE_PREFIX = "gpt.gpt_inference."
+
+def named_tensors(module: nn.Module):
+    # Every parameter and buffer, non-persistent ones included, under every name it has
+    yield from module.named_parameters(remove_duplicate=False)
+    yield from module.named_buffers(remove_duplicate=False)
+
+def read_manifest(snapshot_dir: str = MODEL_SNAPSHOT_DIR):
+    path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not snapshot_dir or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def has_snapshot(model_name: str, snapshot_dir: str = MODEL_SNAPSHOT_DIR) -> bool:
+    manifest = read_manifest(snapshot_dir)
+    return manifest is not None and manifest["model_name"] == model_name
+
+def export_snapshot(tts_model, model_name: str, out_dir: str = MODEL_SNAPSHOT_DIR):
+    xtts = get_xtts(tts_model)
+    os.makedirs(out_dir, exist_ok=True)
+    # Readers treat the manifest as "snapshot complete", so it goes first and comes back last
+    if os.path.exists(os.path.join(out_dir, MANIFEST_FILE)):
+        os.remove(os.path.join(out_dir, MANIFEST_FILE))
+
+    tensors, aliases, names = {}, {}, {}
+    for name, tensor in named_tensors(xtts):
+        if name.startswith(INFERENCE_PREFIX):
+            continue
+        canonical = names.setdefault(id(tensor), name)
+        if canonical != name:
+            # Tied weights (e.g. gpt.gpt.wte and gpt.mel_embedding) are stored once
+            aliases[name] = canonical
+        else:
+            tensors[name] = tensor.detach().to("cpu", copy=True).contiguous()
+    save_file(tensors, os.path.join(out_dir, WEIGHTS_FILE))
+    xtts.tokenizer.tokenizer.save(os.path.join(out_dir, TOKENIZER_FILE))
+
+    manifest = {
+        "model_name": model_name,
+        "tts_version": TTS_VERSION,
+        "torch_version": torch.__version__,
+        "config": xtts.config.to_dict(),
+        "aliases": aliases,
+    }
+    tmp_path = os.path.join(out_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_FILE))
+    size = os.path.getsize(os.path.join(out_dir, WEIGHTS_FILE))
+    logger.info(f"Exported {len(tensors)} tensors ({size / 2**20:.0f} MB, {len(aliases)} aliases) to {out_dir}")
+
+def build_xtts(config: XttsConfig, tokenizer_path: str) -> Xtts:
+    # Same construction as Xtts.load_checkpoint, minus reading the checkpoint
+    def build():
+        xtts = Xtts.init_from_config(config)
+        xtts.tokenizer = VoiceBpeTokenizer(vocab_file=tokenizer_path)
+        xtts.init_models()
+        return xtts
+
+    try:
+        with torch.device("meta"):
+            return build()
+    except Exception as e:
+        # Some op in the constructors can't run on meta; a real allocation still loads correctly
+        logger.warning(f"Building the model skeleton on the meta device failed ({e}), allocating it instead")
+        return build()
+
+def assign_tensor(root: nn.Module, name: str, tensor: torch.Tensor, parameters: dict, canonical: str):
+    module_name, _, attr = name.rpartition(".")
+    module = root.get_submodule(module_name)
+    if attr in module._parameters:
+        # One Parameter per stored tensor keeps tied weights tied
+        if canonical not in parameters:
+            parameters[canonical] = nn.Parameter(tensor, requires_grad=False)
+        module._parameters[attr] = parameters[canonical]
+    else:
+        module._buffers[attr] = tensor
+
+def load_snapshot(snapshot_dir: str = MODEL_SNAPSHOT_DIR, device: str = "cpu"):
+    manifest = read_manifest(snapshot_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No model snapshot in {snapshot_dir}")
+    if manifest["tts_version"] != TTS_VERSION:
+        logger.warning(f"Snapshot was exported with TTS {manifest['tts_version']}, running {TTS_VERSION}; re-export if loading fails")
+    config = XttsConfig()
+    config.from_dict(manifest["config"])
+    xtts = build_xtts(config, os.path.join(snapshot_dir, TOKENIZER_FILE))
+
+    aliases = manifest["aliases"]
+    parameters, missing = {}, []
+    with safe_open(os.path.join(snapshot_dir, WEIGHTS_FILE), framework="pt", device="cpu") as weights:
+        stored = set(weights.keys())
+        loaded = {}
+        for name, _ in list(named_tensors(xtts)):
+            canonical = aliases.get(name, name)
+            if canonical not in stored:
+                missing.append(name)
+                continue
+            if canonical not in loaded:
+                # Backed by the file mapping; pages are read when the tensor is first touched
+                loaded[canonical] = weights.get_tensor(canonical)
+            assign_tensor(xtts, name, loaded[canonical], parameters, canonical)
+    unset = [name for name, tensor in named_tensors(xtts) if tensor.is_meta]
+    if missing or unset:
+        raise RuntimeError(f"Snapshot {snapshot_dir} doesn't match this model, missing {sorted(set(missing + unset))[:10]}; re-export it")
+
+    xtts.gpt.init_gpt_for_inference(kv_cache=xtts.args.kv_cache, use_deepspeed=False)
+    xtts.eval()
+    # Tells WorkerPool the weights are already shared through the page cache
+    xtts.memory_mapped = True
+
+    synthesizer = Synthesizer()
+    synthesizer.tts_model = xtts
+    synthesizer.tts_config = config
+    synthesizer.output_sample_rate = config.audio.output_sample_rate
+    tts_model = TTS(progress_bar=False)
+    # TTS.api recognizes XTTS (multilingual, speaker_wav) by its model name
+    tts_model.model_name = manifest["model_name"]
+    tts_model.synthesizer = synthesizer
+    return tts_model.to(device)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the XTTS model to a memory-mappable snapshot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export")
+    export.add_argument("--model", default="tts_models/multilingual/multi-dataset/xtts_v2")
+    export.add_argument("--out", default=MODEL_SNAPSHOT_DIR or "model_snapshot")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    # Always from the original checkpoint, in fp32
+    # Imported for its side effect: it registers the torch.load allowlist the checkpoint needs
+    importlib.import_module("tts_engine")
+    tts_model = TTS(model_name=args.model, progress_bar=True).to("cpu")
+    export_snapshot(tts_model, args.model, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+from collections import defaultdict
+import asyncio
+import json
+import os
+import threading
+
+PART_EVENTS_POLL_SECONDS = float(os.environ.get("PART_EVENTS_POLL_SECONDS", "0.5"))
+
+class PartEventBus:
+    # Per-request fan-out of part completion events from worker threads to async subscribers.
+    # Events are kept until the request is discarded so late subscribers get a full replay.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.history = {}
+        self.totals = {}
+        self.subscribers = defaultdict(list)
+        # id(queue) -> polling task, for follow() subscribers
+        self.pollers = {}
+
+    def open(self, request_id: str, total_parts: int):
+        with self.lock:
+            self.history[request_id] = []
+            self.totals[request_id] = total_parts
+
+    def discard(self, request_id: str):
+        with self.lock:
+            self.history.pop(request_id, None)
+            self.totals.pop(request_id, None)
+            subscribers = self.subscribers.pop(request_id, [])
+        for loop, events in subscribers:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    def publish(self, request_id: str, event: dict):
+        # Safe to call from any thread
+        with self.lock:
+            if request_id not in self.history:
+                return
+            self.history[request_id].append(event)
+            finished = len(self.history[request_id]) >= self.totals[request_id]
+            subscribers = self.subscribers.pop(request_id, []) if finished else list(self.subscribers.get(request_id, []))
+        for loop, events in subscribers:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+            if finished:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+    def subscribe(self, request_id: str):
+        # Returns an asyncio.Queue of events ending with None, or None for an unknown request
+        events = asyncio.Queue()
+        with self.lock:
+            if request_id not in self.history:
+                return None
+            for event in self.history[request_id]:
+                events.put_nowait(event)
+            if len(self.history[request_id]) >= self.totals[request_id]:
+                events.put_nowait(None)
+            else:
+                self.subscribers[request_id].append((asyncio.get_running_loop(), events))
+        return events
+
+    def follow(self, request_id: str, poll, interval: float = PART_EVENTS_POLL_SECONDS):
+        # For requests another API process is rendering, so no events get published here.
+        # poll(request_id) returns (total_parts, events so far) or None once the request is
+        # gone; it runs in a thread. Returns a queue like subscribe().
+        events = asyncio.Queue()
+        task = asyncio.get_running_loop().create_task(self.poll_loop(request_id, poll, events, interval))
+        with self.lock:
+            self.pollers[id(events)] = task
+        return events
+
+    async def poll_loop(self, request_id: str, poll, events, interval: float):
+        sent = set()
+        try:
+            while True:
+                snapshot = await asyncio.to_thread(poll, request_id)
+                if snapshot is None:
+                    break
+                total_parts, current = snapshot
+                for event in current:
+                    if event["part"] not in sent:
+                        sent.add(event["part"])
+                        events.put_nowait(event)
+                if len(sent) >= total_parts:
+                    break
+                await asyncio.sleep(interval)
+        finally:
+            with self.lock:
+                self.pollers.pop(id(events), None)
+            events.put_nowait(None)
+
+    def unsubscribe(self, request_id: str, events):
+        with self.lock:
+            poller = self.pollers.pop(id(events), None)
+            if poller is not None:
+                poller.cancel()
+            subscribers = self.subscribers.get(request_id)
+            if subscribers:
+                subscribers[:] = [s for s in subscribers if s[1] is not events]
+                if not subscribers:
+                    del self.subscribers[request_id]
+
+async def sse_stream(bus: PartEventBus, request_id: str, events):
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield f"event: part\ndata: {json.dumps(event)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    finally:
+        bus.unsubscribe(request_id, events)
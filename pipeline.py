@@ -0,0 +1,147 @@
+from collections import Counter
+from concurrent.futures import Future
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+import torch
+from metrics import PIPELINE_BUSY_SECONDS
+from xtts_inference import generate_latents, join_sentence_wavs, split_sentences, vocode
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_ENABLED = os.environ.get("PIPELINE_ENABLED", "0") == "1"
+# Cores are split between the stages; GPT decoding is token by token and scales worse than the vocoder
+PIPELINE_GPT_THREADS = int(os.environ.get("PIPELINE_GPT_THREADS", str(max(len(os.sched_getaffinity(0)) // 2, 1))))
+PIPELINE_VOCODER_THREADS = int(os.environ.get("PIPELINE_VOCODER_THREADS", str(max(len(os.sched_getaffinity(0)) - PIPELINE_GPT_THREADS, 1))))
+# Latents waiting for the vocoder before the GPT stage blocks
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "2"))
+
+def set_thread_count(num_threads: int):
+    # torch keeps one process-wide count that each thread copies into its own OpenMP setting on
+    # its first parallel op; run one first so the per-thread count set afterwards sticks.
+    # set_num_threads changes the process-wide count too; PipelinedSynthesizer.start puts it back.
+    torch.ones(1024).sum()
+    torch.set_num_threads(num_threads)
+
+class PipelinedSynthesizer:
+    # Two-stage executor: one thread runs the GPT (sentence -> latents), another the HiFi-GAN
+    # vocoder (latents -> audio), so sentence N is vocoded while sentence N+1 is decoded.
+    # Each stage sets its own torch thread count (OpenMP team sizes are per calling thread).
+    # Sentences pass both stages in FIFO order; the bounded hand-off queue keeps the GPT from
+    # running more than queue_size sentences ahead of the vocoder.
+
+    def __init__(self, tts_model, gpt_threads: int = PIPELINE_GPT_THREADS, vocoder_threads: int = PIPELINE_VOCODER_THREADS,
+                 queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.tts_model = tts_model
+        self.threads_per_stage = {"gpt": gpt_threads, "vocoder": vocoder_threads}
+        self.gpt_jobs = queue.Queue()
+        self.vocoder_jobs = queue.Queue(maxsize=queue_size)
+        self.busy = Counter()
+        self.items = Counter()
+        # Time the GPT stage sat on a full hand-off queue, i.e. waited for the vocoder
+        self.blocked = 0.0
+        self.stats_lock = threading.Lock()
+        # Released by each stage thread once its thread count is set
+        self.stage_ready = threading.Semaphore(0)
+        self.started_at = None
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        self.started_at = time.perf_counter()
+        default_threads = torch.get_num_threads()
+        for name, target in (("gpt", self.gpt_loop), ("vocoder", self.vocoder_loop)):
+            thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        for _ in self.threads:
+            self.stage_ready.acquire()
+        # Each stage keeps its own count; restore the process-wide one so threads that run their first
+        # op later (scheduler threads for streams, conditioning and warm-up) still get every core
+        torch.set_num_threads(default_threads)
+        logger.info(f"Pipelined synthesis started (gpt {self.threads_per_stage['gpt']} threads, "
+                    f"vocoder {self.threads_per_stage['vocoder']} threads)")
+
+    def stop(self):
+        if not self.threads:
+            return
+        # The GPT stage passes the sentinel on to the vocoder stage
+        self.gpt_jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, sentence: str, language: str, latents, tier=None) -> Future:
+        future = Future()
+        self.gpt_jobs.put((future, sentence, language, latents, tier))
+        return future
+
+    def synthesize(self, text: str, language: str, latents, tier=None) -> np.ndarray:
+        # Blocking, like xtts_inference.synthesize; all sentences are queued at once so they overlap
+        futures = [self.submit(s, language, latents, tier) for s in split_sentences(self.tts_model, text, language)]
+        return join_sentence_wavs([f.result() for f in futures])
+
+    def record(self, stage: str, seconds: float):
+        PIPELINE_BUSY_SECONDS.labels(stage).inc(seconds)
+        with self.stats_lock:
+            self.busy[stage] += seconds
+            self.items[stage] += 1
+
+    def gpt_loop(self):
+        set_thread_count(self.threads_per_stage["gpt"])
+        self.stage_ready.release()
+        while True:
+            job = self.gpt_jobs.get()
+            if job is None:
+                self.vocoder_jobs.put(None)
+                break
+            future, sentence, language, (gpt_cond_latent, speaker_embedding), tier = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                gpt_latents = generate_latents(self.tts_model, sentence, language, gpt_cond_latent, tier)
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            finally:
+                self.record("gpt", time.perf_counter() - start)
+            start = time.perf_counter()
+            self.vocoder_jobs.put((future, gpt_latents, speaker_embedding))
+            with self.stats_lock:
+                self.blocked += time.perf_counter() - start
+
+    def vocoder_loop(self):
+        set_thread_count(self.threads_per_stage["vocoder"])
+        self.stage_ready.release()
+        while True:
+            job = self.vocoder_jobs.get()
+            if job is None:
+                break
+            future, gpt_latents, speaker_embedding = job
+            start = time.perf_counter()
+            try:
+                future.set_result(vocode(self.tts_model, gpt_latents, speaker_embedding))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self.record("vocoder", time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        with self.stats_lock:
+            stages = {
+                stage: {
+                    "threads": self.threads_per_stage[stage],
+                    "sentences": self.items[stage],
+                    "busy_seconds": round(self.busy[stage], 3),
+                    "utilization": round(self.busy[stage] / elapsed, 3) if elapsed else 0.0,
+                }
+                for stage in ("gpt", "vocoder")
+            }
+            stages["gpt"]["blocked_seconds"] = round(self.blocked, 3)
+        return {**stages, "waiting_for_gpt": self.gpt_jobs.qsize(), "waiting_for_vocoder": self.vocoder_jobs.qsize()}
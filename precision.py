@@ -0,0 +1,81 @@
+import functools
+import logging
+import os
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+from xtts_inference import get_xtts
+
+logger = logging.getLogger(__name__)
+
+# fp32 (default), int8 (dynamic quantization of the GPT linears) or bf16 (GPT under CPU autocast)
+TTS_PRECISION = os.environ.get("TTS_PRECISION", "fp32")
+PRECISIONS = ("fp32", "int8", "bf16")
+
+def bf16_supported() -> bool:
+    # Autocast works anywhere, but is only faster with native bf16 matmul (AVX512-BF16 / AMX)
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+def conv1d_to_linear(module: nn.Module):
+    # HF GPT-2 uses transformers' Conv1D (y = x @ W + b, W stored as in x out), which
+    # quantize_dynamic doesn't know; swap in equivalent nn.Linear layers first
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = nn.Linear(child.weight.shape[0], child.nf)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+
+def quantize_gpt(xtts):
+    gpt = xtts.gpt
+    conv1d_to_linear(gpt.gpt)
+    # The transformer is shared by gpt.forward and gpt.gpt_inference, so both paths get int8
+    torch.ao.quantization.quantize_dynamic(gpt.gpt, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    torch.ao.quantization.quantize_dynamic(gpt.gpt_inference.lm_head, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def to_float32(output):
+    if torch.is_tensor(output):
+        return output.float()
+    if hasattr(output, "logits"):
+        output.logits = output.logits.float()
+        if output.hidden_states is not None:
+            output.hidden_states = tuple(h.float() for h in output.hidden_states)
+    return output
+
+def autocast_forward(module: nn.Module, dtype=torch.bfloat16):
+    # Run the module under CPU autocast but hand float32 back, since the vocoder and
+    # numpy conversion downstream expect float32
+    forward = module.forward
+
+    @functools.wraps(forward)
+    def wrapped(*args, **kwargs):
+        with torch.autocast("cpu", dtype=dtype):
+            output = forward(*args, **kwargs)
+        return to_float32(output)
+
+    module.forward = wrapped
+
+def apply_precision(tts_model, precision: str = TTS_PRECISION):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    if precision == "fp32":
+        return
+    xtts = get_xtts(tts_model)
+    if xtts.device.type != "cpu":
+        logger.warning(f"Precision {precision} is a CPU mode, keeping fp32 on {xtts.device}")
+        return
+    if precision == "int8":
+        quantize_gpt(xtts)
+    elif precision == "bf16":
+        if not bf16_supported():
+            logger.warning("CPU has no native bf16 support, bf16 autocast will likely be slower than fp32")
+        autocast_forward(xtts.gpt.gpt_inference)
+        autocast_forward(xtts.gpt)
+    logger.info(f"Applied {precision} inference mode to the GPT decoder")
@@ -0,0 +1,80 @@
+import math
+import os
+import threading
+from scheduler import PRIORITY_FIRST_PART
+
+# Parts rendered ahead of the client's playback position when a request doesn't pick its own
+# window; 0 renders every part up front
+PREFETCH_PARTS = int(os.environ.get("PREFETCH_PARTS", "0"))
+# Upper bound for the window when rendering falls behind real time
+PREFETCH_MAX_PARTS = int(os.environ.get("PREFETCH_MAX_PARTS", "8"))
+
+def prefetch_window(min_parts: int, rtf: float, wait_seconds: float, part_seconds: float,
+                    max_parts: int = PREFETCH_MAX_PARTS) -> int:
+    # Parts to keep queued or rendering ahead of playback so the next one is ready when the
+    # current one ends: one part's playback covers 1/rtf parts of rendering, plus the queue wait
+    if part_seconds <= 0:
+        return max(min_parts, max_parts)
+    needed = math.ceil(rtf + wait_seconds / part_seconds)
+    return max(min_parts, min(needed, max_parts))
+
+class PrefetchTracker:
+    # Parts of windowed requests that haven't been handed to the scheduler yet. Clients report
+    # the part they are playing (part-status polls, audio downloads, heartbeats) and parts up to
+    # position + window get released; an abandoned request never renders the rest.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # request_id -> {"pending": {part_num: job}, "texts": {part_num: text}, "min_window": int, "position": int}
+        self.requests = {}
+
+    def open(self, request_id: str, texts: list, jobs: list, min_window: int):
+        # jobs are (priority, fn, args, cost) as submit_many takes them, one per part in order
+        with self.lock:
+            self.requests[request_id] = {
+                "pending": dict(enumerate(jobs, 1)),
+                "texts": dict(enumerate(texts, 1)),
+                "min_window": min_window,
+                "position": 0,
+            }
+
+    def due(self, request_id: str, position: int, window_for) -> list:
+        # Moves the playback position forward and returns the [(part_num, job)] to submit now.
+        # window_for(min_window, texts of the parts still pending) sizes the window.
+        with self.lock:
+            entry = self.requests.get(request_id)
+            if entry is None:
+                return []
+            entry["position"] = max(entry["position"], position)
+            pending = entry["pending"]
+            if not pending:
+                return []
+            window = window_for(entry["min_window"], [entry["texts"][n] for n in pending])
+            jobs = []
+            for n in sorted(n for n in pending if n <= entry["position"] + window):
+                job = pending.pop(n)
+                if n <= entry["position"]:
+                    # The client is already waiting for this part
+                    job = (PRIORITY_FIRST_PART, *job[1:])
+                jobs.append((n, job))
+            return jobs
+
+    def requeue(self, request_id: str, jobs: list):
+        # Puts back parts that couldn't be submitted (queue full); the next report retries them
+        with self.lock:
+            entry = self.requests.get(request_id)
+            if entry is not None:
+                entry["pending"].update(jobs)
+
+    def discard(self, request_id: str) -> list:
+        # Forgets the request; returns the part numbers that were still held back
+        with self.lock:
+            entry = self.requests.pop(request_id, None)
+        return sorted(entry["pending"]) if entry is not None else []
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "windowed_requests": len(self.requests),
+                "held_parts": sum(len(entry["pending"]) for entry in self.requests.values()),
+            }
@@ -0,0 +1,278 @@
+from collections import Counter
+from contextlib import contextmanager
+from fastapi import Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import torch
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# Fraction of new requests profiled without asking; PUT /profiles/sampling changes it at run time
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+# At most one profiled request per this many seconds, flagged or sampled; tracing slows a part down several times
+PROFILE_MIN_INTERVAL_SECONDS = float(os.environ.get("PROFILE_MIN_INTERVAL_SECONDS", "30"))
+# Parts traced per selected request, from part 1; the rest render normally
+PROFILE_MAX_PARTS = int(os.environ.get("PROFILE_MAX_PARTS", "1"))
+# Python stack sampling period for the flamegraph
+PROFILE_STACK_INTERVAL_MS = float(os.environ.get("PROFILE_STACK_INTERVAL_MS", "5"))
+# Profiled requests kept on disk; the oldest go first
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+# Bearer token for the /profiles routes; unset leaves them disabled
+PROFILE_ADMIN_TOKEN = os.environ.get("PROFILE_ADMIN_TOKEN", "")
+
+# record_function labels set by xtts_inference and metrics.instrument_model
+STAGES = ("conditioning", "gpt_decode", "vocoder")
+TOP_OPS = 25
+
+REQUEST_ID_PATTERN = re.compile(r"^[0-9a-f-]{36}$")
+FILE_PATTERN = re.compile(r"^part\d+\.(trace\.json|folded|summary\.json)$")
+
+class StackSampler:
+    # Samples one thread's Python stack on a timer and counts the stacks in folded form
+    # (root;...;leaf), which flamegraph.pl and speedscope read directly
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+def event_ms(event, name: str) -> float:
+    # FunctionEventAvg times are in microseconds; CUDA fields were renamed to device_* in torch 2.4
+    value = getattr(event, name, None)
+    if value is None:
+        value = getattr(event, name.replace("cuda", "device"), 0)
+    return round(value / 1000, 3)
+
+def summarize(profile, cuda: bool) -> tuple:
+    # (per-stage totals, top operators by self time)
+    averages = profile.key_averages()
+    stages = {}
+    for event in averages:
+        if event.key in STAGES:
+            stages[event.key] = {"calls": event.count, "cpu_ms": event_ms(event, "cpu_time_total")}
+            if cuda:
+                stages[event.key]["cuda_ms"] = event_ms(event, "cuda_time_total")
+    sort_by = "self_cuda_time_total" if cuda else "self_cpu_time_total"
+    ops = []
+    for event in sorted((e for e in averages if e.key not in STAGES), key=lambda e: event_ms(e, sort_by), reverse=True)[:TOP_OPS]:
+        op = {"name": event.key, "calls": event.count, "self_cpu_ms": event_ms(event, "self_cpu_time_total"),
+              "cpu_ms": event_ms(event, "cpu_time_total")}
+        if cuda:
+            op["self_cuda_ms"] = event_ms(event, "self_cuda_time_total")
+        ops.append(op)
+    return stages, ops
+
+class RequestProfiler:
+    # Opt-in torch.profiler capture of individual requests, for inputs that are slow in
+    # production and hard to reproduce offline. A request is picked at admission (explicit
+    # flag or random sampling, both under one rate limit); its first max_parts parts are then
+    # traced while they render, together with a Python stack sampler on the rendering thread.
+    # Artifacts go to PROFILE_DIR/<request_id>/: part<N>.trace.json (chrome://tracing,
+    # Perfetto), part<N>.folded (flamegraph) and part<N>.summary.json (stage and operator
+    # breakdown, text length, timings). One capture runs at a time; the profiler sees every
+    # thread, so ops of other requests rendering concurrently can show up in the trace.
+
+    def __init__(self, profile_dir: str = PROFILE_DIR, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 min_interval: float = PROFILE_MIN_INTERVAL_SECONDS, keep: int = PROFILE_KEEP,
+                 max_parts: int = PROFILE_MAX_PARTS):
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.max_parts = max_parts
+        self.min_interval = min_interval
+        self.keep = keep
+        self.last_selected = None
+        self.selected = 0
+        self.rate_limited = 0
+        self.captures = 0
+        self.skipped_busy = 0
+        self.lock = threading.Lock()
+        self.capture_lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def select(self, requested: bool = False) -> bool:
+        # Called once per new request: should its parts be profiled? See profiles_part for which.
+        if not requested and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return False
+        now = time.monotonic()
+        with self.lock:
+            if self.last_selected is not None and now - self.last_selected < self.min_interval:
+                self.rate_limited += 1
+                return False
+            self.last_selected = now
+            self.selected += 1
+        return True
+
+    def profiles_part(self, selected: bool, part_num: int) -> bool:
+        return selected and part_num <= self.max_parts
+
+    @contextmanager
+    def capture(self, request_id: str, part_num: int, text: str, **details):
+        # Yields a dict the caller can add results to (audio_seconds, ...); it ends up in the summary.
+        # Yields None and profiles nothing if another capture is running.
+        if not self.capture_lock.acquire(blocking=False):
+            with self.lock:
+                self.skipped_busy += 1
+            logger.warning(f"Profiler busy, part {part_num} of {request_id} renders unprofiled")
+            yield None
+            return
+        cuda = torch.cuda.is_available()
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        # The text itself stays out of the artifacts; its hash still matches it to a known input
+        summary = {"request_id": request_id, "part": part_num, "text_chars": len(text),
+                   "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(), **details}
+        profile = torch.profiler.profile(activities=activities)
+        sampler = StackSampler(threading.get_ident(), PROFILE_STACK_INTERVAL_MS / 1000)
+        start = time.perf_counter()
+        profile.start()
+        sampler.start()
+        try:
+            yield summary
+        except BaseException as e:
+            summary["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            sampler.stop()
+            profile.stop()
+            summary["wall_seconds"] = round(time.perf_counter() - start, 3)
+            try:
+                self.save(request_id, part_num, profile, sampler, summary, cuda)
+            except Exception as e:
+                logger.error(f"Saving profile of part {part_num} of {request_id} failed: {e}")
+            finally:
+                self.capture_lock.release()
+
+    def save(self, request_id: str, part_num: int, profile, sampler: StackSampler, summary: dict, cuda: bool):
+        out_dir = os.path.join(self.profile_dir, request_id)
+        os.makedirs(out_dir, exist_ok=True)
+        summary["stages"], summary["top_ops"] = summarize(profile, cuda)
+        # Conditioning only runs on a speaker latent cache miss
+        summary["stages"].setdefault("conditioning", None)
+        summary["python_samples"] = sum(sampler.counts.values())
+        summary["created"] = time.time()
+        profile.export_chrome_trace(os.path.join(out_dir, f"part{part_num}.trace.json"))
+        with open(os.path.join(out_dir, f"part{part_num}.folded"), "w", encoding="utf-8") as f:
+            f.write(sampler.folded())
+        with open(os.path.join(out_dir, f"part{part_num}.summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        with self.lock:
+            self.captures += 1
+        logger.info(f"Profiled part {part_num} of {request_id} in {summary['wall_seconds']}s: {summary['stages']}")
+        self.prune()
+
+    def prune(self):
+        entries = sorted(self.list_requests(), key=lambda entry: entry["modified"])
+        for entry in entries[: max(len(entries) - self.keep, 0)]:
+            shutil.rmtree(os.path.join(self.profile_dir, entry["request_id"]), ignore_errors=True)
+
+    def list_requests(self) -> list:
+        # From disk, so every API process sees captures made by the others
+        entries = []
+        for request_id in os.listdir(self.profile_dir):
+            path = os.path.join(self.profile_dir, request_id)
+            if REQUEST_ID_PATTERN.match(request_id) and os.path.isdir(path):
+                files = sorted(f for f in os.listdir(path) if FILE_PATTERN.match(f))
+                entries.append({"request_id": request_id, "files": files, "modified": os.path.getmtime(path)})
+        return entries
+
+    def summaries(self, request_id: str):
+        path = os.path.join(self.profile_dir, request_id)
+        if not REQUEST_ID_PATTERN.match(request_id) or not os.path.isdir(path):
+            return None
+        summaries = []
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith(".summary.json"):
+                with open(os.path.join(path, file_name), encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+        return summaries
+
+    def artifact_path(self, request_id: str, file_name: str):
+        if not REQUEST_ID_PATTERN.match(request_id) or not FILE_PATTERN.match(file_name):
+            return None
+        path = os.path.join(self.profile_dir, request_id, file_name)
+        return path if os.path.exists(path) else None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "min_interval_seconds": self.min_interval,
+                "max_parts": self.max_parts,
+                "selected": self.selected,
+                "rate_limited": self.rate_limited,
+                "captures": self.captures,
+                "skipped_busy": self.skipped_busy,
+            }
+
+def add_profile_routes(app, profiler: RequestProfiler, admin_token: str = PROFILE_ADMIN_TOKEN):
+    # Admin only: they change how much of the traffic is profiled and list request ids
+
+    def require_admin(authorization: Optional[str] = Header(None)):
+        if not admin_token:
+            raise HTTPException(status_code=403, detail="Profile routes are disabled, set PROFILE_ADMIN_TOKEN")
+        if not authorization or not hmac.compare_digest(authorization.encode(), f"Bearer {admin_token}".encode()):
+            raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+    @app.get("/profiles", dependencies=[Depends(require_admin)])
+    async def list_profiles():
+        entries = sorted(profiler.list_requests(), key=lambda entry: entry["modified"], reverse=True)
+        return {"profiles": entries, **profiler.stats()}
+
+    @app.put("/profiles/sampling", dependencies=[Depends(require_admin)])
+    async def set_profile_sampling(rate: float):
+        if not 0 <= rate <= 1:
+            raise HTTPException(status_code=400, detail="rate must be between 0 and 1")
+        profiler.sample_rate = rate
+        logger.info(f"Profiling {rate:.2%} of new requests")
+        return profiler.stats()
+
+    @app.get("/profiles/{request_id}", dependencies=[Depends(require_admin)])
+    async def profile_summaries(request_id: str):
+        summaries = profiler.summaries(request_id)
+        if summaries is None:
+            raise HTTPException(status_code=404, detail="No profile for this request")
+        return {"request_id": request_id, "parts": summaries}
+
+    @app.get("/profiles/{request_id}/{file_name}", dependencies=[Depends(require_admin)])
+    async def download_profile(request_id: str, file_name: str):
+        path = profiler.artifact_path(request_id, file_name)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Profile artifact not found")
+        media_type = "text/plain" if file_name.endswith(".folded") else "application/json"
+        return FileResponse(path, media_type=media_type, filename=f"{request_id}_{file_name}")
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+from metrics import QUALITY_LEVEL
+from scheduler import PRIORITY_FIRST_PART
+
+logger = logging.getLogger(__name__)
+
+class QualityTier(NamedTuple):
+    # None keeps the model config's value
+    name: str
+    temperature: Optional[float] = None
+    top_k: Optional[int] = None
+    top_p: Optional[float] = None
+    length_penalty: Optional[float] = None
+    # Cap on GPT audio tokens per sentence (~46 ms each); the model's own limit is 605
+    max_gpt_tokens: Optional[int] = None
+    # Resample the vocoder output (24 kHz) down to this rate for parts
+    sample_rate: Optional[int] = None
+
+    @property
+    def cache_variant(self) -> str:
+        # Audio cache keys from before tiers existed stay valid for "full"
+        return "" if self.name == "full" else self.name
+
+# Best first. Cooler, narrower sampling also rambles less, so lower tiers decode fewer tokens.
+QUALITY_TIERS = {
+    "full": QualityTier("full"),
+    "balanced": QualityTier("balanced", temperature=0.65, top_k=30, top_p=0.8, length_penalty=1.0, max_gpt_tokens=500),
+    "fast": QualityTier("fast", temperature=0.5, top_k=20, top_p=0.7, length_penalty=1.0, max_gpt_tokens=400, sample_rate=16000),
+}
+TIER_ORDER = list(QUALITY_TIERS)
+
+# Tier for requests that don't ask for one
+QUALITY_TIER = os.environ.get("QUALITY_TIER", "full")
+QUALITY_AUTO = os.environ.get("QUALITY_AUTO", "1") == "1"
+# Step new requests down a tier when the first-part queue wait goes over this, or the RTF over
+# this multiple of the RTF measured while idle (absolute RTF is hardware, e.g. above 1 on CPU)...
+QUALITY_DEGRADE_WAIT_SECONDS = float(os.environ.get("QUALITY_DEGRADE_WAIT_SECONDS", "4"))
+QUALITY_DEGRADE_RTF_RATIO = float(os.environ.get("QUALITY_DEGRADE_RTF_RATIO", "1.5"))
+# ...and back up once both are under this fraction of them
+QUALITY_RECOVER_RATIO = float(os.environ.get("QUALITY_RECOVER_RATIO", "0.5"))
+# Minimum time between steps, so the level doesn't flap with every request
+QUALITY_HOLD_SECONDS = float(os.environ.get("QUALITY_HOLD_SECONDS", "15"))
+
+class QualityController:
+    # Picks the tier for each new request: the one it asked for, or lower while the server is
+    # degraded. The degrade level moves one tier at a time from the scheduler's estimated wait
+    # and the admission controller's running RTF, with hysteresis and a hold time. RTF only
+    # counts relative to the admission controller's idle RTF (parts that rendered with nothing
+    # else in flight), so a slow device on its own never degrades anyone.
+
+    def __init__(self, scheduler, admission, auto: bool = QUALITY_AUTO, max_wait: float = QUALITY_DEGRADE_WAIT_SECONDS,
+                 max_rtf_ratio: float = QUALITY_DEGRADE_RTF_RATIO, recover_ratio: float = QUALITY_RECOVER_RATIO,
+                 hold_seconds: float = QUALITY_HOLD_SECONDS):
+        self.scheduler = scheduler
+        self.admission = admission
+        self.auto = auto
+        self.max_wait = max_wait
+        self.max_rtf_ratio = max_rtf_ratio
+        self.recover_ratio = recover_ratio
+        self.hold_seconds = hold_seconds
+        self.level = 0
+        # No step within hold_seconds of startup either
+        self.changed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self) -> int:
+        wait = self.scheduler.estimated_wait(PRIORITY_FIRST_PART)
+        rtf = self.admission.rtf if self.admission.samples else None
+        idle_rtf = self.admission.idle_rtf
+        # Slowdown over idle; 1.0 while there is nothing to compare
+        slowdown = rtf / idle_rtf if rtf is not None and idle_rtf else 1.0
+        now = time.monotonic()
+        with self.lock:
+            recover_slowdown = 1 + (self.max_rtf_ratio - 1) * self.recover_ratio
+            if now - self.changed_at >= self.hold_seconds:
+                if (wait > self.max_wait or slowdown > self.max_rtf_ratio) and self.level < len(TIER_ORDER) - 1:
+                    self.level += 1
+                    self.changed_at = now
+                    logger.warning(f"Load high (wait {wait:.1f}s, rtf {slowdown:.2f}x idle), new requests degrade to {TIER_ORDER[self.level]}")
+                elif wait < self.max_wait * self.recover_ratio and slowdown < recover_slowdown and self.level > 0:
+                    self.level -= 1
+                    self.changed_at = now
+                    logger.info(f"Load recovered (wait {wait:.1f}s, rtf {slowdown:.2f}x idle), new requests back to {TIER_ORDER[self.level]}")
+            QUALITY_LEVEL.set(self.level)
+            return self.level
+
+    def choose(self, requested: Optional[str] = None) -> tuple:
+        # (tier, degraded); raises ValueError for an unknown tier name
+        requested = requested or QUALITY_TIER
+        if requested not in QUALITY_TIERS:
+            raise ValueError(f"quality must be one of {', '.join(TIER_ORDER)}")
+        level = self.update() if self.auto else 0
+        index = max(TIER_ORDER.index(requested), level)
+        return QUALITY_TIERS[TIER_ORDER[index]], index > TIER_ORDER.index(requested)
+
+    def stats(self) -> dict:
+        idle_rtf = self.admission.idle_rtf
+        with self.lock:
+            return {
+                "auto": self.auto, "default": QUALITY_TIER, "degraded_to": TIER_ORDER[self.level],
+                "idle_rtf": round(idle_rtf, 3) if idle_rtf is not None else None,
+            }
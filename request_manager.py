@@ -0,0 +1,421 @@
+from fastapi import HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import asyncio
+import contextlib
+import functools
+import logging
+import re
+import time
+import uuid
+import numpy as np
+from audio_codec import AUDIO_FORMATS, AUDIO_BITRATE_KBPS, decode_audio, encode_audio, float_to_pcm16, resample, streaming_wav_header
+from audio_store import serve_audio
+from metrics import IN_FLIGHT, REQUESTS_BY_TIER, STAGE_SECONDS, observe_part, timed
+from part_events import PartEventBus, sse_stream
+from prefetch import PrefetchTracker, PREFETCH_PARTS, prefetch_window
+from quality import QUALITY_TIERS
+from retention import RetentionJanitor, OUTPUT_TTL_SECONDS
+from scheduler import QueueFullError, PRIORITY_FIRST_PART, PRIORITY_NEXT_PART
+from stitching import Stitcher, WaveformBuffer, stitched_chunks
+from streaming import scheduled_stream
+from xtts_inference import get_sample_rate, stream_synthesize, synthesize
+
+logger = logging.getLogger(__name__)
+
+def part_from_file(file_name: str):
+    match = re.match(r"(.+)_part(\d+)\.\w+$", file_name)
+    return (match.group(1), int(match.group(2))) if match else (None, None)
+
+class RequestManager:
+    # Everything between accepting a multi-part request and its expiry, shared by the APIs: parts
+    # rendered through the scheduler, prefetch windows driven by the client's playback position,
+    # completion events, stitching, streaming and cancellation. The APIs differ in how a chunk is
+    # rendered (render, the plain model call by default), whether rendered chunks go through an
+    # audio cache, and where parts are served from (audio_url).
+
+    def __init__(self, tts_model, scheduler, state, audio_store, admission, quality, profiler, speaker_cache,
+                 audio_url: str, render=None, audio_cache=None, ttl: float = OUTPUT_TTL_SECONDS):
+        self.tts_model = tts_model
+        self.scheduler = scheduler
+        self.state = state
+        self.audio_store = audio_store
+        self.admission = admission
+        self.quality = quality
+        self.profiler = profiler
+        self.speaker_cache = speaker_cache
+        self.audio_url = audio_url
+        # render(text, speaker_wav, speaker_key, tier) -> float waveform at the model's rate
+        self.render = render or self.render_chunk
+        self.audio_cache = audio_cache
+        # Pushes part completion to /part-events subscribers instead of making them poll
+        self.part_events = PartEventBus()
+        # Float waveforms of recent parts for /stitched, so it doesn't decode what was just encoded
+        self.waveforms = WaveformBuffer()
+        # Parts of windowed requests waiting for the client's playback position to come close
+        self.prefetch = PrefetchTracker()
+        # Expires request state and audio together after ttl or past OUTPUT_QUOTA_MB
+        self.janitor = RetentionJanitor(self.evict_request, ttl=ttl)
+
+    def evict_request(self, request_id: str):
+        self.scheduler.cancel(request_id)
+        for part_file in self.state.delete(request_id):
+            self.audio_store.remove(part_file)
+        self.part_events.discard(request_id)
+        self.waveforms.discard(request_id)
+        self.prefetch.discard(request_id)
+        logger.info(f"Evicted request {request_id}")
+
+    def part_event(self, part_num: int, part_file: str, duration: float) -> dict:
+        if part_file is None:
+            return {"part": part_num, "status": "error"}
+        return {"part": part_num, "status": "done", "url": f"{self.audio_url}/{part_file}", "duration": duration}
+
+    def poll_part_events(self, request_id: str):
+        total_parts = self.state.total_parts(request_id)
+        completed = self.state.completed_parts(request_id)
+        if total_parts is None or completed is None:
+            return None
+        return total_parts, [self.part_event(n, f, d) for n, (f, d) in sorted(completed.items())]
+
+    def open_part_events(self, request_id: str):
+        # Requests accepted by another worker process are followed through the shared state
+        events = self.part_events.subscribe(request_id)
+        if events is None and self.state.shared and self.state.total_parts(request_id) is not None:
+            events = self.part_events.follow(request_id, self.poll_part_events)
+        return events
+
+    def fail_part(self, request_id: str, part_num: int):
+        self.state.complete_part(request_id, part_num, None)
+        self.part_events.publish(request_id, self.part_event(part_num, None, None))
+
+    def record_cancelled(self, request_id: str, part_num: int, future):
+        # Parts dropped from the queue before rendering show up as failed
+        if future.cancelled():
+            self.fail_part(request_id, part_num)
+
+    def submit_parts(self, request_id: str, jobs: list) -> list:
+        # jobs is [(part_num, (priority, fn, args, cost))]
+        futures = self.scheduler.submit_many([job for _, job in jobs], group=request_id)
+        for (part_num, _), future in zip(jobs, futures):
+            future.add_done_callback(functools.partial(self.record_cancelled, request_id, part_num))
+        return futures
+
+    def prefetch_window_for(self, min_parts: int, texts: list) -> int:
+        part_seconds = sum(self.admission.duration(text) for text in texts) / len(texts)
+        return prefetch_window(min_parts, self.admission.rtf, self.scheduler.estimated_wait(PRIORITY_NEXT_PART), part_seconds)
+
+    def report_position(self, request_id: str, part_num: int) -> int:
+        # The client is playing (or waiting for) part_num; release the parts now inside its window
+        jobs = self.prefetch.due(request_id, part_num, self.prefetch_window_for)
+        if not jobs:
+            return 0
+        try:
+            self.submit_parts(request_id, jobs)
+        except QueueFullError:
+            logger.warning(f"Inference queue full, holding {len(jobs)} parts of {request_id}")
+            self.prefetch.requeue(request_id, jobs)
+            return 0
+        return len(jobs)
+
+    def cancel_request(self, request_id: str) -> int:
+        cancelled = self.scheduler.cancel(request_id)
+        # Parts still held back by the prefetch window would otherwise be released by the next position report
+        held = self.prefetch.discard(request_id)
+        for part_num in held:
+            self.fail_part(request_id, part_num)
+        cancelled += len(held)
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} queued or held parts of {request_id}")
+        return cancelled
+
+    def choose_tier(self, requested: Optional[str]):
+        try:
+            tier, degraded = self.quality.choose(requested)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        REQUESTS_BY_TIER.labels(tier.name, str(degraded).lower()).inc()
+        return tier
+
+    def part_sample_rate(self, tier) -> int:
+        return tier.sample_rate or get_sample_rate(self.tts_model)
+
+    def observe_render(self, text: str, elapsed: float, wav):
+        audio_seconds = len(wav) / get_sample_rate(self.tts_model)
+        STAGE_SECONDS.labels("synthesis").observe(elapsed)
+        observe_part(elapsed, audio_seconds)
+        self.admission.observe(len(text), elapsed, audio_seconds)
+
+    def render_chunk(self, text: str, speaker_wav: str, speaker_key: str, tier=None):
+        latents = self.speaker_cache.get_latents(self.tts_model, speaker_wav)
+        start = time.perf_counter()
+        wav = synthesize(self.tts_model, text, "ar", *latents, tier=tier)
+        self.observe_render(text, time.perf_counter() - start, wav)
+        return wav
+
+    def profile_chunk(self, text: str, speaker_wav: str, request_id: str, part_num: int, tier):
+        # Rendered on this thread, past the audio cache, worker pool and batcher, so the trace holds the
+        # model work; synthesize takes the model's GPT lock like the batcher and pipeline threads do.
+        # Left out of the admission and RTF figures, which the profiler's overhead would skew.
+        with self.profiler.capture(request_id, part_num, text, speaker_wav=speaker_wav, tier=tier.name) as details:
+            start = time.perf_counter()
+            wav = synthesize(self.tts_model, text, "ar", *self.speaker_cache.get_latents(self.tts_model, speaker_wav), tier=tier)
+            if details is not None:
+                details["synthesis_seconds"] = round(time.perf_counter() - start, 3)
+                details["audio_seconds"] = round(len(wav) / get_sample_rate(self.tts_model), 3)
+        return wav
+
+    def generate_audio_part(self, text: str, speaker_wav: str, part_file: str, request_id: str, part_num: int,
+                            audio_format: str, bitrate: int, tier, profile: bool = False):
+        if self.state.total_parts(request_id) is None:
+            # Deleted while queued, possibly through another worker process
+            return
+        try:
+            logger.info(f"Generating part {part_num} for {request_id} as {part_file}")
+            with IN_FLIGHT.labels("part").track_inprogress(), timed("part_total"):
+                speaker_key = self.speaker_cache.key_for(speaker_wav)
+                if profile:
+                    wav = self.profile_chunk(text, speaker_wav, request_id, part_num, tier)
+                elif self.audio_cache is not None:
+                    cache_key = self.audio_cache.key_for(text, speaker_key, "ar", tier.cache_variant)
+                    wav = self.audio_cache.get_or_create(cache_key, lambda: self.render(text, speaker_wav, speaker_key, tier))
+                else:
+                    wav = self.render(text, speaker_wav, speaker_key, tier)
+                sample_rate = self.part_sample_rate(tier)
+                wav = resample(np.asarray(wav, dtype=np.float32), get_sample_rate(self.tts_model), sample_rate)
+                with timed("encode"):
+                    data = encode_audio(wav, sample_rate, audio_format, bitrate)
+                with timed("store"):
+                    self.audio_store.put(part_file, data, AUDIO_FORMATS[audio_format].media_type)
+            duration = round(len(wav) / sample_rate, 3)
+            if not self.state.complete_part(request_id, part_num, part_file, duration) or not self.janitor.charge(request_id, len(data)):
+                # The request expired while this part rendered
+                self.audio_store.remove(part_file)
+                return
+            self.waveforms.put(request_id, part_num, wav)
+            self.part_events.publish(request_id, self.part_event(part_num, part_file, duration))
+        except Exception as e:
+            logger.error(f"Error generating part {part_num} for {request_id}: {e}")
+            self.fail_part(request_id, part_num)
+            raise
+
+    async def start_request(self, parts: list, speaker_wav: str, audio_format: str, bitrate: int,
+                            prefetch_parts: Optional[int], quality_tier: Optional[str], profile: bool) -> dict:
+        # Admits the request, queues its parts and returns once part 1 is ready
+        self.admission.admit(parts[0])
+        # Fixed for the whole request, so all of its parts sound alike and share a sample rate
+        tier = self.choose_tier(quality_tier)
+        profiled = self.profiler.select(profile)
+
+        request_id = str(uuid.uuid4())
+        self.state.create(request_id, parts, tier.name)
+        self.part_events.open(request_id, len(parts))
+        self.janitor.track(request_id)
+
+        # Part 1 of a new request outranks the remaining parts of older requests
+        extension = AUDIO_FORMATS[audio_format].extension
+        jobs = []
+        for i, part_text in enumerate(parts, 1):
+            part_file = f"{request_id}_part{i}.{extension}"
+            priority = PRIORITY_FIRST_PART if i == 1 else PRIORITY_NEXT_PART
+            args = (part_text, speaker_wav, part_file, request_id, i, audio_format, bitrate, tier,
+                    self.profiler.profiles_part(profiled, i))
+            jobs.append((priority, self.generate_audio_part, args, self.admission.cost(part_text)))
+        window = PREFETCH_PARTS if prefetch_parts is None else max(prefetch_parts, 0)
+        if self.state.shared:
+            # Position reports may reach another worker process, which can't release these parts
+            window = 0
+        if window:
+            self.prefetch.open(request_id, parts, jobs, window)
+            jobs = self.prefetch.due(request_id, 1, self.prefetch_window_for)
+        else:
+            jobs = list(enumerate(jobs, 1))
+        try:
+            futures = self.submit_parts(request_id, jobs)
+        except QueueFullError:
+            logger.error(f"Inference queue full, rejecting {request_id}")
+            self.janitor.forget(request_id)
+            self.evict_request(request_id)
+            raise HTTPException(status_code=503, detail="Server busy, try again later")
+        logger.info(f"Queued {len(jobs)} of {len(parts)} parts for {request_id}")
+
+        try:
+            await asyncio.wrap_future(futures[0])
+        except asyncio.CancelledError:
+            if not futures[0].cancelled():
+                raise
+            raise HTTPException(status_code=409, detail="Request was cancelled")
+
+        logger.info(f"Initialized request {request_id} with {len(parts)} parts at {tier.name} quality")
+        return {
+            "request_id": request_id,
+            "total_parts": len(parts),
+            "prefetch_parts": window,
+            "tier": tier.name,
+            "profiled": profiled,
+        }
+
+    def stream_audio(self, text: str, speaker_wav: str, tier, emit, stop):
+        with IN_FLIGHT.labels("stream").track_inprogress():
+            start = time.perf_counter()
+            gpt_cond_latent, speaker_embedding = self.speaker_cache.get_latents(self.tts_model, speaker_wav)
+            # Runs on the shared model from a scheduler thread, alongside the batcher, pipeline or other
+            # streams; stream_synthesize holds the model's GPT lock. Closing it on stop releases the lock.
+            with contextlib.closing(stream_synthesize(self.tts_model, text, "ar", gpt_cond_latent, speaker_embedding, tier=tier)) as chunks:
+                for i, chunk in enumerate(chunks):
+                    if i == 0:
+                        STAGE_SECONDS.labels("stream_first_chunk").observe(time.perf_counter() - start)
+                    if stop.is_set():
+                        logger.info("Stream stopped, client disconnected")
+                        return
+                    emit(chunk)
+
+    def start_stream(self, text: str, speaker_wav: str, quality_tier: Optional[str]):
+        # The tier picks sampling settings only; streams stay at the model's sample rate
+        self.admission.admit(text)
+        tier = self.choose_tier(quality_tier)
+        try:
+            return scheduled_stream(self.scheduler, self.stream_audio, text, speaker_wav, tier, cost=self.admission.cost(text))
+        except QueueFullError:
+            logger.error("Inference queue full, rejecting stream")
+            raise HTTPException(status_code=503, detail="Server busy, try again later")
+
+    async def encode_stream(self, chunks, audio_format: str, sample_rate: int = None):
+        if audio_format == "wav":
+            yield streaming_wav_header(sample_rate or get_sample_rate(self.tts_model))
+        async for chunk in chunks:
+            yield float_to_pcm16(chunk)
+
+    def load_part_waveform(self, request_id: str, part_num: int):
+        wav = self.waveforms.get(request_id, part_num)
+        if wav is not None:
+            return wav
+        # Evicted from the buffer, or rendered by another worker process
+        part = self.state.part(request_id, part_num)
+        entry = self.audio_store.get(part[0]) if part and part[0] else None
+        if entry is None:
+            raise RuntimeError(f"Part {part_num} of {request_id} is gone")
+        data, path, _ = entry
+        return decode_audio(data if data is not None else path)
+
+    async def stitched_audio(self, request_id: str, events, audio_format: str, bitrate: int, sample_rate: int):
+
+        def load_part(part_num: int):
+            # Windowed parts are released as the stream reaches them; disconnecting cancels the rest
+            self.report_position(request_id, part_num)
+            return self.load_part_waveform(request_id, part_num)
+
+        chunks = stitched_chunks(events, load_part, Stitcher(sample_rate))
+        finished = False
+        try:
+            if audio_format in ("wav", "pcm"):
+                async for chunk in self.encode_stream(chunks, audio_format, sample_rate):
+                    yield chunk
+            else:
+                # Compressed formats are encoded once, after the last part
+                wav = np.concatenate([chunk async for chunk in chunks])
+                yield await asyncio.to_thread(encode_audio, wav, sample_rate, audio_format, bitrate)
+            finished = True
+        finally:
+            self.part_events.unsubscribe(request_id, events)
+            if not finished:
+                # The listener hung up; stop rendering parts nobody will hear
+                self.cancel_request(request_id)
+
+def add_request_routes(app, manager: RequestManager, audio_route: str):
+    # Part status, playback position, part events, stitched audio and deletion of requests
+    # started through manager.start_request; parts are served under audio_route
+
+    @app.get("/part-status/{request_id}/{part_number}")
+    async def part_status(request_id: str, part_number: int):
+        total_parts = manager.state.total_parts(request_id)
+        if total_parts is None:
+            logger.error(f"Request ID {request_id} not found")
+            raise HTTPException(status_code=404, detail="Request ID not found")
+        if part_number > total_parts or part_number < 1:
+            logger.error(f"Part number {part_number} out of range for {request_id}")
+            raise HTTPException(status_code=404, detail="Part number out of range")
+
+        manager.report_position(request_id, part_number)
+        tier = manager.state.tier(request_id)
+        part = manager.state.part(request_id, part_number)
+        if part is not None and part[0] is None:
+            return {"status": "error", "tier": tier}
+        if part is not None:
+            return {"status": "done", "audio_url": f"{manager.audio_url}/{part[0]}", "tier": tier}
+        return {"status": "pending", "tier": tier}
+
+    @app.get(audio_route + "/{file_name}")
+    async def get_audio(file_name: str, request: Request):
+        request_id, part_num = part_from_file(file_name)
+        if request_id is not None:
+            manager.report_position(request_id, part_num)
+        return serve_audio(manager.audio_store, file_name, request.headers.get("range"))
+
+    @app.post("/requests/{request_id}/position")
+    async def playback_position(request_id: str, part: int):
+        # Heartbeat for clients that neither poll /part-status nor download parts from here
+        if manager.state.total_parts(request_id) is None:
+            raise HTTPException(status_code=404, detail="Request ID not found")
+        return {"request_id": request_id, "part": part, "queued_parts": manager.report_position(request_id, part)}
+
+    @app.get("/part-events/{request_id}")
+    async def part_events_sse(request_id: str):
+        events = manager.open_part_events(request_id)
+        if events is None:
+            logger.error(f"Request ID {request_id} not found")
+            raise HTTPException(status_code=404, detail="Request ID not found")
+        return StreamingResponse(
+            sse_stream(manager.part_events, request_id, events),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.websocket("/ws/part-events/{request_id}")
+    async def part_events_ws(websocket: WebSocket, request_id: str):
+        events = manager.open_part_events(request_id)
+        if events is None:
+            await websocket.close(code=4404)
+            return
+        await websocket.accept()
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                await websocket.send_json(event)
+            await websocket.close()
+        except WebSocketDisconnect:
+            # Like SSE, losing the event socket leaves the request running: the client may reconnect or
+            # still fetch parts over HTTP. Only a dropped audio stream (/stitched) cancels.
+            pass
+        finally:
+            manager.part_events.unsubscribe(request_id, events)
+
+    @app.get("/stitched/{request_id}")
+    async def stitched(request_id: str, audio_format: str = "wav", bitrate: int = AUDIO_BITRATE_KBPS):
+        # All parts of a request as one continuous file, with silence trimmed and crossfades at the
+        # joins. wav and pcm start playing as soon as part 1 is ready; other formats wait for all parts.
+        if audio_format != "pcm" and audio_format not in AUDIO_FORMATS:
+            raise HTTPException(status_code=400, detail=f"audio_format must be one of pcm, {', '.join(AUDIO_FORMATS)}")
+        events = manager.open_part_events(request_id)
+        if events is None:
+            logger.error(f"Request ID {request_id} not found")
+            raise HTTPException(status_code=404, detail="Request ID not found")
+        # Parts are stored at their tier's rate, so the stitched stream is too
+        sample_rate = manager.part_sample_rate(QUALITY_TIERS.get(manager.state.tier(request_id), QUALITY_TIERS["full"]))
+        if audio_format == "pcm":
+            media_type = f"audio/L16;rate={sample_rate};channels=1"
+        else:
+            media_type = AUDIO_FORMATS[audio_format].media_type
+        return StreamingResponse(manager.stitched_audio(request_id, events, audio_format, bitrate, sample_rate), media_type=media_type)
+
+    @app.delete("/requests/{request_id}")
+    async def delete_request(request_id: str):
+        # Drops the request's queued parts and deletes its state and audio; parts already rendering finish
+        if manager.state.total_parts(request_id) is None:
+            raise HTTPException(status_code=404, detail="Request ID not found")
+        cancelled = manager.cancel_request(request_id)
+        manager.janitor.forget(request_id)
+        manager.evict_request(request_id)
+        return {"request_id": request_id, "cancelled_parts": cancelled}
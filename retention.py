@@ -0,0 +1,134 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Requests (state + audio) live this long after their last part was produced
+OUTPUT_TTL_SECONDS = float(os.environ.get("OUTPUT_TTL_SECONDS", "3600"))
+# Cap on stored output bytes; past it the least recently active requests go first
+OUTPUT_QUOTA_BYTES = int(os.environ.get("OUTPUT_QUOTA_MB", "2048")) * 1024 * 1024
+JANITOR_INTERVAL_SECONDS = float(os.environ.get("JANITOR_INTERVAL_SECONDS", "30"))
+
+class RetentionJanitor:
+    # Expires whole requests through evict(request_id), which drops their state and audio.
+    # Deadlines sit in a min-heap and one thread pops the due ones, so cost is per expiry
+    # rather than per file or per sweep. Heap entries superseded by a later deadline are
+    # skipped when popped.
+
+    def __init__(self, evict, ttl: float = OUTPUT_TTL_SECONDS, quota_bytes: int = OUTPUT_QUOTA_BYTES,
+                 interval: float = JANITOR_INTERVAL_SECONDS):
+        self.evict = evict
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.heap = []
+        # request_id -> live deadline / stored bytes
+        self.deadlines = {}
+        self.sizes = {}
+        self.total_bytes = 0
+        self.expired = 0
+        self.evicted_for_quota = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name="retention-janitor", daemon=True)
+        self.thread.start()
+        logger.info(f"Retention janitor started (ttl {self.ttl:.0f}s, quota {self.quota_bytes / 1e6:.0f} MB)")
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+
+    def track(self, request_id: str):
+        self.touch(request_id, create=True)
+
+    def touch(self, request_id: str, create: bool = False) -> bool:
+        deadline = time.monotonic() + self.ttl
+        with self.lock:
+            if request_id not in self.deadlines and not create:
+                return False
+            self.deadlines[request_id] = deadline
+            self.sizes.setdefault(request_id, 0)
+            heapq.heappush(self.heap, (deadline, request_id))
+        return True
+
+    def charge(self, request_id: str, nbytes: int) -> bool:
+        # Account stored output to a request and restart its TTL. False means the request
+        # was already evicted and the caller should drop what it just stored.
+        if not self.touch(request_id):
+            return False
+        with self.lock:
+            self.sizes[request_id] += nbytes
+            self.total_bytes += nbytes
+            over_quota = self.total_bytes > self.quota_bytes
+        if over_quota:
+            self.wakeup.set()
+        return True
+
+    def forget(self, request_id: str):
+        # Stop tracking without calling evict, for requests the caller tore down itself
+        with self.lock:
+            self.deadlines.pop(request_id, None)
+            self.total_bytes -= self.sizes.pop(request_id, 0)
+
+    def pop_due(self, now: float) -> list:
+        due = []
+        with self.lock:
+            while self.heap:
+                deadline, request_id = self.heap[0]
+                if self.deadlines.get(request_id) != deadline:
+                    heapq.heappop(self.heap)
+                    continue
+                if deadline <= now:
+                    self.expired += 1
+                elif self.total_bytes > self.quota_bytes:
+                    self.evicted_for_quota += 1
+                else:
+                    break
+                heapq.heappop(self.heap)
+                del self.deadlines[request_id]
+                self.total_bytes -= self.sizes.pop(request_id, 0)
+                due.append(request_id)
+        return due
+
+    def sweep(self, now: float = None):
+        for request_id in self.pop_due(time.monotonic() if now is None else now):
+            try:
+                self.evict(request_id)
+            except Exception as e:
+                logger.error(f"Failed to evict request {request_id}: {e}")
+
+    def next_wait(self) -> float:
+        with self.lock:
+            if not self.heap:
+                return self.interval
+            return min(max(self.heap[0][0] - time.monotonic(), 0), self.interval)
+
+    def run(self):
+        while not self.stopping:
+            self.sweep()
+            self.wakeup.wait(self.next_wait())
+            self.wakeup.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "tracked_requests": len(self.deadlines),
+                "stored_bytes": self.total_bytes,
+                "quota_bytes": self.quota_bytes,
+                "expired": self.expired,
+                "evicted_for_quota": self.evicted_for_quota,
+            }
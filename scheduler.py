@@ -0,0 +1,169 @@
+from collections import defaultdict
+from concurrent.futures import Future
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from metrics import QUEUE_DEPTH, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "256"))
+
+# Lower value runs first
+PRIORITY_FIRST_PART = 0
+PRIORITY_NEXT_PART = 1
+
+class QueueFullError(Exception):
+    pass
+
+class InferenceScheduler:
+    # Bounded priority queue of synthesis jobs feeding a fixed set of model worker threads
+
+    def __init__(self, num_workers: int = INFERENCE_WORKERS, max_queue_size: int = INFERENCE_QUEUE_SIZE,
+                 parallelism=None):
+        self.num_workers = num_workers
+        # Jobs the model really works through at once, for estimated_wait: a number or a callable
+        # returning one. Worker threads sharing one model mostly wait on its GPT lock, so this is
+        # usually below num_workers.
+        self.parallelism = num_workers if parallelism is None else parallelism
+        self.jobs = queue.PriorityQueue(maxsize=max_queue_size)
+        # Tie-breaker so jobs of equal priority run in submission (FIFO) order
+        self.counter = itertools.count()
+        self.submit_lock = threading.RLock()
+        # Queued and running futures per group (a request id), so a request's parts can be cancelled
+        self.groups = defaultdict(set)
+        # priority -> estimated seconds of work queued at that priority
+        self.pending_cost = defaultdict(float)
+        # Costs of queued jobs, future -> (priority, cost), moved to running_cost when a worker takes them
+        self.queued_costs = {}
+        # future -> (cost, start) of running jobs
+        self.running_cost = {}
+        # Costed jobs started so far; each worker thread's current job keeps (its number, started alone)
+        self.started = 0
+        self.current = threading.local()
+        self.tracking_lock = threading.Lock()
+        self.workers = []
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self.worker_loop, name=f"inference-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logger.info(f"Inference scheduler started with {self.num_workers} workers")
+
+    def stop(self):
+        self.running = False
+        # Cancel whatever has not started yet
+        while True:
+            try:
+                _, _, future, _, _, _, _ = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None:
+                future.cancel()
+        for _ in self.workers:
+            # Sentinel sorts after every real job
+            self.jobs.put((float("inf"), next(self.counter), None, None, None, None, None))
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        logger.info("Inference scheduler stopped")
+
+    def qsize(self) -> int:
+        return self.jobs.qsize()
+
+    def submit(self, fn, *args, priority: int = PRIORITY_NEXT_PART, group: str = None, cost: float = 0.0, **kwargs) -> Future:
+        # cost is the job's estimated run time in seconds, for estimated_wait()
+        future = Future()
+        with self.submit_lock:
+            try:
+                self.jobs.put_nowait((priority, next(self.counter), future, fn, args, kwargs, time.perf_counter()))
+            except queue.Full:
+                raise QueueFullError("Inference queue is full")
+        QUEUE_DEPTH.set(self.jobs.qsize())
+        if group is not None or cost:
+            with self.tracking_lock:
+                if group is not None:
+                    self.groups[group].add(future)
+                self.pending_cost[priority] += cost
+                self.queued_costs[future] = (priority, cost)
+            future.add_done_callback(lambda f: self.release(f, priority, group, cost))
+        return future
+
+    def submit_many(self, jobs: list, group: str = None) -> list:
+        # jobs is a list of (priority, fn, args, cost); all-or-nothing so a request is never half queued
+        with self.submit_lock:
+            if self.jobs.maxsize and self.jobs.maxsize - self.jobs.qsize() < len(jobs):
+                raise QueueFullError("Inference queue is full")
+            return [self.submit(fn, *args, priority=priority, group=group, cost=cost) for priority, fn, args, cost in jobs]
+
+    def mark_running(self, future: Future):
+        self.current.job = None
+        with self.tracking_lock:
+            entry = self.queued_costs.pop(future, None)
+            if entry is not None:
+                priority, cost = entry
+                self.pending_cost[priority] -= cost
+                self.started += 1
+                self.current.job = (self.started, not self.running_cost)
+                self.running_cost[future] = (cost, time.perf_counter())
+
+    def release(self, future: Future, priority: int, group: str, cost: float):
+        with self.tracking_lock:
+            if self.running_cost.pop(future, None) is None and self.queued_costs.pop(future, None) is not None:
+                self.pending_cost[priority] -= cost
+            if group is not None:
+                futures = self.groups.get(group)
+                if futures is not None:
+                    futures.discard(future)
+                    if not futures:
+                        del self.groups[group]
+
+    def cancel(self, group: str) -> int:
+        # Drops a group's jobs that haven't started; running ones finish. Returns how many were dropped.
+        with self.tracking_lock:
+            futures = list(self.groups.get(group, ()))
+        # Outside the lock: cancel() runs release() synchronously
+        return sum(future.cancel() for future in futures)
+
+    def ran_alone(self) -> bool:
+        # From inside a job: has it run with no other costed job running alongside, so far?
+        job = getattr(self.current, "job", None)
+        with self.tracking_lock:
+            return job is not None and job[1] and self.started == job[0]
+
+    def effective_parallelism(self) -> float:
+        parallelism = self.parallelism() if callable(self.parallelism) else self.parallelism
+        return max(parallelism, 1)
+
+    def estimated_wait(self, priority: int = PRIORITY_NEXT_PART) -> float:
+        # Seconds until a job submitted now at this priority would start: the queued cost at this
+        # priority or better, plus what is left of every running job whatever its priority
+        now = time.perf_counter()
+        with self.tracking_lock:
+            ahead = sum(cost for p, cost in self.pending_cost.items() if p <= priority)
+            ahead += sum(max(cost - (now - start), 0.0) for cost, start in self.running_cost.values())
+        return max(ahead, 0.0) / self.effective_parallelism()
+
+    def worker_loop(self):
+        while True:
+            priority, _, future, fn, args, kwargs, enqueued = self.jobs.get()
+            if future is None:
+                break
+            QUEUE_DEPTH.set(self.jobs.qsize())
+            STAGE_SECONDS.labels("queue_wait").observe(time.perf_counter() - enqueued)
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.mark_running(future)
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
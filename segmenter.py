@@ -0,0 +1,107 @@
+import os
+import re
+
+# Sentence terminators, Arabic and Latin; newlines also end a sentence
+SENTENCE_END = ".!?؟؛;…\n"
+# Places a sentence can be broken when it is too long for one model call
+SOFT_BREAK = "،,:"
+
+SENTENCE_RE = re.compile(rf"[^{re.escape(SENTENCE_END)}]+[{re.escape(SENTENCE_END)}]*")
+CLAUSE_RE = re.compile(rf"[^{re.escape(SOFT_BREAK)}]+[{re.escape(SOFT_BREAK)}]*")
+
+# XTTS per-language character limit (TTS.tts.layers.xtts.tokenizer); Arabic is 166
+DEFAULT_CHAR_LIMIT = 166
+
+class SegmentPolicy:
+    # Part 1 is kept short so it comes back fast; each following part may grow by
+    # `growth` up to `max_chars`, trading latency for fewer, larger model calls
+    def __init__(self, first_chars: int = None, growth: float = None, max_chars: int = None):
+        self.first_chars = first_chars if first_chars is not None else int(os.environ.get("SEGMENT_FIRST_CHARS", "100"))
+        self.growth = growth if growth is not None else float(os.environ.get("SEGMENT_GROWTH", "2.0"))
+        self.max_chars = max_chars if max_chars is not None else int(os.environ.get("SEGMENT_MAX_CHARS", "500"))
+        if self.first_chars < 1:
+            raise ValueError(f"first_chars (SEGMENT_FIRST_CHARS) must be at least 1, got {self.first_chars}")
+        if self.growth < 1:
+            raise ValueError(f"growth (SEGMENT_GROWTH) must be at least 1, got {self.growth}")
+        if self.max_chars < self.first_chars:
+            raise ValueError(f"max_chars (SEGMENT_MAX_CHARS) must be at least first_chars ({self.first_chars}), got {self.max_chars}")
+
+    def limits(self):
+        limit = self.first_chars
+        while True:
+            yield limit
+            limit = min(int(limit * self.growth), self.max_chars)
+
+def split_sentences(text: str) -> list:
+    return [s.strip() for s in SENTENCE_RE.findall(text) if s.strip(" \n" + SENTENCE_END)]
+
+class Fragment(str):
+    # Piece of a word too long for the limit, hard-split; it continues the text before it without a space
+    pass
+
+def join_units(units: list) -> str:
+    text = "".join(u if i == 0 or isinstance(u, Fragment) else " " + u for i, u in enumerate(units))
+    return Fragment(text) if isinstance(units[0], Fragment) else text
+
+def pack(units: list, limit: int) -> list:
+    # Greedily joins units into pieces of at most `limit` characters
+    pieces, current, length = [], [], 0
+    for unit in units:
+        separator = 0 if isinstance(unit, Fragment) else 1
+        if current and length + separator + len(unit) > limit:
+            pieces.append(join_units(current))
+            current, length = [], 0
+        length += len(unit) + (separator if current else 0)
+        current.append(unit)
+    if current:
+        pieces.append(join_units(current))
+    return pieces
+
+def split_long(sentence: str, limit: int) -> list:
+    # Breaks one sentence at commas/colons, then at spaces, then hard, to fit `limit`
+    if len(sentence) <= limit:
+        return [sentence]
+    units = []
+    for clause in (c.strip() for c in CLAUSE_RE.findall(sentence)):
+        if len(clause) <= limit:
+            units.append(clause)
+            continue
+        for word in clause.split():
+            units.append(word[:limit])
+            units.extend(Fragment(word[i:i + limit]) for i in range(limit, len(word), limit))
+    pieces = pack([u for u in units if u], limit)
+    if isinstance(sentence, Fragment) and pieces and not isinstance(pieces[0], Fragment):
+        pieces[0] = Fragment(pieces[0])
+    return pieces
+
+def split_for_model(text: str, char_limit: int = DEFAULT_CHAR_LIMIT) -> list:
+    # Pieces small enough for a single XTTS inference call, in order
+    pieces = []
+    for sentence in split_sentences(text):
+        pieces.extend(split_long(sentence, char_limit))
+    return pieces
+
+def segment_text(text: str, policy: SegmentPolicy = None, char_limit: int = DEFAULT_CHAR_LIMIT) -> list:
+    # Splits request text into parts; single pass over the text, parts joined once
+    policy = policy or SegmentPolicy()
+    limits = policy.limits()
+    limit = next(limits)
+    parts, current, length = [], [], 0
+    pending = split_for_model(text, char_limit)[::-1]
+    while pending:
+        piece = pending.pop()
+        if not current and len(piece) > limit:
+            # Only the short first part can be smaller than a model piece
+            head, *rest = split_long(piece, limit)
+            pending.extend(reversed(rest))
+            piece = head
+        separator = 0 if isinstance(piece, Fragment) else 1
+        if current and length + separator + len(piece) > limit:
+            parts.append(str(join_units(current)))
+            current, length = [], 0
+            limit = next(limits)
+        length += len(piece) + (separator if current else 0)
+        current.append(piece)
+    if current:
+        parts.append(str(join_units(current)))
+    return parts
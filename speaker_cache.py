@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import logging
+import os
+import threading
+import torch
+from metrics import CACHE_LOOKUPS, timed
+from xtts_inference import compute_conditioning_latents
+
+logger = logging.getLogger(__name__)
+
+SPEAKER_CACHE_SIZE = int(os.environ.get("SPEAKER_CACHE_SIZE", "32"))
+SPEAKER_CACHE_DIR = os.environ.get("SPEAKER_CACHE_DIR", "speaker_cache")  # empty string disables persistence
+# Reference files whose content hash is remembered; past this the least recently used are re-hashed
+FILE_HASH_CACHE_SIZE = 1024
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+class SpeakerLatentCache:
+    # LRU of (gpt_cond_latent, speaker_embedding) keyed by reference audio content + model version
+
+    def __init__(self, model_version: str, max_size: int = SPEAKER_CACHE_SIZE, cache_dir: str = SPEAKER_CACHE_DIR):
+        self.model_version = model_version
+        self.max_size = max_size
+        self.cache_dir = cache_dir or None
+        self.latents = OrderedDict()
+        # (path, mtime, size) -> content hash, so unchanged files are not re-hashed; LRU
+        self.file_hashes = OrderedDict()
+        self.lock = threading.Lock()
+        # key -> Future of the one conditioning pass running for it
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, speaker_wav: str) -> str:
+        stat = os.stat(speaker_wav)
+        file_id = (os.path.abspath(speaker_wav), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            content_hash = self.file_hashes.get(file_id)
+            if content_hash is not None:
+                self.file_hashes.move_to_end(file_id)
+        if content_hash is None:
+            # Hashed outside the lock; two threads hashing the same file just agree
+            content_hash = hash_file(speaker_wav)
+            with self.lock:
+                self.file_hashes[file_id] = content_hash
+                while len(self.file_hashes) > FILE_HASH_CACHE_SIZE:
+                    self.file_hashes.popitem(last=False)
+        return hashlib.sha256(f"{self.model_version}:{content_hash}".encode()).hexdigest()
+
+    def disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def get(self, key: str):
+        with self.lock:
+            if key in self.latents:
+                self.latents.move_to_end(key)
+                self.hits += 1
+                return self.latents[key]
+        if self.cache_dir and os.path.exists(self.disk_path(key)):
+            try:
+                data = torch.load(self.disk_path(key), map_location="cpu")
+                latents = (data["gpt_cond_latent"], data["speaker_embedding"])
+                self.put(key, latents, persist=False)
+                with self.lock:
+                    self.hits += 1
+                return latents
+            except Exception as e:
+                logger.error(f"Failed to load cached speaker latents {key}: {e}")
+        return None
+
+    def put(self, key: str, latents, persist: bool = True):
+        with self.lock:
+            self.latents[key] = latents
+            self.latents.move_to_end(key)
+            while len(self.latents) > self.max_size:
+                self.latents.popitem(last=False)
+        if persist and self.cache_dir:
+            try:
+                # Unique per process and thread, so concurrent writers of one speaker never share a tmp file
+                tmp_path = f"{self.disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+                torch.save({"gpt_cond_latent": latents[0].cpu(), "speaker_embedding": latents[1].cpu()}, tmp_path)
+                os.replace(tmp_path, self.disk_path(key))
+            except Exception as e:
+                logger.error(f"Failed to persist speaker latents {key}: {e}")
+
+    def discard(self, speaker_wav: str):
+        # Drops a reference's latents from memory and disk, e.g. when its voice is deleted
+        try:
+            key = self.key_for(speaker_wav)
+        except OSError:
+            return
+        path = os.path.abspath(speaker_wav)
+        with self.lock:
+            self.latents.pop(key, None)
+            for file_id in [f for f in self.file_hashes if f[0] == path]:
+                del self.file_hashes[file_id]
+        if self.cache_dir:
+            try:
+                os.remove(self.disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def compute(self, tts_model, speaker_wav: str, key: str):
+        # Single flight: concurrent misses for the same key wait for one conditioning pass
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        CACHE_LOOKUPS.labels("speaker", "miss" if leader else "coalesced").inc()
+        if not leader:
+            return future.result()
+        try:
+            logger.info(f"Computing conditioning latents for {speaker_wav}")
+            with timed("conditioning"):
+                latents = compute_conditioning_latents(tts_model, speaker_wav)
+            self.put(key, latents)
+            future.set_result(latents)
+            return latents
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def get_latents(self, tts_model, speaker_wav: str):
+        key = self.key_for(speaker_wav)
+        latents = self.get(key)
+        if latents is None:
+            latents = self.compute(tts_model, speaker_wav, key)
+        else:
+            CACHE_LOOKUPS.labels("speaker", "hit").inc()
+        device = tts_model.synthesizer.tts_model.device
+        return latents[0].to(device), latents[1].to(device)
@@ -0,0 +1,171 @@
+from fastapi import HTTPException, Request
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import librosa
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+SPEAKER_REGISTRY_DIR = os.environ.get("SPEAKER_REGISTRY_DIR", "speakers")
+# XTTS loads conditioning audio at 22.05 kHz and only looks at the first gpt_cond_len seconds
+REFERENCE_SAMPLE_RATE = 22050
+REFERENCE_MIN_SECONDS = float(os.environ.get("REFERENCE_MIN_SECONDS", "2"))
+REFERENCE_MAX_SECONDS = float(os.environ.get("REFERENCE_MAX_SECONDS", "15"))
+REFERENCE_MAX_UPLOAD_BYTES = int(os.environ.get("REFERENCE_MAX_UPLOAD_MB", "20")) * 1024 * 1024
+
+class SpeakerRegistryError(ValueError):
+    pass
+
+def preprocess_reference(data: bytes) -> np.ndarray:
+    # Decode, downmix, resample, trim leading/trailing silence, cap length and peak-normalize
+    try:
+        wav, sample_rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    except RuntimeError as e:
+        raise SpeakerRegistryError(f"Unsupported or corrupt audio: {e}")
+    wav = wav.mean(axis=1)
+    if sample_rate != REFERENCE_SAMPLE_RATE:
+        wav = librosa.resample(wav, orig_sr=sample_rate, target_sr=REFERENCE_SAMPLE_RATE)
+    wav, _ = librosa.effects.trim(wav, top_db=30)
+    wav = wav[: int(REFERENCE_MAX_SECONDS * REFERENCE_SAMPLE_RATE)]
+    if len(wav) < REFERENCE_MIN_SECONDS * REFERENCE_SAMPLE_RATE:
+        raise SpeakerRegistryError(f"Reference needs at least {REFERENCE_MIN_SECONDS:g}s of speech after trimming silence")
+    peak = float(np.abs(wav).max())
+    if peak < 1e-3:
+        raise SpeakerRegistryError("Reference is silent")
+    return (wav * (0.9 / peak)).astype(np.float32)
+
+class SpeakerRegistry:
+    # Normalized reference voices by speaker_id, with a small JSON index. The id is a hash of
+    # the normalized audio, so uploading the same voice twice returns the same id. The
+    # conditioning latents live in the SpeakerLatentCache, keyed by model version, so a
+    # model upgrade recomputes them from the stored audio.
+
+    def __init__(self, registry_dir: str = SPEAKER_REGISTRY_DIR):
+        self.registry_dir = registry_dir
+        self.index_path = os.path.join(registry_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(registry_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        logger.info(f"Speaker registry has {len(self.index)} voices")
+
+    def save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def register(self, data: bytes, name: str = None) -> dict:
+        wav = preprocess_reference(data)
+        speaker_id = hashlib.sha256(wav.tobytes()).hexdigest()[:16]
+        with self.lock:
+            if speaker_id in self.index:
+                return {"speaker_id": speaker_id, **self.index[speaker_id]}
+        path = os.path.join(self.registry_dir, f"{speaker_id}.wav")
+        sf.write(f"{path}.tmp", wav, REFERENCE_SAMPLE_RATE, format="WAV", subtype="PCM_16")
+        os.replace(f"{path}.tmp", path)
+        record = {"name": name, "duration": round(len(wav) / REFERENCE_SAMPLE_RATE, 2), "created": time.time()}
+        with self.lock:
+            self.index[speaker_id] = record
+            self.save_index()
+        logger.info(f"Registered speaker {speaker_id} ({record['duration']}s)")
+        return {"speaker_id": speaker_id, **record}
+
+    def path_for(self, speaker_id: str):
+        with self.lock:
+            if speaker_id not in self.index:
+                return None
+        return os.path.join(self.registry_dir, f"{speaker_id}.wav")
+
+    def get(self, speaker_id: str):
+        with self.lock:
+            record = self.index.get(speaker_id)
+        return {"speaker_id": speaker_id, **record} if record else None
+
+    def list(self) -> list:
+        with self.lock:
+            return [{"speaker_id": speaker_id, **record} for speaker_id, record in self.index.items()]
+
+    def delete(self, speaker_id: str) -> bool:
+        with self.lock:
+            if self.index.pop(speaker_id, None) is None:
+                return False
+            self.save_index()
+        try:
+            os.remove(os.path.join(self.registry_dir, f"{speaker_id}.wav"))
+        except FileNotFoundError:
+            pass
+        return True
+
+def add_speaker_routes(app, registry: SpeakerRegistry, prepare=None, forget=None):
+    # prepare(path) returns a Future that computes the voice's conditioning latents on a model worker;
+    # forget(path) drops them again when the voice is deleted
+
+    @app.post("/speakers")
+    async def register_speaker(request: Request, name: str = None):
+        # Body is the raw reference audio (wav, flac, ogg or mp3)
+        chunks, size = [], 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > REFERENCE_MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail="Reference audio too large")
+            chunks.append(chunk)
+        if not size:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        try:
+            record = await asyncio.to_thread(registry.register, b"".join(chunks), name)
+        except SpeakerRegistryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if prepare is not None:
+            try:
+                await asyncio.wrap_future(prepare(registry.path_for(record["speaker_id"])))
+            except Exception as e:
+                # The first request with this voice computes the latents instead
+                logger.warning(f"Could not precompute latents for {record['speaker_id']}: {e}")
+        return record
+
+    @app.get("/speakers")
+    async def list_speakers():
+        return registry.list()
+
+    @app.get("/speakers/{speaker_id}")
+    async def get_speaker(speaker_id: str):
+        record = registry.get(speaker_id)
+        if record is None:
+            raise HTTPException(status_code=404, detail="Speaker not found")
+        return record
+
+    @app.delete("/speakers/{speaker_id}")
+    async def delete_speaker(speaker_id: str):
+        path = registry.path_for(speaker_id)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Speaker not found")
+        if forget is not None:
+            # Before the file goes: the latent cache key is a hash of its content
+            forget(path)
+        if not registry.delete(speaker_id):
+            raise HTTPException(status_code=404, detail="Speaker not found")
+        return {"deleted": speaker_id}
+
+def resolve_speaker(registry: SpeakerRegistry, speaker_id: str = None, speaker_wav: str = None, base_dir: str = "") -> str:
+    # Reference path for a request: a registered speaker_id, or a raw path on the server
+    if speaker_id:
+        path = registry.path_for(speaker_id)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Speaker not found")
+        return path
+    if not speaker_wav:
+        raise HTTPException(status_code=400, detail="speaker_id or speaker_wav is required")
+    path = os.path.join(base_dir, speaker_wav)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=400, detail="Speaker WAV file not found")
+    return path
@@ -0,0 +1,174 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# "memory" keeps state in the API process; "sqlite" shares it between processes on the host
+REQUEST_STATE_BACKEND = os.environ.get("REQUEST_STATE_BACKEND", "memory")
+REQUEST_STATE_DB = os.environ.get("REQUEST_STATE_DB", "request_state.db")
+
+class MemoryStateStore:
+    # Text parts, quality tier and finished parts per request, private to one process.
+    # A finished part is (file name, duration); file name None marks a failed part.
+    shared = False
+
+    def __init__(self):
+        # request_id -> (parts, {part_num: (file, duration)}, tier name)
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def create(self, request_id: str, parts: list, tier: str = "full"):
+        with self.lock:
+            self.requests[request_id] = (parts, {}, tier)
+
+    def parts(self, request_id: str):
+        with self.lock:
+            record = self.requests.get(request_id)
+        return record[0] if record else None
+
+    def tier(self, request_id: str):
+        with self.lock:
+            record = self.requests.get(request_id)
+        return record[2] if record else None
+
+    def total_parts(self, request_id: str):
+        parts = self.parts(request_id)
+        return len(parts) if parts is not None else None
+
+    def complete_part(self, request_id: str, part_num: int, part_file: str, duration: float = None) -> bool:
+        # False if the request is gone, so the caller can drop the part's audio
+        with self.lock:
+            record = self.requests.get(request_id)
+            if record is None:
+                return False
+            record[1][part_num] = (part_file, duration)
+            return True
+
+    def part(self, request_id: str, part_num: int):
+        with self.lock:
+            record = self.requests.get(request_id)
+            return record[1].get(part_num) if record else None
+
+    def completed_parts(self, request_id: str):
+        with self.lock:
+            record = self.requests.get(request_id)
+            return dict(record[1]) if record else None
+
+    def delete(self, request_id: str) -> list:
+        # Returns the part files the request owned
+        with self.lock:
+            record = self.requests.pop(request_id, None)
+        return [f for f, _ in record[1].values() if f] if record else []
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY,
+    total_parts INTEGER NOT NULL,
+    parts TEXT NOT NULL,
+    created REAL NOT NULL,
+    tier TEXT NOT NULL DEFAULT 'full'
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS parts (
+    request_id TEXT NOT NULL,
+    part_num INTEGER NOT NULL,
+    file TEXT,
+    duration REAL,
+    PRIMARY KEY (request_id, part_num)
+) WITHOUT ROWID;
+"""
+
+class SQLiteStateStore:
+    # Same interface as MemoryStateStore, backed by one SQLite file that every API process
+    # on the host opens. WAL mode lets status reads run alongside part writes; both tables
+    # are clustered on request_id, so lookups are a primary-key probe.
+    shared = True
+
+    def __init__(self, path: str = REQUEST_STATE_DB):
+        self.path = path
+        self.local = threading.local()
+        db = self.connect()
+        db.executescript(SCHEMA)
+        if "tier" not in [row[1] for row in db.execute("PRAGMA table_info(requests)")]:
+            # Database created before quality tiers
+            db.execute("ALTER TABLE requests ADD COLUMN tier TEXT NOT NULL DEFAULT 'full'")
+        logger.info(f"Request state in SQLite at {path}")
+
+    def connect(self) -> sqlite3.Connection:
+        # One connection per thread; autocommit, with explicit transactions where needed
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def transaction(self):
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def create(self, request_id: str, parts: list, tier: str = "full"):
+        self.connect().execute(
+            "INSERT INTO requests (request_id, total_parts, parts, created, tier) VALUES (?, ?, ?, ?, ?)",
+            (request_id, len(parts), json.dumps(parts, ensure_ascii=False), time.time(), tier),
+        )
+
+    def parts(self, request_id: str):
+        row = self.connect().execute("SELECT parts FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def total_parts(self, request_id: str):
+        row = self.connect().execute("SELECT total_parts FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+        return row[0] if row else None
+
+    def tier(self, request_id: str):
+        row = self.connect().execute("SELECT tier FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+        return row[0] if row else None
+
+    def complete_part(self, request_id: str, part_num: int, part_file: str, duration: float = None) -> bool:
+        # One statement, so the existence check and the write are atomic against delete()
+        cursor = self.connect().execute(
+            "INSERT OR REPLACE INTO parts (request_id, part_num, file, duration) "
+            "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM requests WHERE request_id = ?)",
+            (request_id, part_num, part_file, duration, request_id),
+        )
+        return cursor.rowcount == 1
+
+    def part(self, request_id: str, part_num: int):
+        row = self.connect().execute(
+            "SELECT file, duration FROM parts WHERE request_id = ? AND part_num = ?", (request_id, part_num)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def completed_parts(self, request_id: str):
+        db = self.connect()
+        if db.execute("SELECT 1 FROM requests WHERE request_id = ?", (request_id,)).fetchone() is None:
+            return None
+        rows = db.execute("SELECT part_num, file, duration FROM parts WHERE request_id = ?", (request_id,))
+        return {part_num: (part_file, duration) for part_num, part_file, duration in rows}
+
+    def delete(self, request_id: str) -> list:
+        with self.transaction() as db:
+            files = [row[0] for row in db.execute("SELECT file FROM parts WHERE request_id = ?", (request_id,)) if row[0]]
+            db.execute("DELETE FROM parts WHERE request_id = ?", (request_id,))
+            db.execute("DELETE FROM requests WHERE request_id = ?", (request_id,))
+        return files
+
+def create_state_store(backend: str = REQUEST_STATE_BACKEND):
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    raise ValueError(f"Unknown REQUEST_STATE_BACKEND {backend}, expected memory or sqlite")
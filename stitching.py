@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import asyncio
+import logging
+import os
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STITCH_CROSSFADE_MS = float(os.environ.get("STITCH_CROSSFADE_MS", "30"))
+# Pause left between parts once their edge silence is trimmed
+STITCH_PAUSE_MS = float(os.environ.get("STITCH_PAUSE_MS", "250"))
+STITCH_SILENCE_DB = float(os.environ.get("STITCH_SILENCE_DB", "-45"))
+STITCH_BUFFER_BYTES = int(os.environ.get("STITCH_BUFFER_MB", "256")) * 1024 * 1024
+
+def trim_silence(wav: np.ndarray, sample_rate: int, threshold_db: float = STITCH_SILENCE_DB) -> np.ndarray:
+    # Drop leading/trailing 10 ms frames whose RMS is under the threshold, keeping one frame of margin
+    frame = max(sample_rate // 100, 1)
+    frames = len(wav) // frame
+    if frames == 0:
+        return wav
+    rms = np.sqrt(np.mean(wav[: frames * frame].reshape(frames, frame) ** 2, axis=1))
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if len(loud) == 0:
+        return wav[:0]
+    start = max(loud[0] - 1, 0) * frame
+    end = min((loud[-1] + 2) * frame, len(wav))
+    return wav[start:end]
+
+class Stitcher:
+    # Joins parts into one continuous signal: edge silence is trimmed, a fixed pause goes
+    # between parts, and each joint gets an equal-power crossfade so there is no click.
+    # The last crossfade's worth of samples is held back until the next part (or finish()).
+
+    def __init__(self, sample_rate: int, crossfade_ms: float = STITCH_CROSSFADE_MS, pause_ms: float = STITCH_PAUSE_MS):
+        self.sample_rate = sample_rate
+        self.fade = int(sample_rate * crossfade_ms / 1000)
+        self.pause = np.zeros(int(sample_rate * pause_ms / 1000), dtype=np.float32)
+        self.held = None
+
+    def add(self, wav: np.ndarray) -> np.ndarray:
+        wav = trim_silence(np.asarray(wav, dtype=np.float32), self.sample_rate)
+        if self.held is None:
+            body = wav
+        else:
+            head = wav.copy()
+            ramp = min(self.fade, len(head))
+            head[:ramp] *= np.sin(np.linspace(0, np.pi / 2, ramp, dtype=np.float32))
+            head = np.concatenate([self.pause, head])
+            n = min(self.fade, len(self.held), len(head))
+            t = np.linspace(0, np.pi / 2, n, dtype=np.float32)
+            mixed = self.held[len(self.held) - n:] * np.cos(t) + head[:n] * np.sin(t)
+            body = np.concatenate([self.held[: len(self.held) - n], mixed, head[n:]])
+        split = max(len(body) - self.fade, 0)
+        self.held = body[split:]
+        return body[:split]
+
+    def finish(self) -> np.ndarray:
+        held, self.held = self.held, None
+        return held if held is not None else np.zeros(0, dtype=np.float32)
+
+class WaveformBuffer:
+    # Float waveforms of finished parts, so stitching doesn't decode what was just encoded.
+    # Least recently added parts are dropped past max_bytes; callers fall back to decoding.
+
+    def __init__(self, max_bytes: int = STITCH_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self.parts = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def put(self, request_id: str, part_num: int, wav: np.ndarray):
+        with self.lock:
+            self.parts[(request_id, part_num)] = wav
+            self.total_bytes += wav.nbytes
+            while self.total_bytes > self.max_bytes and self.parts:
+                _, dropped = self.parts.popitem(last=False)
+                self.total_bytes -= dropped.nbytes
+
+    def get(self, request_id: str, part_num: int):
+        with self.lock:
+            return self.parts.get((request_id, part_num))
+
+    def discard(self, request_id: str):
+        with self.lock:
+            for key in [k for k in self.parts if k[0] == request_id]:
+                self.total_bytes -= self.parts.pop(key).nbytes
+
+async def stitched_chunks(events, load_part, stitcher: Stitcher):
+    # Consumes part events (any completion order) and yields stitched audio in part order.
+    # load_part(part_num) returns the part's float waveform and runs in a thread.
+    # Stops early if a part failed.
+    ready, next_part = set(), 1
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        if event.get("status") != "done":
+            logger.error(f"Part {event.get('part')} failed, ending stitched stream")
+            break
+        ready.add(event["part"])
+        while next_part in ready:
+            wav = await asyncio.to_thread(load_part, next_part)
+            yield stitcher.add(wav)
+            next_part += 1
+    yield stitcher.finish()
@@ -0,0 +1,103 @@
+import asyncio
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+from scheduler import PRIORITY_FIRST_PART
+
+logger = logging.getLogger(__name__)
+
+# Chunks a stream may have waiting for its client; past this the producer waits for it to catch up
+STREAM_BUFFER_CHUNKS = int(os.environ.get("STREAM_BUFFER_CHUNKS", "32"))
+# A client that takes no chunk for this long is treated as gone, so a stalled one can't keep
+# the producer (and the model's GPT lock it may hold) forever
+STREAM_STALL_SECONDS = float(os.environ.get("STREAM_STALL_SECONDS", "30"))
+
+def scheduled_stream(scheduler, producer, *args, priority: int = PRIORITY_FIRST_PART, cost: float = 0.0,
+                     max_chunks: int = STREAM_BUFFER_CHUNKS, stall_seconds: float = STREAM_STALL_SECONDS):
+    # Runs producer(*args, emit, stop) on a scheduler worker and returns an async iterator
+    # over whatever it emits. Submission happens here, so QueueFullError is raised before
+    # any response has started. emit blocks while max_chunks are waiting for the client.
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    stop = threading.Event()
+    # One slot per chunk in the queue; the consumer gives a slot back for every chunk it takes
+    slots = threading.Semaphore(max_chunks)
+
+    def emit(chunk):
+        if not slots.acquire(timeout=stall_seconds):
+            logger.warning(f"Stream client took no audio for {stall_seconds:.0f}s, stopping")
+            stop.set()
+        if stop.is_set():
+            return
+        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+    future = scheduler.submit(producer, *args, emit, stop, priority=priority, cost=cost)
+    future.add_done_callback(lambda f: loop.call_soon_threadsafe(chunks.put_nowait, None))
+
+    async def iterate():
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                slots.release()
+                yield chunk
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"Streaming synthesis failed: {future.exception()}")
+        finally:
+            # Client went away or stream finished: stop the producer between chunks, waking it if
+            # it is waiting for a slot
+            stop.set()
+            slots.release()
+            future.cancel()
+
+    return iterate()
+
+def threaded_stream(make_chunks, max_chunks: int = STREAM_BUFFER_CHUNKS, stall_seconds: float = STREAM_STALL_SECONDS):
+    # Sync counterpart of scheduled_stream: iterates the generator make_chunks() on a dedicated
+    # thread and yields its chunks here. For consumers whose next() calls can land on different
+    # threads (Gradio steps sync generators through a thread pool): stream_synthesize holds the
+    # model's GPT lock, an RLock, across yields, so it has to stay on the thread that took it.
+    chunks = queue.Queue(maxsize=max_chunks)
+    stop = threading.Event()
+    errors = []
+
+    def put(chunk) -> bool:
+        # Waits for the consumer to make room; False once it has gone away or stalled
+        deadline = time.monotonic() + stall_seconds
+        while not stop.is_set():
+            try:
+                chunks.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    logger.warning(f"Stream consumer took no audio for {stall_seconds:.0f}s, stopping")
+                    stop.set()
+        return False
+
+    def produce():
+        try:
+            # Closing the generator on the way out releases whatever it holds, on this thread
+            with contextlib.closing(make_chunks()) as generator:
+                for chunk in generator:
+                    if not put(chunk):
+                        return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(None)
+
+    threading.Thread(target=produce, name="stream-producer", daemon=True).start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import time
+from types import SimpleNamespace
+import numpy as np
+from scipy.io import wavfile
+import torch
+from xtts_inference import compute_conditioning_latents, synthesize
+
+# Speaking rate and speed of the stand-in model; sleep time = audio seconds * STUB_RTF
+STUB_RTF = float(os.environ.get("STUB_RTF", "0.3"))
+STUB_CHARS_PER_SECOND = float(os.environ.get("STUB_CHARS_PER_SECOND", "14"))
+STUB_SAMPLE_RATE = 24000
+
+def seed_for(*values) -> int:
+    return int.from_bytes(hashlib.sha256("\0".join(map(str, values)).encode("utf-8")).digest()[:8], "little")
+
+class StubXtts:
+    # Stands in for TTS.tts.models.xtts.Xtts with the same call signatures. Audio is a
+    # deterministic function of text and speaker, and each call blocks (GIL released) for
+    # audio seconds * rtf, so the API's scheduling and I/O behave as with a model that fast.
+    # There is no GPT or vocoder, so BATCHING_ENABLED and TTS_PRECISION don't apply.
+
+    def __init__(self, rtf: float = STUB_RTF, chars_per_second: float = STUB_CHARS_PER_SECOND):
+        self.rtf = rtf
+        self.chars_per_second = chars_per_second
+        self.device = torch.device("cpu")
+        self.config = SimpleNamespace(
+            temperature=0.75, length_penalty=1.0, repetition_penalty=5.0, top_k=50, top_p=0.85,
+            gpt_cond_len=30, gpt_cond_chunk_len=4, max_ref_len=30, sound_norm_refs=False,
+        )
+        self.tokenizer = SimpleNamespace(char_limits={"ar": 166, "en": 250})
+
+    def share_memory(self):
+        return self
+
+    def get_conditioning_latents(self, audio_path: str, **kwargs):
+        with open(audio_path, "rb") as f:
+            rng = np.random.default_rng(seed_for(hashlib.sha256(f.read()).hexdigest()))
+        gpt_cond_latent = torch.from_numpy(rng.standard_normal((1, 32, 1024), dtype=np.float32))
+        speaker_embedding = torch.from_numpy(rng.standard_normal((1, 512, 1), dtype=np.float32))
+        return gpt_cond_latent, speaker_embedding
+
+    def render(self, text: str, speaker_embedding) -> np.ndarray:
+        seconds = max(len(text.strip()), 1) / self.chars_per_second
+        pitch = 110 + 60 * abs(float(speaker_embedding.flatten()[0]))
+        t = np.arange(int(seconds * STUB_SAMPLE_RATE)) / STUB_SAMPLE_RATE
+        noise = np.random.default_rng(seed_for(text)).standard_normal(len(t))
+        return (0.3 * np.sin(2 * np.pi * pitch * t) + 0.02 * noise).astype(np.float32)
+
+    def inference(self, text: str, language: str, gpt_cond_latent, speaker_embedding, **kwargs) -> dict:
+        wav = self.render(text, speaker_embedding)
+        time.sleep(len(wav) / STUB_SAMPLE_RATE * self.rtf)
+        return {"wav": wav}
+
+    def inference_stream(self, text: str, language: str, gpt_cond_latent, speaker_embedding, stream_chunk_size: int = 20, **kwargs):
+        # XTTS emits ~1024 samples per GPT token
+        wav = self.render(text, speaker_embedding)
+        step = stream_chunk_size * 1024
+        for start in range(0, len(wav), step):
+            chunk = wav[start:start + step]
+            time.sleep(len(chunk) / STUB_SAMPLE_RATE * self.rtf)
+            yield torch.from_numpy(chunk)
+
+class StubSynthesizer:
+    def __init__(self, tts_model: StubXtts):
+        self.tts_model = tts_model
+        self.output_sample_rate = STUB_SAMPLE_RATE
+
+    def save_wav(self, wav, path: str):
+        wav = np.asarray(wav, dtype=np.float32)
+        wavfile.write(path, self.output_sample_rate, (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16))
+
+class StubTTS:
+    # Drop-in for TTS.api.TTS as used by this repo: .synthesizer, .to() and tts_to_file()
+
+    def __init__(self, rtf: float = STUB_RTF):
+        self.synthesizer = StubSynthesizer(StubXtts(rtf))
+
+    def to(self, device):
+        return self
+
+    def tts_to_file(self, text: str, speaker_wav: str, language: str, file_path: str, **kwargs) -> str:
+        wav = synthesize(self, text, language, *compute_conditioning_latents(self, speaker_wav))
+        self.synthesizer.save_wav(wav, file_path)
+        return file_path
@@ -3,15 +3,13 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import os
-import torch
+import threading
 import uuid
-from TTS.api import TTS
-from TTS.tts.configs.xtts_config import XttsConfig
-from TTS.tts.models.xtts import XttsArgs, XttsAudioConfig
-from TTS.config.shared_configs import BaseDatasetConfig
-
-# Allow safe serialization for TTS configurations
-torch.serialization.add_safe_globals([XttsConfig, XttsArgs, XttsAudioConfig, BaseDatasetConfig])
+from retention import RetentionJanitor
+from segmenter import segment_text
+from speaker_cache import SpeakerLatentCache
+from tts_engine import Engine, add_health_routes
+from xtts_inference import synthesize_to_file
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -24,15 +22,22 @@ app.add_middleware(
 )
 app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
 
-# Set device based on availability
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# Load TTS model (device picked by the engine based on availability)
+engine = Engine()
+tts_model = engine.load()
+add_health_routes(app, engine)
+
+# Cache conditioning latents per reference voice
+speaker_cache = SpeakerLatentCache(model_version=engine.model_version)
 
-# Load TTS model
-try:
-    tts_model = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-except Exception as e:
-    print("Error loading TTS model:", e)
-    tts_model = None
+@app.on_event("startup")
+async def warm_up_model():
+    janitor.start()
+    threading.Thread(target=engine.warm_up, args=(speaker_cache,), daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_janitor():
+    janitor.stop()
 
 # Define request model
 class TTSRequest(BaseModel):
@@ -42,34 +47,29 @@ class TTSRequest(BaseModel):
 # Dictionary to store text parts
 text_parts = {}
 generated_parts = {}
+request_speakers = {}
 
-# Function to split text into parts at sentence boundaries
-def split_text_by_sentences(text: str, max_length: int = 500) -> list:
-    sentences = text.split('.')
-    parts = []
-    current_part = ""
-    
-    for sentence in sentences:
-        if len(current_part) + len(sentence) + 1 <= max_length:
-            current_part += sentence + '.'
-        else:
-            parts.append(current_part.strip())
-            current_part = sentence + '.'
-    
-    if current_part:
-        parts.append(current_part.strip())
-    
-    return parts
+def evict_request(request_id: str):
+    text_parts.pop(request_id, None)
+    request_speakers.pop(request_id, None)
+    for part_path in generated_parts.pop(request_id, []):
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+# Removes request state and its files after OUTPUT_TTL_SECONDS or past OUTPUT_QUOTA_MB
+janitor = RetentionJanitor(evict_request)
 
 # Function to generate an audio part with error handling
-def generate_audio_part(text: str, speaker_wav: str, file_path: str):
+def generate_audio_part(text: str, speaker_wav: str, file_path: str, request_id: str):
     try:
-        tts_model.tts_to_file(
-            text=text,
-            speaker_wav=speaker_wav,
-            language="ar",
-            file_path=file_path
-        )
+        gpt_cond_latent, speaker_embedding = speaker_cache.get_latents(tts_model, speaker_wav)
+        synthesize_to_file(tts_model, text, "ar", gpt_cond_latent, speaker_embedding, file_path)
+        parts = generated_parts.get(request_id)
+        if parts is not None:
+            parts.append(file_path)
+        if parts is None or not janitor.charge(request_id, os.path.getsize(file_path)):
+            # The request expired while this part rendered
+            os.remove(file_path)
     except Exception as e:
         print(f"Error generating audio for text '{text}': {e}")
         raise e
@@ -83,19 +83,20 @@ async def initialize_voice(tts_req: TTSRequest):
     text = tts_req.text  # Use raw text directly
     print(f"Original Text: {text}")
     
-    parts = split_text_by_sentences(text)
+    parts = segment_text(text)
     if not parts:
         raise HTTPException(status_code=400, detail="No valid text provided")
     
     request_id = str(uuid.uuid4())
     text_parts[request_id] = parts
     generated_parts[request_id] = []
+    request_speakers[request_id] = tts_req.speaker_wav
+    janitor.track(request_id)
 
     # Generate the first part immediately
     first_part_file = f"{request_id}_part1.wav"
     first_part_path = os.path.join("outputs", first_part_file)
-    generate_audio_part(parts[0], tts_req.speaker_wav, first_part_path)
-    generated_parts[request_id].append(first_part_path)
+    generate_audio_part(parts[0], tts_req.speaker_wav, first_part_path, request_id)
     
     response = {
         "request_id": request_id,
@@ -111,6 +112,7 @@ async def get_part(request_id: str, part_number: int, background_tasks: Backgrou
         raise HTTPException(status_code=404, detail="Request ID not found")
     
     parts = text_parts[request_id]
+    speaker_wav = request_speakers[request_id]
     if part_number > len(parts) or part_number < 1:
         raise HTTPException(status_code=404, detail="Part number out of range")
     
@@ -118,8 +120,7 @@ async def get_part(request_id: str, part_number: int, background_tasks: Backgrou
     part_path = os.path.join("outputs", part_file)
     
     if part_path not in generated_parts[request_id]:
-        generate_audio_part(parts[part_number - 1], "sounds/SpongBob.wav", part_path)
-        generated_parts[request_id].append(part_path)
+        generate_audio_part(parts[part_number - 1], speaker_wav, part_path, request_id)
     
     # Start generating the next part immediately
     next_part_number = part_number + 1
@@ -128,7 +129,7 @@ async def get_part(request_id: str, part_number: int, background_tasks: Backgrou
         next_part_path = os.path.join("outputs", next_part_file)
         if next_part_path not in generated_parts[request_id]:
             background_tasks.add_task(
-                generate_audio_part, parts[next_part_number - 1], "sounds/SpongBob.wav", next_part_path
+                generate_audio_part, parts[next_part_number - 1], speaker_wav, next_part_path, request_id
             )
     
     return {"part": part_number, "audio_file": f"/outputs/{part_file}"}
@@ -1,173 +1,247 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 import os
-import torch
-import uuid
-from TTS.api import TTS
-from TTS.tts.configs.xtts_config import XttsConfig
-from TTS.tts.models.xtts import XttsAudioConfig, XttsArgs
-from TTS.config.shared_configs import BaseDatasetConfig
 import logging
 import time
+from admission import AdmissionController
+from audio_cache import AudioCache
+from audio_codec import AUDIO_FORMATS, AUDIO_FORMAT, AUDIO_BITRATE_KBPS
+from audio_store import AudioStore
+from metrics import add_metrics_route
+from batching import BatchingEngine, BATCHING_ENABLED, BATCH_MAX_SIZE
+from pipeline import PipelinedSynthesizer, PIPELINE_ENABLED
+from profiling import RequestProfiler, add_profile_routes
+from quality import QualityController
+from request_manager import RequestManager, add_request_routes
+from scheduler import InferenceScheduler, INFERENCE_WORKERS, PRIORITY_FIRST_PART
+from segmenter import segment_text
+from speaker_cache import SpeakerLatentCache
+from speaker_registry import SpeakerRegistry, add_speaker_routes, resolve_speaker
+from state_store import create_state_store
+from tts_engine import Engine, add_health_routes
+from worker_pool import WorkerPool, WORKER_PROCESSES
+from xtts_inference import get_sample_rate, synthesize
 
 # Set up detailed logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-# Allowlist all required globals for PyTorch 2.6+
-torch.serialization.add_safe_globals([XttsConfig, XttsAudioConfig, BaseDatasetConfig, XttsArgs])
-logger.info("Added XttsConfig, XttsAudioConfig, BaseDatasetConfig, and XttsArgs to safe globals for torch.load")
-
 app = FastAPI()
-app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
-
-# Set device
-device = "cuda" if torch.cuda.is_available() else "cpu"
-logger.info(f"Using device: {device}")
-
-# Load TTS model
-tts_model = None
-try:
-    logger.info("Attempting to load TTS model...")
-    tts_model = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True).to(device)
-    logger.info("TTS model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load TTS model: {e}")
-    tts_model = None
+
+# Load TTS model through the shared engine; /healthz and /readyz report its state
+engine = Engine()
+logger.info(f"Using device: {engine.device}")
+
+# Optionally run chunk synthesis in pinned worker processes, each loading its own model. They
+# fork here, before this process loads the model or runs any torch op (see WorkerPool).
+worker_pool = WorkerPool(engine.model_version, model_name=engine.model_name, device=engine.device,
+                         precision=engine.precision) if WORKER_PROCESSES else None
+if worker_pool:
+    worker_pool.start()
+
+tts_model = engine.load()
+add_health_routes(app, engine)
+add_metrics_route(app)
+
+# Conditioning latents per reference voice, shared by all requests
+speaker_cache = SpeakerLatentCache(model_version=engine.model_version)
+
+# Synthesized chunks keyed by text, speaker, language and model; repeated prompts skip the model
+audio_cache = AudioCache(model_version=engine.model_version)
+
+# Request and part state; REQUEST_STATE_BACKEND=sqlite shares it between uvicorn workers
+state = create_state_store()
+
+# Encoded parts served from memory under /outputs, spilling to outputs/ past the memory budget.
+# With shared state every part goes to outputs/ so any worker can serve it.
+audio_store = AudioStore(spill_dir="outputs", shared=state.shared)
+
+# Optionally batch sentences across requests; scheduler workers then only wait on the batcher
+batcher = BatchingEngine(tts_model) if BATCHING_ENABLED and tts_model is not None and not worker_pool else None
+
+# Optionally overlap GPT decoding of one sentence with vocoding of the previous one
+pipeline = PipelinedSynthesizer(tts_model) if PIPELINE_ENABLED and tts_model is not None and not (worker_pool or batcher) else None
+
+# All synthesis goes through the scheduler; the event loop only awaits results
+scheduler_workers = INFERENCE_WORKERS
+if batcher:
+    scheduler_workers = max(INFERENCE_WORKERS, BATCH_MAX_SIZE)
+elif worker_pool:
+    scheduler_workers = max(INFERENCE_WORKERS, WORKER_PROCESSES)
+elif pipeline:
+    # At least two parts in flight, so the next part's GPT stage can start during this one's vocoder.
+    # Streams and warm-up on the other scheduler threads share the model's GPT lock with the pipeline.
+    scheduler_workers = max(INFERENCE_WORKERS, 2)
+# Wait estimates divide queued work by what really decodes at once, not by the thread count: each
+# worker process has its own model, a batch decodes its sentences together, and otherwise every
+# thread takes turns on the one model's GPT lock
+if worker_pool:
+    parallelism = worker_pool.alive_workers
+elif batcher:
+    parallelism = batcher.mean_batch_size
+else:
+    parallelism = 1
+scheduler = InferenceScheduler(num_workers=scheduler_workers, parallelism=parallelism)
+
+# Rejects new requests with 429 once the estimated wait for their first audio is over budget
+admission = AdmissionController(scheduler)
+
+# Steps new requests down to cheaper quality tiers while the server is overloaded
+quality = QualityController(scheduler, admission)
+
+# torch.profiler captures of flagged or sampled requests, listed and downloaded under /profiles
+profiler = RequestProfiler()
+add_profile_routes(app, profiler)
+
+@app.on_event("startup")
+async def start_scheduler():
+    if batcher:
+        batcher.start()
+    if pipeline:
+        pipeline.start()
+    scheduler.start()
+    request_manager.janitor.start()
+    if tts_model is not None:
+        # Warm up on a model worker; /readyz flips once it has run
+        warm_up_fn = worker_pool.wait_ready if worker_pool else None
+        scheduler.submit(engine.warm_up, speaker_cache, warm_up_fn, priority=PRIORITY_FIRST_PART)
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    request_manager.janitor.stop()
+    scheduler.stop()
+    if batcher:
+        batcher.stop()
+    if pipeline:
+        pipeline.stop()
+    if worker_pool:
+        worker_pool.stop()
+
+# Uploaded reference voices; requests pick one by speaker_id
+speaker_registry = SpeakerRegistry()
+add_speaker_routes(
+    app, speaker_registry,
+    # First-part priority: the upload waits on this, and would otherwise queue behind every pending part
+    lambda path: scheduler.submit(speaker_cache.get_latents, tts_model, path, priority=PRIORITY_FIRST_PART),
+    speaker_cache.discard,
+)
 
 class TTSRequest(BaseModel):
     text: str
-    speaker_wav: str
+    speaker_id: Optional[str] = None
+    speaker_wav: Optional[str] = None
 
-text_parts = {}
-generated_parts = {}
-request_timestamps = {}
-CLEANUP_THRESHOLD = 3600  # 1 hour
+AUDIO_BASE_URL = os.environ.get("AUDIO_BASE_URL", "http://172.20.10.7:8001/outputs")
 
-def split_text_by_sentences(text: str, max_length: int = 500) -> list:
-    try:
-        sentences = text.split('.')
-        parts = []
-        current_part = ""
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if sentence and len(current_part) + len(sentence) + 1 <= max_length:
-                current_part += sentence + '.'
-            else:
-                if current_part:
-                    parts.append(current_part.strip())
-                current_part = sentence + '.' if sentence else ""
-        if current_part:
-            parts.append(current_part.strip())
-        logger.info(f"Text split into {len(parts)} parts")
-        return parts
-    except Exception as e:
-        logger.error(f"Error splitting text: {e}")
-        raise
+def render_chunk(text: str, speaker_wav: str, speaker_key: str, tier=None):
+    latents = None if worker_pool else speaker_cache.get_latents(tts_model, speaker_wav)
+    start = time.perf_counter()
+    if worker_pool:
+        wav = worker_pool.synthesize(text, "ar", speaker_wav, tier)
+    elif batcher:
+        wav = batcher.synthesize(text, "ar", speaker_key, latents, tier)
+    elif pipeline:
+        wav = pipeline.synthesize(text, "ar", latents, tier)
+    else:
+        wav = synthesize(tts_model, text, "ar", *latents, tier=tier)
+    request_manager.observe_render(text, time.perf_counter() - start, wav)
+    return wav
 
-def generate_audio_part(text: str, speaker_wav: str, file_path: str, request_id: str, part_num: int):
-    try:
-        logger.info(f"Generating part {part_num} for {request_id} at {file_path}")
-        tts_model.tts_to_file(
-            text=text,
-            speaker_wav=speaker_wav,
-            language="ar",
-            file_path=file_path
-        )
-        if request_id in generated_parts:
-            generated_parts[request_id].add(file_path)
-    except Exception as e:
-        logger.error(f"Error generating part {part_num} for {request_id}: {e}")
-        raise
+# Request lifecycle, part events, prefetch, stitching and expiry; parts are served under /outputs
+request_manager = RequestManager(tts_model, scheduler, state, audio_store, admission, quality, profiler, speaker_cache,
+                                 AUDIO_BASE_URL, render=render_chunk, audio_cache=audio_cache)
+add_request_routes(app, request_manager, "/outputs")
 
 @app.post("/initialize-voice")
-async def initialize_voice(tts_req: TTSRequest, background_tasks: BackgroundTasks):
+async def initialize_voice(tts_req: TTSRequest, audio_format: str = AUDIO_FORMAT, bitrate: int = AUDIO_BITRATE_KBPS,
+                           prefetch_parts: Optional[int] = None, quality_tier: Optional[str] = Query(None, alias="quality"),
+                           profile: bool = False):
+    # prefetch_parts: render at least this many parts ahead of the client's playback position
+    # (more when rendering is slow or the queue is long); 0 renders every part up front.
+    # quality: full, balanced or fast; under load the request may get a lower tier than asked.
+    # profile: trace the first PROFILE_MAX_PARTS parts into /profiles/<request_id>, subject to the profiler's rate limit.
     try:
         if tts_model is None:
             logger.error("TTS model is not loaded")
             raise HTTPException(status_code=500, detail="TTS model not loaded")
         
-        if not os.path.exists(tts_req.speaker_wav):
-            logger.error(f"Speaker WAV file {tts_req.speaker_wav} not found")
-            raise HTTPException(status_code=400, detail="Speaker WAV file not found")
+        if audio_format not in AUDIO_FORMATS:
+            raise HTTPException(status_code=400, detail=f"audio_format must be one of {', '.join(AUDIO_FORMATS)}")
+        
+        speaker_wav = resolve_speaker(speaker_registry, tts_req.speaker_id, tts_req.speaker_wav)
         
         text = tts_req.text
         logger.info(f"Original Text: {text}")
         
-        parts = split_text_by_sentences(text)
+        parts = segment_text(text)
+        logger.info(f"Text split into {len(parts)} parts")
         if not parts:
             logger.error("No valid text provided")
             raise HTTPException(status_code=400, detail="No valid text provided")
-        
-        request_id = str(uuid.uuid4())
-        text_parts[request_id] = parts
-        generated_parts[request_id] = set()
-        request_timestamps[request_id] = time.time()
-        
-        os.makedirs("outputs", exist_ok=True)
-        logger.info(f"Created outputs directory for {request_id}")
-        
-        first_part_file = f"{request_id}_part1.wav"
-        first_part_path = os.path.join("outputs", first_part_file)
-        logger.info(f"Starting synchronous generation of part 1 for {request_id}")
-        generate_audio_part(parts[0], tts_req.speaker_wav, first_part_path, request_id, 1)
-        generated_parts[request_id].add(first_part_path)
-        
-        for i, part_text in enumerate(parts[1:], 2):
-            part_file = f"{request_id}_part{i}.wav"
-            part_path = os.path.join("outputs", part_file)
-            logger.info(f"Queuing part {i} for {request_id}")
-            background_tasks.add_task(generate_audio_part, part_text, tts_req.speaker_wav, part_path, request_id, i)
-        
-        background_tasks.add_task(cleanup_old_requests)
-        
-        logger.info(f"Initialized request {request_id} with {len(parts)} parts")
-        return {
-            "request_id": request_id,
-            "total_parts": len(parts)
-        }
+        return await request_manager.start_request(parts, speaker_wav, audio_format, bitrate, prefetch_parts, quality_tier, profile)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in initialize_voice: {e}")
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
-@app.get("/part-status/{request_id}/{part_number}")
-async def part_status(request_id: str, part_number: int):
+@app.post("/stream-voice")
+async def stream_voice(tts_req: TTSRequest, audio_format: str = "wav", quality_tier: Optional[str] = Query(None, alias="quality")):
+    # quality picks the tier's sampling settings; the stream itself always stays at the model's rate
     try:
-        if request_id not in text_parts:
-            logger.error(f"Request ID {request_id} not found")
-            raise HTTPException(status_code=404, detail="Request ID not found")
-        if part_number > len(text_parts[request_id]) or part_number < 1:
-            logger.error(f"Part number {part_number} out of range for {request_id}")
-            raise HTTPException(status_code=404, detail="Part number out of range")
+        if tts_model is None:
+            logger.error("TTS model is not loaded")
+            raise HTTPException(status_code=500, detail="TTS model not loaded")
+        if audio_format not in ("wav", "pcm"):
+            raise HTTPException(status_code=400, detail="audio_format must be 'wav' or 'pcm'")
+        speaker_wav = resolve_speaker(speaker_registry, tts_req.speaker_id, tts_req.speaker_wav)
+        if not tts_req.text.strip():
+            raise HTTPException(status_code=400, detail="No valid text provided")
         
-        part_file = f"{request_id}_part{part_number}.wav"
-        part_path = os.path.join("outputs", part_file)
-        if part_path in generated_parts.get(request_id, set()):
-            logger.info(f"Part {part_number} for {request_id} is ready")
-            return {"status": "done", "audio_url": f"http://172.20.10.7:8001/outputs/{part_file}"}
-        logger.info(f"Part {part_number} for {request_id} is still pending")
-        return {"status": "pending"}
+        chunks = request_manager.start_stream(tts_req.text, speaker_wav, quality_tier)
+        sample_rate = get_sample_rate(tts_model)
+        media_type = "audio/wav" if audio_format == "wav" else f"audio/L16;rate={sample_rate};channels=1"
+        logger.info(f"Streaming {len(tts_req.text)} characters as {audio_format}")
+        return StreamingResponse(request_manager.encode_stream(chunks, audio_format), media_type=media_type)
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in part_status: {e}")
+        logger.error(f"Error in stream_voice: {e}")
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
 
-async def cleanup_old_requests():
-    current_time = time.time()
-    for req_id in list(request_timestamps.keys()):
-        if current_time - request_timestamps[req_id] > CLEANUP_THRESHOLD:
-            logger.info(f"Cleaning up old request {req_id}")
-            if req_id in text_parts:
-                del text_parts[req_id]
-            if req_id in generated_parts:
-                del generated_parts[req_id]
-            if req_id in request_timestamps:
-                del request_timestamps[req_id]
-            for i in range(1, 100):
-                part_file = f"{req_id}_part{i}.wav"
-                part_path = os.path.join("outputs", part_file)
-                if os.path.exists(part_path):
-                    os.remove(part_path)
+@app.get("/cache-stats")
+async def cache_stats():
+    return {
+        "audio": audio_cache.stats(),
+        "audio_store": audio_store.stats(),
+        "retention": request_manager.janitor.stats(),
+        "prefetch": request_manager.prefetch.stats(),
+        "speaker_latents": {"entries": len(speaker_cache.latents), "hits": speaker_cache.hits, "misses": speaker_cache.misses,
+                            "coalesced": speaker_cache.coalesced},
+    }
+
+@app.get("/batch-stats")
+async def batch_stats():
+    if batcher is None:
+        return {"enabled": False, "admission": admission.stats(), "quality": quality.stats()}
+    return {
+        "enabled": True, "max_batch_size": batcher.max_batch_size, **batcher.stats(),
+        "admission": admission.stats(), "quality": quality.stats(),
+    }
+
+@app.get("/worker-stats")
+async def worker_stats():
+    if worker_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, "degraded": worker_pool.degraded, **worker_pool.stats()}
+
+@app.get("/pipeline-stats")
+async def pipeline_stats():
+    if pipeline is None:
+        return {"enabled": False}
+    return {"enabled": True, **pipeline.stats()}
 
 if __name__ == "__main__":
     import uvicorn
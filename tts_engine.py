@@ -0,0 +1,144 @@
+from fastapi.responses import JSONResponse
+import logging
+import os
+import tempfile
+import threading
+import numpy as np
+from scipy.io import wavfile
+import torch
+from TTS import __version__ as TTS_VERSION
+from TTS.api import TTS
+from TTS.tts.configs.xtts_config import XttsConfig
+from TTS.tts.models.xtts import XttsAudioConfig, XttsArgs
+from TTS.config.shared_configs import BaseDatasetConfig
+from metrics import instrument_model
+from model_snapshot import MODEL_SNAPSHOT_DIR, has_snapshot, load_snapshot
+from precision import TTS_PRECISION, apply_precision
+from xtts_inference import compute_conditioning_latents, synthesize
+
+logger = logging.getLogger(__name__)
+
+# Allowlist all required globals for PyTorch 2.6+
+torch.serialization.add_safe_globals([XttsConfig, XttsAudioConfig, BaseDatasetConfig, XttsArgs])
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+# "stub" serves a deterministic stand-in model (stub_tts.py) for benchmarks without XTTS
+TTS_BACKEND = os.environ.get("TTS_BACKEND", "xtts")
+WARMUP_SPEAKER_WAV = os.environ.get("WARMUP_SPEAKER_WAV", "sounds/sound4.wav")
+WARMUP_TEXT = os.environ.get("WARMUP_TEXT", "مرحبا، هذا اختبار قصير.")
+
+# Process-wide models keyed by (model_name, device, precision)
+models = {}
+models_lock = threading.Lock()
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def model_version(model_name: str = MODEL_NAME, precision: str = TTS_PRECISION) -> str:
+    # Cache keys must change with anything that changes the audio, precision included
+    if TTS_BACKEND == "stub":
+        return f"stub@{TTS_VERSION}"
+    version = f"{model_name}@{TTS_VERSION}"
+    return version if precision == "fp32" else f"{version}+{precision}"
+
+def get_model(model_name: str = MODEL_NAME, device: str = None, progress_bar: bool = True, precision: str = TTS_PRECISION):
+    device = device or default_device()
+    with models_lock:
+        key = (model_name, device, precision)
+        if key not in models:
+            if TTS_BACKEND == "stub":
+                from stub_tts import StubTTS
+                logger.warning("TTS_BACKEND=stub, serving the stand-in model")
+                models[key] = StubTTS()
+                return models[key]
+            if has_snapshot(model_name):
+                # Memory-mapped export from model_snapshot.py; no model manager or torch.load
+                logger.info(f"Loading TTS model {model_name} from {MODEL_SNAPSHOT_DIR} on {device} ({precision})...")
+                model = load_snapshot(MODEL_SNAPSHOT_DIR, device)
+            else:
+                logger.info(f"Loading TTS model {model_name} on {device} ({precision})...")
+                model = TTS(model_name=model_name, progress_bar=progress_bar).to(device)
+            apply_precision(model, precision)
+            instrument_model(model)
+            models[key] = model
+            logger.info("TTS model loaded successfully")
+        return models[key]
+
+def warm_up(tts_model, speaker_wav: str = WARMUP_SPEAKER_WAV, speaker_cache=None, language: str = "ar"):
+    # One short synthesis so the first real request doesn't pay for lazy init and allocator growth
+    tmp_path = None
+    if not os.path.exists(speaker_wav):
+        logger.warning(f"Warm-up speaker {speaker_wav} not found, using a synthetic reference")
+        sample_rate = 22050
+        t = np.arange(3 * sample_rate) / sample_rate
+        tone = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.01 * np.random.randn(len(t))
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
+            tmp_path = f.name
+        wavfile.write(tmp_path, sample_rate, (tone * 32767).astype(np.int16))
+        speaker_wav = tmp_path
+    try:
+        if speaker_cache is not None and tmp_path is None:
+            latents = speaker_cache.get_latents(tts_model, speaker_wav)
+        else:
+            latents = compute_conditioning_latents(tts_model, speaker_wav)
+        synthesize(tts_model, WARMUP_TEXT, language, *latents)
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+class Engine:
+    # Lifecycle of the serving model: loading -> loaded -> warming -> ready, or failed
+
+    def __init__(self, model_name: str = MODEL_NAME, device: str = None, precision: str = TTS_PRECISION):
+        self.model_name = model_name
+        self.device = device or default_device()
+        self.precision = precision
+        self.model_version = model_version(model_name, precision)
+        self.model = None
+        self.state = "starting"
+        self.error = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load(self):
+        self.state = "loading"
+        try:
+            self.model = get_model(self.model_name, self.device, precision=self.precision)
+            self.state = "loaded"
+        except Exception as e:
+            logger.error(f"Failed to load TTS model: {e}")
+            self.state = "failed"
+            self.error = str(e)
+        return self.model
+
+    def warm_up(self, speaker_cache=None, warm_up_fn=None):
+        # warm_up_fn replaces the in-process warm-up, e.g. waiting for worker processes
+        if self.model is None:
+            return
+        self.state = "warming"
+        try:
+            logger.info("Warming up TTS model...")
+            if warm_up_fn is not None:
+                warm_up_fn()
+            else:
+                warm_up(self.model, speaker_cache=speaker_cache)
+            logger.info("TTS model warm")
+        except Exception as e:
+            # A cold model still serves; warm-up only moves first-request cost to startup
+            logger.error(f"Warm-up failed: {e}")
+        self.state = "ready"
+
+def add_health_routes(app, engine: Engine):
+    @app.get("/healthz")
+    async def healthz():
+        # Liveness: the process is up, even if the model is still loading
+        status_code = 500 if engine.state == "failed" else 200
+        return JSONResponse({"status": engine.state, "error": engine.error}, status_code=status_code)
+
+    @app.get("/readyz")
+    async def readyz():
+        # Readiness: only route traffic to replicas with a warm model
+        status_code = 200 if engine.ready else 503
+        return JSONResponse({"ready": engine.ready, "status": engine.state}, status_code=status_code)
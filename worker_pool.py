@@ -0,0 +1,243 @@
+from collections import deque
+from concurrent.futures import Future
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import torch
+from precision import TTS_PRECISION
+from speaker_cache import SpeakerLatentCache
+from tts_engine import MODEL_NAME, get_model, warm_up
+from xtts_inference import get_sample_rate, synthesize
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps inference in the API process
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))
+# Longest wait for the workers to finish warming up before the API reports ready anyway
+WORKER_READY_TIMEOUT_SECONDS = float(os.environ.get("WORKER_READY_TIMEOUT_SECONDS", "600"))
+# How often the dispatcher checks for workers that died (OOM kill, segfault)
+WORKER_CHECK_INTERVAL_SECONDS = float(os.environ.get("WORKER_CHECK_INTERVAL_SECONDS", "1"))
+
+class WorkerDiedError(RuntimeError):
+    pass
+
+def core_slices(num_workers: int, cores: list = None) -> list:
+    # Disjoint, equally sized CPU sets, one per worker
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    per_worker = max(len(cores) // num_workers, 1)
+    return [cores[i * per_worker:(i + 1) * per_worker] or cores for i in range(num_workers)]
+
+def worker_main(worker_id: int, model_name: str, device: str, precision: str, model_version: str, cores: list, tasks, results):
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    try:
+        tts_model = get_model(model_name, device, progress_bar=False, precision=precision)
+    except Exception as e:
+        # Exiting makes the parent count this worker as dead
+        logger.error(f"Worker {worker_id} failed to load the model: {e}")
+        return
+    speaker_cache = SpeakerLatentCache(model_version=model_version)
+    try:
+        warm_up(tts_model, speaker_cache=speaker_cache)
+    except Exception as e:
+        logger.error(f"Worker {worker_id} warm-up failed: {e}")
+    # The ready message carries the model's sample rate in the audio slot
+    results.put((worker_id, "ready", get_sample_rate(tts_model), None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, text, language, speaker_wav, tier = task
+        try:
+            latents = speaker_cache.get_latents(tts_model, speaker_wav)
+            results.put((worker_id, job_id, synthesize(tts_model, text, language, *latents, tier=tier), None))
+        except Exception as e:
+            results.put((worker_id, job_id, None, f"{type(e).__name__}: {e}"))
+
+class WorkerPool:
+    # N forked inference processes, each pinned to its own cores and loading its own model.
+    # Start the pool before the parent loads a model or runs any torch op: forking after
+    # torch's OpenMP pool is up can deadlock the children. Workers loading the memory-mapped
+    # snapshot (model_snapshot.py) share its weight pages through the page cache; from the
+    # model manager's checkpoint each worker holds a full copy.
+    # Jobs wait in the parent and are handed to one idle worker at a time through that
+    # worker's own queue, so the parent always knows which job a worker holds. A worker that
+    # dies fails its job with WorkerDiedError and is not replaced (by then the parent may have
+    # run inference, and forking it is the deadlock above); the pool serves on with the rest,
+    # and with none left every job fails at once instead of hanging.
+
+    def __init__(self, model_version: str, num_workers: int = WORKER_PROCESSES, model_name: str = MODEL_NAME,
+                 device: str = None, precision: str = TTS_PRECISION):
+        self.model_version = model_version
+        self.model_name = model_name
+        self.device = device
+        self.precision = precision
+        self.num_workers = num_workers
+        # Output rate of the workers' model, reported with their ready message
+        self.sample_rate = None
+        self.processes = []
+        self.task_queues = []
+        self.pending = {}
+        # Jobs not yet handed to a worker, (job_id, task)
+        self.backlog = deque()
+        # worker_id -> job_id it is running, for idle workers None
+        self.assigned = {}
+        self.idle = set()
+        self.dead = set()
+        self.pending_lock = threading.Lock()
+        self.job_ids = itertools.count()
+        self.ready_count = 0
+        self.ready_event = threading.Event()
+        self.stopping = False
+        self.dispatcher = None
+
+    def start(self):
+        ctx = mp.get_context("fork")
+        self.results = ctx.Queue()
+        for i, cores in enumerate(core_slices(self.num_workers)):
+            tasks = ctx.Queue()
+            process = ctx.Process(
+                target=worker_main,
+                args=(i, self.model_name, self.device, self.precision, self.model_version, cores, tasks, self.results),
+                name=f"tts-worker-{i}",
+                daemon=True,
+            )
+            process.start()
+            self.task_queues.append(tasks)
+            self.processes.append(process)
+            logger.info(f"Started TTS worker {i} (pid {process.pid}) on cores {cores}")
+        self.dispatcher = threading.Thread(target=self.dispatch_results, name="worker-pool-results", daemon=True)
+        self.dispatcher.start()
+
+    def stop(self):
+        # Workers exiting from here on are not deaths
+        self.stopping = True
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        if self.dispatcher is not None:
+            self.results.put(None)
+            self.dispatcher.join()
+            self.dispatcher = None
+        self.processes = []
+        self.task_queues = []
+
+    def wait_ready(self, timeout: float = WORKER_READY_TIMEOUT_SECONDS) -> bool:
+        # True once every worker is warm or dead with at least one warm
+        ready = self.ready_event.wait(timeout)
+        if not ready:
+            logger.error(f"TTS workers not ready after {timeout:.0f}s ({self.ready_count}/{self.num_workers} warm)")
+        return ready and self.alive_workers() > 0
+
+    def alive_workers(self) -> int:
+        with self.pending_lock:
+            return self.num_workers - len(self.dead)
+
+    @property
+    def degraded(self) -> bool:
+        return bool(self.dead)
+
+    def stats(self) -> dict:
+        with self.pending_lock:
+            return {
+                "workers": self.num_workers,
+                "ready": self.ready_count,
+                "dead": sorted(self.dead),
+                "queued_jobs": len(self.backlog),
+            }
+
+    def submit(self, text: str, language: str, speaker_wav: str, tier=None) -> Future:
+        future = Future()
+        job_id = next(self.job_ids)
+        with self.pending_lock:
+            if len(self.dead) == self.num_workers:
+                future.set_exception(WorkerDiedError("All TTS workers have died"))
+                return future
+            self.pending[job_id] = future
+            self.backlog.append((job_id, (job_id, text, language, speaker_wav, tier)))
+            self.assign()
+        return future
+
+    def synthesize(self, text: str, language: str, speaker_wav: str, tier=None):
+        return self.submit(text, language, speaker_wav, tier).result()
+
+    def assign(self):
+        # Under pending_lock: hand waiting jobs to idle workers
+        while self.idle and self.backlog:
+            worker_id = self.idle.pop()
+            job_id, task = self.backlog.popleft()
+            self.assigned[worker_id] = job_id
+            self.task_queues[worker_id].put(task)
+
+    def dispatch_results(self):
+        next_check = time.monotonic() + WORKER_CHECK_INTERVAL_SECONDS
+        while True:
+            try:
+                message = self.results.get(timeout=WORKER_CHECK_INTERVAL_SECONDS)
+            except queue.Empty:
+                message = False
+            if message is None:
+                break
+            if message:
+                self.handle_result(*message)
+            if time.monotonic() >= next_check:
+                self.check_workers()
+                next_check = time.monotonic() + WORKER_CHECK_INTERVAL_SECONDS
+
+    def handle_result(self, worker_id: int, job_id, wav, error):
+        with self.pending_lock:
+            if job_id == "ready":
+                self.ready_count += 1
+                self.sample_rate = wav
+                future = None
+            else:
+                self.assigned[worker_id] = None
+                future = self.pending.pop(job_id, None)
+            if worker_id not in self.dead:
+                self.idle.add(worker_id)
+                self.assign()
+            self.update_ready()
+        if job_id == "ready":
+            return
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(wav)
+
+    def update_ready(self):
+        # Under pending_lock
+        if not self.ready_event.is_set() and self.ready_count + len(self.dead) >= self.num_workers:
+            logger.info(f"TTS workers ready ({self.ready_count} warm, {len(self.dead)} dead)")
+            self.ready_event.set()
+
+    def check_workers(self):
+        if self.stopping:
+            return
+        failed = []
+        with self.pending_lock:
+            for worker_id, process in enumerate(self.processes):
+                if worker_id in self.dead or process.is_alive():
+                    continue
+                self.dead.add(worker_id)
+                self.idle.discard(worker_id)
+                logger.error(f"TTS worker {worker_id} (pid {process.pid}) died with exit code {process.exitcode}")
+                job_id = self.assigned.pop(worker_id, None)
+                if job_id is not None and job_id in self.pending:
+                    failed.append((self.pending.pop(job_id), f"TTS worker {worker_id} died with exit code {process.exitcode}"))
+            if self.dead and len(self.dead) == self.num_workers:
+                while self.backlog:
+                    job_id, _ = self.backlog.popleft()
+                    if job_id in self.pending:
+                        failed.append((self.pending.pop(job_id), "All TTS workers have died"))
+            self.update_ready()
+        for future, error in failed:
+            future.set_exception(WorkerDiedError(error))
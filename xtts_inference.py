@@ -0,0 +1,211 @@
+import contextlib
+import numpy as np
+import logging
+import os
+import threading
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from segmenter import split_for_model
+
+logger = logging.getLogger(__name__)
+
+# Silence inserted between sentences, same as TTS.utils.synthesizer.Synthesizer.tts
+SENTENCE_SILENCE_SAMPLES = 10000
+# GPT tokens decoded before each streamed vocoder pass (~45 ms of audio per token)
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", "8"))
+
+def get_xtts(tts_model):
+    # The underlying Xtts instance wrapped by TTS.api.TTS
+    return tts_model.synthesizer.tts_model
+
+def get_sample_rate(tts_model) -> int:
+    return tts_model.synthesizer.output_sample_rate
+
+# Guards creation of the per-model GPT locks
+gpt_locks_lock = threading.Lock()
+
+def gpt_lock(tts_model):
+    # GPT.compute_embeddings stores the conditioning prefix on the shared gpt_inference module
+    # (store_prefix_emb), so two generations at once decode with each other's text and voice.
+    # Every GPT generate on a model holds this lock; conditioning and the vocoder don't need it.
+    xtts = get_xtts(tts_model)
+    if not hasattr(xtts, "gpt"):
+        # Stub backend, no shared decoding state
+        return contextlib.nullcontext()
+    with gpt_locks_lock:
+        if getattr(xtts, "gpt_lock", None) is None:
+            xtts.gpt_lock = threading.RLock()
+        return xtts.gpt_lock
+
+def generation_settings(tts_model, tier=None) -> dict:
+    # Same tuning knobs Xtts.inference_with_config reads from the model config, with a
+    # quality.QualityTier's overrides on top
+    config = get_xtts(tts_model).config
+    settings = {
+        "temperature": config.temperature,
+        "length_penalty": config.length_penalty,
+        "repetition_penalty": config.repetition_penalty,
+        "top_k": config.top_k,
+        "top_p": config.top_p,
+    }
+    if tier is not None:
+        for name in ("temperature", "length_penalty", "top_k", "top_p"):
+            if getattr(tier, name) is not None:
+                settings[name] = getattr(tier, name)
+        if tier.max_gpt_tokens is not None:
+            # Passed through to HF generate, where it takes precedence over GPT's max_length
+            settings["max_new_tokens"] = tier.max_gpt_tokens
+    return settings
+
+def char_limit(tts_model, language: str) -> int:
+    return get_xtts(tts_model).tokenizer.char_limits.get(language.split("-")[0], 250)
+
+def split_sentences(tts_model, text: str, language: str) -> list:
+    # Pieces that each fit one Xtts.inference call, split on Arabic and Latin punctuation
+    return split_for_model(text, char_limit(tts_model, language))
+
+def compute_conditioning_latents(tts_model, speaker_wav: str):
+    xtts = get_xtts(tts_model)
+    config = xtts.config
+    # Labelled for profiling.py, like the gpt_decode and vocoder stages in metrics.instrument_model
+    with torch.profiler.record_function("conditioning"):
+        return xtts.get_conditioning_latents(
+            audio_path=speaker_wav,
+            gpt_cond_len=config.gpt_cond_len,
+            gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+            max_ref_length=config.max_ref_len,
+            sound_norm_refs=config.sound_norm_refs,
+        )
+
+def join_sentence_wavs(wavs: list) -> np.ndarray:
+    if not wavs:
+        return np.zeros(0, dtype=np.float32)
+    silence = np.zeros(SENTENCE_SILENCE_SAMPLES, dtype=np.float32)
+    joined = [wavs[0]]
+    for wav in wavs[1:]:
+        joined += [silence, wav]
+    return np.concatenate(joined)
+
+def synthesize(tts_model, text: str, language: str, gpt_cond_latent, speaker_embedding, tier=None) -> np.ndarray:
+    # Equivalent of tts_to_file(..., speaker_wav=...) but with precomputed latents
+    xtts = get_xtts(tts_model)
+    settings = generation_settings(tts_model, tier)
+    wavs = []
+    for sentence in split_sentences(tts_model, text, language):
+        with gpt_lock(tts_model):
+            out = xtts.inference(sentence, language, gpt_cond_latent, speaker_embedding, **settings)
+        wavs.append(np.asarray(out["wav"], dtype=np.float32))
+    return join_sentence_wavs(wavs)
+
+@torch.inference_mode()
+def generate_latents(tts_model, sentence: str, language: str, gpt_cond_latent, tier=None):
+    # GPT half of Xtts.inference: one sentence to the latents the vocoder decodes
+    xtts = get_xtts(tts_model)
+    gpt = xtts.gpt
+    device = xtts.device
+    gpt_cond_latent = gpt_cond_latent.to(device)
+    language = language.split("-")[0]
+    text_tokens = torch.IntTensor(xtts.tokenizer.encode(sentence.strip().lower(), lang=language)).unsqueeze(0).to(device)
+    # Shared with streams and warm-up on scheduler threads; the latent pass below doesn't use the prefix cache
+    with gpt_lock(tts_model):
+        gpt_codes = gpt.generate(
+            cond_latents=gpt_cond_latent,
+            text_inputs=text_tokens,
+            input_tokens=None,
+            do_sample=True,
+            num_return_sequences=1,
+            num_beams=1,
+            output_attentions=False,
+            **generation_settings(tts_model, tier),
+        )
+    expected_output_len = torch.tensor([gpt_codes.shape[-1] * gpt.code_stride_len], device=device)
+    text_len = torch.tensor([text_tokens.shape[-1]], device=device)
+    return gpt(
+        text_tokens,
+        text_len,
+        gpt_codes,
+        expected_output_len,
+        cond_latents=gpt_cond_latent,
+        return_attentions=False,
+        return_latent=True,
+    )
+
+@torch.inference_mode()
+def vocode(tts_model, gpt_latents, speaker_embedding) -> np.ndarray:
+    # HiFi-GAN half of Xtts.inference
+    xtts = get_xtts(tts_model)
+    wav = xtts.hifigan_decoder(gpt_latents, g=speaker_embedding.to(xtts.device))
+    return wav.cpu().squeeze().numpy().astype(np.float32)
+
+def stream_synthesize(tts_model, text: str, language: str, gpt_cond_latent, speaker_embedding,
+                      stream_chunk_size: int = STREAM_CHUNK_SIZE, tier=None):
+    # Yields float32 chunks as Xtts.inference_stream decodes them, across sentence boundaries
+    xtts = get_xtts(tts_model)
+    settings = generation_settings(tts_model, tier)
+    for i, sentence in enumerate(split_sentences(tts_model, text, language)):
+        if i:
+            yield np.zeros(SENTENCE_SILENCE_SAMPLES, dtype=np.float32)
+        # inference_stream interleaves decoding steps with vocoding, so the lock is held for the
+        # whole sentence; a consumer that stops early releases it when the generator is closed
+        with gpt_lock(tts_model):
+            for chunk in xtts.inference_stream(
+                sentence, language, gpt_cond_latent, speaker_embedding, stream_chunk_size=stream_chunk_size, **settings
+            ):
+                yield chunk.cpu().numpy().astype(np.float32)
+
+@torch.inference_mode()
+def inference_batch(tts_model, sentences: list, language: str, gpt_cond_latent, speaker_embedding, tier=None) -> list:
+    # Batched version of Xtts.inference for sentences sharing one speaker and language.
+    # Text tokens are right-padded with the stop token, so rows of very different
+    # lengths decode slightly differently than they would alone; callers should
+    # keep batches to similar lengths (BatchingEngine buckets by token count).
+    xtts = get_xtts(tts_model)
+    gpt = xtts.gpt
+    device = xtts.device
+    settings = generation_settings(tts_model, tier)
+    language = language.split("-")[0]
+    tokens = [torch.IntTensor(xtts.tokenizer.encode(s.strip().lower(), lang=language)) for s in sentences]
+    text_tokens = pad_sequence(tokens, batch_first=True, padding_value=gpt.stop_text_token).to(device)
+    text_lens = torch.tensor([len(t) for t in tokens], device=device)
+    batch_size = len(sentences)
+    cond_latents = gpt_cond_latent.to(device).expand(batch_size, -1, -1)
+
+    with gpt_lock(tts_model):
+        gpt_codes = gpt.generate(
+            cond_latents=cond_latents,
+            text_inputs=text_tokens,
+            input_tokens=None,
+            do_sample=True,
+            num_return_sequences=1,
+            num_beams=1,
+            output_attentions=False,
+            **settings,
+        )
+    # Finished rows are padded with the stop token; keep each row up to and including its first stop
+    code_lens = []
+    for row in gpt_codes:
+        stops = (row == gpt.stop_audio_token).nonzero()
+        code_lens.append(int(stops[0]) + 1 if len(stops) else row.shape[-1])
+    wav_lens = torch.tensor([n * gpt.code_stride_len for n in code_lens], device=device)
+    gpt_latents = gpt(
+        text_tokens,
+        text_lens,
+        gpt_codes,
+        wav_lens,
+        cond_latents=cond_latents,
+        return_attentions=False,
+        return_latent=True,
+    )
+
+    # One padded vocoder pass, then trim each row back to its own length
+    max_len = max(code_lens)
+    latents = gpt_latents[:, :max_len]
+    wavs = xtts.hifigan_decoder(latents, g=speaker_embedding.to(device).expand(batch_size, -1, -1)).cpu()
+    wavs = wavs.reshape(batch_size, -1)
+    samples_per_latent = wavs.shape[-1] // max(latents.shape[1], 1)
+    return [wavs[i, : code_lens[i] * samples_per_latent].numpy().astype(np.float32) for i in range(batch_size)]
+
+def synthesize_to_file(tts_model, text: str, language: str, gpt_cond_latent, speaker_embedding, file_path: str) -> np.ndarray:
+    wav = synthesize(tts_model, text, language, gpt_cond_latent, speaker_embedding)
+    tts_model.synthesizer.save_wav(wav, file_path)
+    return wav